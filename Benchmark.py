@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the sampling, the model setup, the clean-out of the
+compartments, the simulation, the post-processing of the case study and the
+export calculation on synthetic databases (see SyntheticDatabase) of several
+sizes. The time and the peak memory allocated by each step are written into
+a json file, that can be compared with the file of an earlier version
+
+"""
+
+# import necessary packages
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import runpy
+import numpy as np
+import numpy.random as nr
+
+import TruncatingFunctions as tr
+import setup_model_new as su
+import ModelGraph as mg
+import Statistics as st
+import ResultStore as rs
+import Reports as rp
+import SyntheticDatabase as sd
+from DatabaseLoader import ModelDatabase
+from dpmfa import simulator as sc
+
+# sizes of the synthetic models: flow compartments, years and runs
+TIERS = {"small":  {"compartments": 12, "years": 17, "runs": 100},
+         "medium": {"compartments": 30, "years": 40, "runs": 500},
+         "large":  {"compartments": 60, "years": 67, "runs": 2000}}
+
+# number of calls of TriangTrunc and TrapezTrunc per measurement
+CALLS = 100
+
+
+def measure(function, setup = None, repeat = 3, memory = True):
+    """
+    runs function repeat times (with the arguments returned by setup, called
+    before each run and not measured), returns the shortest and mean time in
+    seconds and, if memory, the peak memory allocated during one more run
+    (traced separately, since tracing slows the run down)
+    """
+    times = []
+    for r in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    result = {"seconds": min(times), "mean_seconds": float(np.mean(times)), "repeat": repeat}
+
+    if memory:
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        try:
+            function(*args)
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+def quiet(function):
+    """
+    function without console output
+    """
+    def run(*args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args)
+    return run
+
+def benchmarkTier(directory, compartments, years, runs, repeat = 3, memory = True, seed = 0):
+    """
+    runs all benchmarks on a synthetic database of this size (written into
+    directory), returns the results by step
+    """
+    startYear = 1950
+    endYear = startYear + years - 1
+    mat = "LDPE"
+
+    db = sd.writeDatabase(os.path.join(directory, "model.db"), compartments, years = (startYear, endYear),
+                          materials = (mat, "PP"), seed = seed)
+    results = {}
+
+    ### SAMPLING
+
+    results["TriangTrunc"] = measure(lambda: [tr.TriangTrunc(0.3, 0.4, runs, 0, 1) for i in range(CALLS)],
+                                     repeat = repeat, memory = memory)
+    results["TrapezTrunc"] = measure(lambda: [tr.TrapezTrunc(0.2, 0.4, 0.4, 0.3, runs, 0, 1) for i in range(CALLS)],
+                                     repeat = repeat, memory = memory)
+
+    ### MODEL SETUP
+
+    results["DatabaseLoad"] = measure(lambda: ModelDatabase(db, mat), repeat = repeat, memory = memory)
+
+    data = ModelDatabase(db, mat)
+    results["CleanOut"] = measure(lambda: mg.ReachableCompartments(data), repeat = repeat, memory = memory)
+
+    def setup():
+        nr.seed(seed)
+        return ()
+    build = quiet(lambda: su.setupModel(db, "Benchmark", runs, mat, startYear, endYear))
+    results["setupModel"] = measure(build, setup, repeat = repeat, memory = memory)
+
+    ### SIMULATION
+
+    def simulate():
+        simulator = sc.Simulator(runs, years, seed, True, True)
+        simulator.setModel(model)
+        simulator.runSimulation()
+        return simulator
+
+    nr.seed(seed)
+    model = build()
+    results["Simulation"] = measure(simulate, repeat = 1, memory = memory)
+
+    ### POST-PROCESSING OF THE CASE STUDY
+
+    simulator = simulate()
+    outputdir = os.path.join(directory, "output")
+    os.makedirs(outputdir, exist_ok = True)
+    xScale = np.arange(startYear, endYear+1)
+
+    def postprocess():
+        series = st.collectSeries(simulator)
+        stats = st.summarize(series, quantiles = (0.25, 0.75), years = xScale, scale = 1000)
+        st.writeTable(stats, os.path.join(outputdir, "summary_"+mat+".csv"))
+        rp.writeReports(stats, outputdir, mat, 1)
+        rs.writeResults(os.path.join(outputdir, "results_"+mat+".npz"), series, xScale)
+
+    results["PostProcessing"] = measure(postprocess, repeat = 1, memory = memory)
+
+    # reports split over all cores (see Reports.writeReports)
+    stats = st.summarize(st.collectSeries(simulator), quantiles = (0.25, 0.75), years = xScale, scale = 1000)
+
+    def reports():
+        rp.writeReports(stats, outputdir, mat)
+
+    results["ParallelReports"] = measure(reports, repeat = 1, memory = memory)
+
+    ### EXPORT CALCULATION
+
+    # the script reads data_casestudy/DPMFA_Plastic_CH_inclExport.db and
+    # changes it, a new copy is used for each run
+    tradedb = sd.writeDatabase(os.path.join(directory, "trade.db"), compartments, years = (startYear, endYear),
+                               materials = (mat,), trade = True, seed = seed)
+    exportdir = os.path.join(directory, "export")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Export_Calculation.py")
+
+    def setupExport():
+        os.makedirs(os.path.join(exportdir, "data_casestudy"), exist_ok = True)
+        shutil.copy(tradedb, os.path.join(exportdir, "data_casestudy", "DPMFA_Plastic_CH_inclExport.db"))
+        return ()
+
+    def export():
+        cwd = os.getcwd()
+        os.chdir(exportdir)
+        try:
+            quiet(runpy.run_path)(script)
+        finally:
+            os.chdir(cwd)
+
+    results["ExportCalculation"] = measure(export, setupExport, repeat = 1, memory = memory)
+
+    return results
+
+def environment():
+    """
+    versions and machine of the benchmark
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count()}
+
+def runBenchmarks(tiers = ("small", "medium"), output = None, repeat = 3, memory = True):
+    """
+    runs the benchmarks of the tiers (keys of TIERS), writes the results into
+    the json file output if given and returns them
+    """
+    results = {"environment": environment(), "tiers": {}}
+
+    for tier in tiers:
+        print("Benchmark tier "+tier+"...")
+        directory = tempfile.mkdtemp(prefix = "benchmark_")
+        try:
+            results["tiers"][tier] = {"parameters": TIERS[tier],
+                                      "results": benchmarkTier(directory, repeat = repeat, memory = memory, **TIERS[tier])}
+        finally:
+            shutil.rmtree(directory, ignore_errors = True)
+
+        for step, r in results["tiers"][tier]["results"].items():
+            print("  {a:<20} {b:10.4f} s {c}".format(a = step, b = r["seconds"],
+                  c = "" if "peak_bytes" not in r else "{:10.1f} MB".format(r["peak_bytes"]/1e6)))
+
+    if output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent = 1)
+
+    return results
+
+def compareResults(old, new):
+    """
+    prints the ratio of the times and peak memory of the results new to the
+    results old (both as returned by runBenchmarks), for the steps of both
+    """
+    for tier, t in new["tiers"].items():
+        if tier not in old["tiers"]:
+            continue
+        print("Tier "+tier+" (new/old):")
+        for step, r in t["results"].items():
+            o = old["tiers"][tier]["results"].get(step)
+            if o is None:
+                continue
+            line = "  {a:<20} time {b:6.2f}".format(a = step, b = r["seconds"]/o["seconds"])
+            if "peak_bytes" in r and "peak_bytes" in o and o["peak_bytes"] > 0:
+                line += "  memory {:6.2f}".format(r["peak_bytes"]/o["peak_bytes"])
+            print(line)
+
+
+if __name__ == "__main__":
+
+    # usage: python Benchmark.py [--tiers small medium large] [--output FILE] [--repeat N] [--no-memory]
+    #                           [--compare OLDFILE]
+    parser = argparse.ArgumentParser(description = "Benchmarks of the model setup, simulation and export on synthetic databases")
+    parser.add_argument("--tiers", nargs = "+", default = ["small", "medium"], choices = list(TIERS))
+    parser.add_argument("--output", default = os.path.join("benchmarks", "benchmark_"+time.strftime("%Y%m%d_%H%M%S")+".json"))
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--no-memory", action = "store_true", help = "do not trace the peak memory")
+    parser.add_argument("--compare", default = None, help = "json file of earlier results to compare with")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.tiers, args.output, args.repeat, not args.no_memory)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compareResults(json.load(f), results)
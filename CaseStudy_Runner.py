@@ -8,17 +8,31 @@ Test model for importing SQL databases
 """
 
 import os
-import csv
+import sys
+import argparse
+import zlib
+import json
+import contextlib
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import numpy.random as nr
 
 import setup_model_new as su
+import ChunkedSimulation as cs
+import Statistics as st
+import ResultStore as rs
+import RecordStorage as rm
+import Reports as rp
+import ModelCache as mc
+import MassBalance as mb
+import TruncatingFunctions as tr
+import SampleBank as sb
+import Instrumentation as ins
+import Sensitivity as sa
 from dpmfa import simulator as sc
 from dpmfa import components as cp
+from concurrent.futures import ProcessPoolExecutor
 
 
-#import numpy.random as nr
 #from scipy.stats import gaussian_kde 
 #import pandas as pd
 
@@ -27,261 +41,360 @@ startYear = 1950 # year of start of modelling
 Tperiods = 67 # total number of periods considered
 Speriod = 30 # special period for detailed output printing
 RUNS = 10000 # number of runs (numerical precision)
+BATCH = 1000 # number of runs per batch with a convergence tolerance
+MAXRUNS = 50000 # maximal number of runs with a convergence tolerance
 
-pathtoDB = os.path.join("data_casestudy","DPMFA_Plastic_EU_inclExport.db")
-#mat = "PS"
-#mat = "PP"
-#mat = "EPS"
-#mat = "PVC"
-#mat = "HDPE"
-#mat = "PET"
-mat = "LDPE"
-
-modelname = mat+" in Europe"
 startYear = 1950
 endYear = 2016
 # for plots
 xScale=np.arange(startYear,startYear+Tperiods)
 
-# define model
-model = su.setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear)
+# database and name of each region
+regions = {"EU": {"db": os.path.join("data_casestudy","DPMFA_Plastic_EU_inclExport.db"),
+                  "name": "Europe"},
+           "CH": {"db": os.path.join("data_casestudy","DPMFA_Plastic_CH_inclExport.db"),
+                  "name": "Switzerland"}}
 
-# check validity
-#model.checkModelValidity()
-#model.debugModel()
+# all polymers of the case study
+materials = ["LDPE", "HDPE", "PP", "PS", "EPS", "PVC", "PET"]
 
 
-# set up the simulator object
-simulator = sc.Simulator(RUNS, Tperiods, 2250, True, True) # 2250 is just a seed
-# define what model  needs to be run
-simulator.setModel(model)
-# run the model
-#simulator.debugSimulator()
-simulator.runSimulation()
+def checkOptions(chunks = None, streaming = False, mean = False, tolerance = None,
+                 sampling = "random", bank = None, sensitivity = False, **options):
+    """
+    raises an exception if the options of runCaseStudy cannot be combined
+    """
+    if bank is not None and sampling != "random":
+        raise Exception('The samples of a sample bank are taken from its uniforms, sampling "{a}" cannot be used with a bank.'.format(a = sampling))
+    
+    if streaming and bank is not None:
+        raise Exception('The samples of a sample bank cannot be drawn for each chunk, use streaming without bank.')
+    
+    if sensitivity and (chunks is not None or streaming or tolerance is not None or mean):
+        raise Exception('The sensitivity analysis needs the runs of a single simulation (without chunks, streaming, tolerance or mean).')
+    
+    if sensitivity and sensitivity is not True:
+        for year in sensitivity:
+            if not startYear <= year < startYear+Tperiods:
+                raise Exception('The year {a} of the sensitivity analysis is not simulated ({b}-{c}).'.format(a = year, b = startYear, c = startYear+Tperiods-1))
+
+
+def runCaseStudy(mat, region = "EU", seed = 2250, *, runs = None, chunks = None, processes = None, csvExport = False,
+                 scratch = None, float32 = False, streaming = False, cache = None, mean = False,
+                 tolerance = None, sampling = "random", bank = None, trace = False, sensitivity = False):
+    """
+    sets up and runs the model for material mat in region (key of regions),
+    then plots and exports the results into output_casestudy/<region>
+    (summary, pdf reports and all runs in results_<mat>.npz). The options
+    are keyword arguments:
+        runs: number of runs (default: RUNS)
+        chunks: number of chunks of runs simulated in parallel
+        processes: maximal number of processes (chunks and plots)
+        csvExport: also export each series to a csv file
+        scratch: directory keeping the matrices of the simulation instead of
+            memory (see RecordStorage)
+        float32: logged flows in single precision (with scratch)
+        streaming: only keep the statistics of chunks of runs (default: 1000
+            runs per chunk), the runs are not exported. The samples are drawn
+            for each chunk, the memory needed does not depend on runs
+        cache: directory of the built models (see ModelCache)
+        mean: one deterministic run with the means of the distributions,
+            written into output_casestudy/<region>/mean
+        tolerance: simulate batches of BATCH runs until the mean and quartiles
+            in the last year change by less than tolerance (at most MAXRUNS)
+        sampling: method of the samples (see TruncatingFunctions.METHODS)
+        bank: directory of the uniforms shared by all jobs (see SampleBank,
+            not with streaming, random sampling only)
+        trace: time and peak memory of each phase in trace_<mat>.json (see
+            Instrumentation)
+        sensitivity: parameters driving each series in each year (True) or
+            in a list of years, in csv/sensitivity_<mat>.csv (see Sensitivity,
+            single simulation only)
+    """
+    
+    checkOptions(chunks = chunks, streaming = streaming, mean = mean, tolerance = tolerance,
+                 sampling = sampling, bank = bank, sensitivity = sensitivity)
+    
+    # trace of the phases, unless the whole process is already traced
+    started = trace and not ins.enabled()
+    if started:
+        ins.enable()
+    ins.begin("runCaseStudy")
+    
+    pathtoDB = regions[region]["db"]
+    samplebank = None if bank is None else sb.SampleBank(bank)
+    outputdir = os.path.join("output_casestudy", region, "mean" if mean else "")
+    os.makedirs(os.path.join(outputdir, "csv"), exist_ok=True)
+    
+    modelname = mat+" in "+regions[region]["name"]
+    
+    if runs is None:
+        runs = RUNS
+    
+    # number of runs of the samples of the model: with streaming, they are
+    # drawn again for each chunk or batch. Samples taken in the order of the
+    # runs are not repeated: with a tolerance, they are drawn for up to
+    # MAXRUNS runs
+    resample = streaming and not mean
+    if resample:
+        chunks = chunks or int(np.ceil(runs/1000))
+        samples = BATCH if tolerance is not None else int(np.ceil(runs/chunks))
+    elif tolerance is not None and (sampling != "random" or bank is not None):
+        samples = MAXRUNS
+    else:
+        samples = runs
+    
+    ins.begin("build")
+    
+    if mean:
+        # define the model with the means of the distributions
+        model = su.setupModel(pathtoDB,modelname,1,mat, startYear, endYear, mean = True)
+    
+    elif cache is None:
+        # seed the sampling of the model, so that each job is reproducible
+        nr.seed(seed)
+    
+        # define model
+        model = su.setupModel(pathtoDB,modelname,samples,mat, startYear, endYear, sampling = sampling, bank = samplebank,
+                              resample = resample)
+    
+    else:
+        # load the model from the cache, or define it and store it there
+        model = mc.cachedSetupModel(mc.ModelCache(cache), pathtoDB, modelname, samples, mat, startYear, endYear, seed, sampling,
+                                    samplebank, resample)
 
+    ins.end("build")
+    ins.snapshot("model built")
+    
+    # check validity
+    #model.checkModelValidity()
+    #model.debugModel()
 
-### plot inflow
 
-# compartment with loggedInflows
-loggedInflows = simulator.getLoggedInflows() 
+    # optional storage of the matrices of the simulation in files
+    records = []
+    def prepare(simulator):
+        records.append(rm.memmapRecords(simulator, scratch, np.float32 if float32 else np.float64))
+    
+    ins.begin("simulation")
+    
+    if mean:
+        # one run, with the mass balance of all periods solved at once
+        simulator = mb.DeterministicSimulator(Tperiods, True, True, seed)
+        simulator.setModel(model)
+        simulator.runSimulation()
+    
+    elif tolerance is not None:
+        # run batches of runs until the statistics converge (in kt)
+        accumulator, simulator, convergence = cs.runAdaptiveSimulation(model, Tperiods, seed, BATCH, tolerance, MAXRUNS,
+                                                                       processes, scale = 1000, keepRecords = not streaming,
+                                                                       prepare = prepare if scratch is not None else None)
+        print("Runs: "+str(convergence["runs"])+", relative change: "+str(convergence["change"])
+              +", converged: "+str(convergence["converged"]))
+    
+    elif streaming:
+        # run the model in chunks of runs, only keeping their statistics (in kt)
+        accumulator = cs.runStreamingSimulation(model, runs, Tperiods, seed, chunks,
+                                                processes, scale = 1000)
+    
+    elif chunks is None:
+        # set up the simulator object
+        simulator = sc.Simulator(runs, Tperiods, seed, True, True)
+        # record the values of the parameters sampled in each run
+        if sensitivity:
+            parameters = sa.recordParameters(model, runs, startYear)
+        # define what model  needs to be run
+        simulator.setModel(model)
+        if scratch is not None:
+            prepare(simulator)
+        # run the model
+        #simulator.debugSimulator()
+        simulator.runSimulation()
+    
+    else:
+        # run the model in chunks of runs, merged into one simulator object
+        simulator = cs.runChunkedSimulation(model, runs, Tperiods, seed, chunks, processes,
+                                            prepare = prepare if scratch is not None else None)
+    
+    ins.end("simulation")
+    ins.snapshot("simulation")
+
 
-# create pdf document with multiple pages
-pp = PdfPages('output_casestudy/EU/TimeSeries_INFLOW_'+mat+'.pdf')
+    ### summary statistics
     
-## display mean for each inflow
-for key, value in loggedInflows.items():
-    data = value*1000
-        
-    mean=[]                                       
-    q25=[]
-    q75=[]
-    minimum=[]
-    maximum=[]
-    
-    for i in range(0,np.shape(data)[1]):
-        mean.append(np.mean(data[:,i]))
-        q25.append(np.percentile(data[:,i],25))
-        q75.append(np.percentile(data[:,i],75))
-        minimum.append(np.min(data[:,i]))
-        maximum.append(np.max(data[:,i]))
-    
-    # create a new figure
-    fig = plt.figure('INFLOW_'+ key) 
-    plt.xlabel('Year',fontsize=14)
-    plt.ylabel('Flow mass (kt)',fontsize=14)
-    plt.title('Inflow into '+key)
-    plt.rcParams['font.size']=12 # tick's font
-    plt.xlim(xmin=startYear-0.5, xmax=startYear+Tperiods-0.5)
-    plt.fill_between(xScale, minimum, maximum, color='blanchedalmond', label="Range")
-    plt.plot(xScale,mean, color = 'darkred', linewidth=2, label='Mean Value')
-    plt.plot(xScale, q25, color = 'red', linestyle='dashed', linewidth=1.5, label = '25% Quantile')
-    plt.plot(xScale, q75, color = 'red', linestyle='dashed', linewidth=1.5, label = '75% Quantile')
-    plt.legend(loc='upper left', fontsize = 'small')
-    plt.tight_layout()
-    pp.savefig()
-    # fig.savefig('output_casestudy/EU/TimeSeries_INFLOW_'+ key+'.pdf', bbox_inches='tight')
-
-# close the multipage pdf object
-pp.close()
-
-### plot outflow
-
-# compartment with loggedOutflows
-loggedOutflows = simulator.getLoggedOutflows()
-
-# create pdf document with multiple pages
-pp = PdfPages('output_casestudy/EU/TimeSeries_OUTFLOW_'+mat+'.pdf')
-
-for Comp in loggedOutflows:
-    
-    # in this case name is the key, value is the matrix(data), in this case .items is needed
-    for comp, value in Comp.outflowRecord.items():
+    ins.begin("statistics")
+
+    if streaming and not mean:
+        # no logged series, the statistics are already accumulated
+        series = []
+        stats = accumulator.table(quantiles = (0.25, 0.75), years = xScale)
+    
+    else:
+        # all logged series
+        series = st.collectSeries(simulator)
+    
+        # mean, standard deviation, range and quartiles of all logged series (in kt)
+        stats = st.summarize(series, quantiles = (0.25, 0.75), years = xScale, scale = 1000)
+    
+    # export the statistics to csv
+    st.writeTable(stats, os.path.join(outputdir,"csv","summary_"+mat+".csv"))
+    
+    ins.end("statistics")
+
+
+    ### plot inflows, outflows, stocks and sinks
+
+    # one pdf document with multiple pages per kind of series
+    with ins.span("reports"):
+        rp.writeReports(stats, outputdir, mat, processes)
+
+
+    ## display mean ± std for each outflow
+    print('-----------------------')
+    for Speriod in [66]:
+        print('Logged Outflows period '+str(Speriod)+' (year: '+str(startYear+Speriod)+'):')
+        print('')
+        rows = st.selectRows(stats, kind = "outflow", year = startYear+Speriod)
+        # loop over the compartments with loggedoutflows
+        for source in dict.fromkeys(rows["source"]):
+            print('Flows from ' + source +':' )
+            for i in np.flatnonzero(rows["source"] == source):
+                print(' --> ' + str(rows["target"][i])+ ': Mean = '+str(round(rows["mean"][i],0))+' ± '+str(round(rows["std"][i],0))   )
+            print('')
+    print('-----------------------')
+
+
+    ### export data
+    
+    ins.begin("export")
+
+    # all series of runs x years into one compressed file
+    metadata = {"material": mat, "region": region, "model": modelname, "seed": seed,
+                "RUNS": 1 if mean else runs, "chunks": chunks, "mean": mean, "sampling": sampling,
+                "bank": bank}
+    if tolerance is not None and not mean:
+        metadata["RUNS"] = convergence["runs"]
+        metadata["convergence"] = convergence
+    
+    if mean or not streaming:
+        rs.writeResults(os.path.join(outputdir,"results_"+mat+".npz"), series, xScale, metadata)
+    elif tolerance is not None:
+        # the runs are not exported, only the metadata
+        with open(os.path.join(outputdir,"metadata_"+mat+".json"), "w") as f:
+            json.dump(metadata, f, indent = 1)
+
+    # legacy export of each series to its own csv file
+    if csvExport and (mean or not streaming):
+        rs.writeCSV(series, os.path.join(outputdir,"csv"), mat)
+    
+    # parameters driving the uncertainty of each series in each year (or in
+    # the years given)
+    if sensitivity:
+        names, X = sa.parameterMatrix(parameters)
+        sa.writeParameters(os.path.join(outputdir,"parameters_"+mat+".npz"), names, X)
+        periods = range(Tperiods) if sensitivity is True else [year-startYear for year in sensitivity]
+        st.writeTable(sa.rankDrivers(names, X, series, periods, xScale),
+                      os.path.join(outputdir,"csv","sensitivity_"+mat+".csv"))
+    
+    # delete the files of the simulation
+    for directory in records:
+        rm.removeRecords(directory)
+    
+    ins.end("export")
+    ins.end("runCaseStudy")
+    ins.snapshot("end")
+    
+    if trace:
+        ins.writeTrace(os.path.join(outputdir,"trace_"+mat+".json"), metadata)
+    if started:
+        ins.disable()
+
+
+def jobSeed(mat, region, seed = 2250):
+    """
+    deterministic seed of the job for material mat in region, derived from
+    the master seed (independent of the order of the jobs)
+    """
+    return int(np.random.SeedSequence([seed, zlib.crc32((region+"/"+mat).encode())]).generate_state(1)[0])
+
+
+def runJob(mat, region, seed, **options):
+    """
+    runs one case study in a worker process (options: keyword arguments of
+    runCaseStudy), the console output is written into
+    output_casestudy/<region>/log_<mat>.txt
+    """
+    logdir = os.path.join("output_casestudy", region, "mean" if options.get("mean") else "")
+    os.makedirs(logdir, exist_ok=True)
+    
+    with open(os.path.join(logdir, "log_"+mat+".txt"), "w") as log:
+        with contextlib.redirect_stdout(log):
+            print("Material: "+mat+", region: "+region+", seed: "+str(seed))
+            runCaseStudy(mat, region, seed, processes = 1, **options)
+    
+    return mat, region, seed
+
+
+def runPortfolio(mats = materials, regs = ["EU"], processes = None, seed = 2250, **options):
+    """
+    runs the case study for all combinations of the materials mats and the
+    regions regs, each in its own process (at most processes at the same time,
+    default: number of CPUs), with the options of runCaseStudy (keyword
+    arguments). With chunks, the runs of each job are split into chunks,
+    simulated one after the other in the process of the job
+    """
+    checkOptions(**options)
+    
+    jobs = [(mat, region, jobSeed(mat, region, seed)) for region in regs for mat in mats]
+    
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        futures = [pool.submit(runJob, *job, **options) for job in jobs]
         
-        data = value*1000
+        for future in futures:
+            mat, region, jobseed = future.result()
+            print("Finished "+mat+" in "+region+" (seed "+str(jobseed)+")")
+
+
+if __name__ == "__main__":
+    
+    # usage: python CaseStudy_Runner.py [materials] [--regions EU CH] [--processes N] [--runs N] [--chunks K] [--csv]
+    #                            [--scratch DIR] [--float32] [--streaming] [--cache DIR] [--mean]
+    #                            [--tolerance TOL] [--sampling random|lhs|sobol] [--bank DIR] [--trace]
+    #                            [--sensitivity [YEAR ...]]
+    # without arguments, LDPE is run in Europe as before
+    if len(sys.argv) == 1:
+        runCaseStudy("LDPE", "EU")
+    
+    else:
+        parser = argparse.ArgumentParser(description = "Runs the case study for several materials and regions in parallel")
+        parser.add_argument("materials", nargs = "*", default = materials)
+        parser.add_argument("--regions", nargs = "+", default = ["EU"], choices = list(regions))
+        parser.add_argument("--processes", type = int, default = None)
+        parser.add_argument("--seed", type = int, default = 2250)
+        parser.add_argument("--runs", type = int, default = None, help = "number of runs (default: "+str(RUNS)+")")
+        parser.add_argument("--chunks", type = int, default = None)
+        parser.add_argument("--csv", action = "store_true", help = "also export each series to a csv file")
+        parser.add_argument("--scratch", default = None, help = "directory for the matrices of the simulation (instead of memory)")
+        parser.add_argument("--float32", action = "store_true", help = "log the flows in single precision (with --scratch)")
+        parser.add_argument("--streaming", action = "store_true", help = "only keep the statistics of the runs (no export of the runs)")
+        parser.add_argument("--cache", default = None, help = "directory for the cache of the built models")
+        parser.add_argument("--mean", action = "store_true", help = "only one deterministic run with the means of the distributions (quick check)")
+        parser.add_argument("--tolerance", type = float, default = None, help = "run batches of runs until the statistics change by less than TOL (relative)")
+        parser.add_argument("--sampling", default = "random", choices = tr.METHODS, help = "sampling method of the distributions")
+        parser.add_argument("--bank", default = None, help = "directory of the sample bank shared by all jobs")
+        parser.add_argument("--trace", action = "store_true", help = "write the time and peak memory of each phase into trace_<mat>.json")
+        parser.add_argument("--sensitivity", nargs = "*", type = int, default = None, metavar = "YEAR",
+                            help = "rank the TCs and inputs driving the uncertainty of each series in the years YEAR (default: all years)")
+        args = parser.parse_args()
         
-        mean=[]                                       
-        q25=[]
-        q75=[]
-        minimum=[]
-        maximum=[]
+        options = {"runs": args.runs, "chunks": args.chunks, "csvExport": args.csv, "scratch": args.scratch, "float32": args.float32,
+                   "streaming": args.streaming, "cache": args.cache, "mean": args.mean, "tolerance": args.tolerance,
+                   "sampling": args.sampling, "bank": args.bank, "trace": args.trace,
+                   "sensitivity": False if args.sensitivity is None else (args.sensitivity or True)}
         
-        for i in range(0,np.shape(data)[1]):
-            mean.append(np.mean(data[:,i]))
-            q25.append(np.percentile(data[:,i],25))
-            q75.append(np.percentile(data[:,i],75))
-            minimum.append(np.min(data[:,i]))
-            maximum.append(np.max(data[:,i]))
-
-        # create a new figure
-        fig = plt.figure('OUTFLOW_'+ Comp.name +' to ' + comp) 
-        plt.xlabel('Year',fontsize=14)
-        plt.ylabel('Flow mass (kt)',fontsize=14)    
-        plt.title('Flow from '+Comp.name+' to ' + comp)
-        plt.rcParams['font.size']=12 # tick's font
-        plt.xlim(xmin=startYear-0.5, xmax=startYear+Tperiods-0.5)
-        plt.fill_between(xScale, minimum, maximum, color='blanchedalmond', label="Range")
-        plt.plot(xScale,mean, color = 'darkred', linewidth=2, label='Mean Value')
-        plt.plot(xScale, q25, color = 'red', linestyle='dashed', linewidth=1.5, label = '25% Quantile')
-        plt.plot(xScale, q75, color = 'red', linestyle='dashed', linewidth=1.5, label = '75% Quantile')
-        plt.legend(loc='upper left', fontsize = 'small')
-        plt.tight_layout()
-        pp.savefig()
-
-# close the multipage pdf object
-pp.close()
-
-
-### plot stocks
-stocks = simulator.getStocks()
-
-# create pdf document with multiple pages
-pp = PdfPages('output_casestudy/EU/TimeSeries_STOCK_'+mat+'.pdf')
-
-for stock in stocks:
-
-    data = stock.inventory*1000
-    
-    mean=[]                                       
-    q25=[]
-    q75=[]
-    minimum=[]
-    maximum=[]
-    
-    for i in range(0,np.shape(data)[1]):
-        mean.append(np.mean(data[:,i]))
-        q25.append(np.percentile(data[:,i],25))
-        q75.append(np.percentile(data[:,i],75))
-        minimum.append(np.min(data[:,i]))
-        maximum.append(np.max(data[:,i]))
-    
-    # create a new figure
-    fig = plt.figure('STOCK_'+ stock.name) 
-    plt.xlabel('Year',fontsize=14)
-    plt.ylabel('Flow mass (kt)',fontsize=14)
-    plt.title('Mass in stock '+stock.name)
-    plt.rcParams['font.size']=12 # tick's font
-    plt.xlim(xmin=startYear-0.5, xmax=startYear+Tperiods-0.5)
-    plt.fill_between(xScale, minimum, maximum, color='blanchedalmond', label="Range")
-    plt.plot(xScale,mean, color = 'darkred', linewidth=2, label='Mean Value')
-    plt.plot(xScale, q25, color = 'red', linestyle='dashed', linewidth=1.5, label = '25% Quantile')
-    plt.plot(xScale, q75, color = 'red', linestyle='dashed', linewidth=1.5, label = '75% Quantile')
-    plt.legend(loc='upper left', fontsize = 'small')
-    plt.tight_layout()
-    pp.savefig()
-
-# close the multipage pdf object
-pp.close()
-
-
-### plot sinks
-sinks = simulator.getSinks()
-
-# create pdf document with multiple pages
-pp = PdfPages('output_casestudy/EU/TimeSeries_SINK_'+mat+'.pdf')
-
-for sink in sinks:
-
-    if isinstance(sink,cp.Stock):
-        continue
-    
-    data = sink.inventory*1000
-    
-    mean=[]                                       
-    q25=[]
-    q75=[]
-    minimum=[]
-    maximum=[]
-    
-    for i in range(0,np.shape(data)[1]):
-        mean.append(np.mean(data[:,i]))
-        q25.append(np.percentile(data[:,i],25))
-        q75.append(np.percentile(data[:,i],75))
-        minimum.append(np.min(data[:,i]))
-        maximum.append(np.max(data[:,i]))
-    
-    # create a new figure
-    fig = plt.figure('SINK_'+ sink.name) 
-    plt.xlabel('Year',fontsize=14)
-    plt.ylabel('Flow mass (kt)',fontsize=14)
-    plt.title('Mass in sink '+sink.name)
-    plt.rcParams['font.size']=12 # tick's font
-    plt.xlim(xmin=startYear-0.5, xmax=startYear+Tperiods-0.5)
-    plt.fill_between(xScale, minimum, maximum, color='blanchedalmond', label="Range")
-    plt.plot(xScale,mean, color = 'darkred', linewidth=2, label='Mean Value')
-    plt.plot(xScale, q25, color = 'red', linestyle='dashed', linewidth=1.5, label = '25% Quantile')
-    plt.plot(xScale, q75, color = 'red', linestyle='dashed', linewidth=1.5, label = '75% Quantile')
-    plt.legend(loc='upper left', fontsize = 'small')
-    plt.tight_layout()
-    pp.savefig()
-
-# close the multipage pdf object
-pp.close()
-
-
-## display mean ± std for each outflow
-print('-----------------------')
-for Speriod in [66]:
-    print('Logged Outflows period '+str(Speriod)+' (year: '+str(startYear+Speriod)+'):')
-    print('')
-    # loop over the list of compartments with loggedoutflows
-    for Comp in loggedOutflows:
-        print('Flows from ' + Comp.name +':' )
-        # in this case name is the key, value is the matrix(data), in this case .items is needed
-        for Target_name, value in Comp.outflowRecord.items():
-            print(' --> ' + str(Target_name)+ ': Mean = '+str(round(np.mean(value[:,Speriod]*1000),0))+' ± '+str(round(np.std(value[:,Speriod]*1000),0))   )
-        print('')
-print('-----------------------')
-
-
-### export data
-
-# export outflows to csv
-for Comp in loggedOutflows: # loggedOutflows is the compartment list of compartmensts with loggedoutflows
-    for Target_name, value in Comp.outflowRecord.items(): # in this case name is the key, value is the matrix(data), in this case .items is needed     
-        with open(os.path.join("output_casestudy","EU","csv","loggedOutflows_"+mat+"_" + Comp.name + "_to_" + Target_name + ".csv"), 'w') as RM :
-            a = csv.writer(RM, delimiter=' ')
-            data = np.asarray(value)
-            a.writerows(data)
-
-# export inflows to csv
-for Comp in loggedInflows: # loggedOutflows is the compartment list of compartmensts with loggedoutflows
-    with open(os.path.join("output_casestudy","EU","csv","loggedInflows_"+mat+"_" + Comp + ".csv"), 'w') as RM :
-        a = csv.writer(RM, delimiter=' ')
-        data = np.asarray(loggedInflows[Comp])
-        a.writerows(data) 
-
-# export sinks to csv
-for sink in sinks:
-    if isinstance(sink,cp.Stock):
-        continue
-    with open(os.path.join("output_casestudy","EU","csv","sinks_"+mat+"_" + sink.name + ".csv"), 'w') as RM :
-        a = csv.writer(RM, delimiter=' ')
-        data = np.asarray(sink.inventory)
-        a.writerows(data)
-
-# export stocks to csv
-for stock in stocks:
-    with open(os.path.join("output_casestudy","EU","csv","stocks_"+mat+"_" + stock.name + ".csv"), 'w') as RM :
-        a = csv.writer(RM, delimiter=' ')
-        data = np.asarray(stock.inventory)
-        a.writerows(data)
+        # a single job is run here, its chunks being distributed over the processes
+        if len(args.materials)*len(args.regions) == 1 and (args.chunks is not None or args.streaming or args.tolerance is not None):
+            runCaseStudy(args.materials[0], args.regions[0], jobSeed(args.materials[0], args.regions[0], args.seed),
+                         processes = args.processes, **options)
+        else:
+            runPortfolio(args.materials, args.regions, args.processes, args.seed, **options)
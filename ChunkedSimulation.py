@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo simulation of a model split into chunks of runs that are simulated
+in parallel processes, the logged flows and stocks being merged back into a
+single simulator
+
+"""
+
+# import necessary packages
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from dpmfa import simulator as sc
+from dpmfa import components as cp
+import Statistics as st
+import TruncatingFunctions as tr
+from StreamingStatistics import SummaryAccumulator, TINY
+
+
+def chunkSeeds(seed, chunks):
+    """
+    derives an independent seed for each chunk from the master seed
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(chunks)]
+
+def chunkRuns(RUNS, chunks):
+    """
+    splits the RUNS into chunks of (almost) equal size, returns the first and
+    last (excluded) run of each chunk
+    """
+    bounds = np.linspace(0, RUNS, chunks+1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+def getRecords(simulator):
+    """
+    returns the logged flows and stocks of all compartments of a simulator,
+    by compartment name
+    """
+    records = {}
+
+    for comp in simulator.getCompartments():
+        rec = {}
+        if getattr(comp, "logInflows", False):
+            rec["inflowRecord"] = comp.inflowRecord
+        if isinstance(comp, cp.FlowCompartment) and comp.logOutflows:
+            rec["outflowRecord"] = comp.outflowRecord
+        if isinstance(comp, cp.Sink):
+            rec["inventory"] = comp.inventory
+        if type(comp) is cp.Stock and comp.logImmediateFlows:
+            rec["immediateFlowRecord"] = comp.immediateFlowRecord
+        records[comp.name] = rec
+
+    return records
+
+def setFirstRun(model, run):
+    """
+    makes the transfers and inflows of a model taking their samples in the
+    order of the runs (see TruncatingFunctions.RunSample) start at run, the
+    first run of a chunk
+    """
+    for comp in model.compartments:
+        for trans in getattr(comp, "transfers", []):
+            for dist in getattr(trans, "transfer_distribution_list", []):
+                if isinstance(dist.function, tr.RunSample):
+                    dist.function.setRun(run)
+
+    for inflow in model.inflows:
+        for single in getattr(inflow, "inflowList", []):
+            if isinstance(getattr(single, "pdf", None), tr.RunSample):
+                single.pdf.setRun(run)
+
+def prepareChunk(model, runs, seed, first):
+    """
+    prepares the samples of a model for a chunk of runs starting at run
+    first: the samples of a model with a SampleMatrix (see setupModel with
+    resample) are drawn again for the runs of the chunk (from a seed derived
+    from the seed of the chunk), otherwise the samples taken in the order of
+    the runs start at run first
+    """
+    matrix = getattr(model, "sampleMatrix", None)
+    if matrix is None:
+        setFirstRun(model, first)
+    else:
+        matrix.resample(runs, int(np.random.SeedSequence([seed, 1]).generate_state(1)[0]))
+        setFirstRun(model, 0)
+
+def completed(pool, function, args, processes):
+    """
+    calls function with each tuple of arguments of args in the pool (here if
+    pool is None), at most processes at the same time, and yields the index
+    and result of each call as soon as it finishes, so that the results do
+    not all have to be kept until the last one
+    """
+    if pool is None:
+        for i, a in enumerate(args):
+            yield i, function(*a)
+        return
+
+    args = enumerate(args)
+    pending = {}
+    for i, a in args:
+        pending[pool.submit(function, *a)] = i
+        if len(pending) == processes:
+            break
+
+    while len(pending) != 0:
+        done, notdone = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = pending.pop(future)
+            yield i, future.result()
+            for j, a in args:
+                pending[pool.submit(function, *a)] = j
+                break
+
+def sampleRuns(model):
+    """
+    number of runs of the samples taken in the order of the runs (see
+    TruncatingFunctions.RunSample) of a model, the shortest one (None if the
+    model has none): the runs after it would repeat the first runs. None too
+    if the samples are drawn again for each chunk (see prepareChunk)
+    """
+    if getattr(model, "sampleMatrix", None) is not None:
+        return None
+
+    lengths = []
+    for comp in model.compartments:
+        for trans in getattr(comp, "transfers", []):
+            for dist in getattr(trans, "transfer_distribution_list", []):
+                if isinstance(getattr(dist, "function", None), tr.RunSample):
+                    lengths.append(len(dist.function.sample))
+
+    for inflow in model.inflows:
+        for single in getattr(inflow, "inflowList", []):
+            if isinstance(getattr(single, "pdf", None), tr.RunSample):
+                lengths.append(len(single.pdf.sample))
+
+    return min(lengths) if len(lengths) != 0 else None
+
+def runChunk(modelpickle, runs, periods, seed, useGlobalTCSettings=True, normalizeTCs=True, first=0):
+    """
+    simulates one chunk of runs of a (pickled) model, first being the index
+    of its first run, returns its records
+    """
+    model = pickle.loads(modelpickle)
+    prepareChunk(model, runs, seed, first)
+
+    simulator = sc.Simulator(runs, periods, seed, useGlobalTCSettings, normalizeTCs)
+    simulator.setModel(model)
+    simulator.runSimulation()
+
+    return getRecords(simulator)
+
+def runChunkedSimulation(model, RUNS, periods, seed, chunks, processes=None,
+                         useGlobalTCSettings=True, normalizeTCs=True, prepare=None):
+    """
+    simulates RUNS runs of a model in chunks, distributed over a number of
+    processes (all cores if None, no separate process if 1). Each chunk has its
+    own seed derived from seed, the results are thus identical for a given
+    seed and number of chunks, whatever the number of processes.
+    Returns a simulator with the merged records of all chunks, that can be
+    used like a simulator having run the whole simulation. If given, prepare
+    is called on this simulator before the merge (e.g. to store its records
+    with RecordStorage.memmapRecords): the records of a chunk are merged as
+    soon as it is finished, at most processes chunks being kept in memory.
+    """
+    if chunks < 1 or chunks > RUNS:
+        raise Exception('The number of chunks must be between 1 and the number of runs ({a}), not {b}.'.format(a = RUNS, b = chunks))
+
+    bounds = chunkRuns(RUNS, chunks)
+    seeds = chunkSeeds(seed, chunks)
+
+    # pickle the model once, before the records of the merged simulator are
+    # initialized
+    modelpickle = pickle.dumps(model)
+
+    # simulator with records for all runs
+    simulator = sc.Simulator(RUNS, periods, seed, useGlobalTCSettings, normalizeTCs)
+    simulator.setModel(model)
+
+    if prepare is not None:
+        prepare(simulator)
+
+    ### SIMULATION AND MERGE OF THE CHUNKS
+
+    if processes is None:
+        processes = min(chunks, os.cpu_count() or 1)
+
+    # the records of each chunk are copied into the simulator as soon as the
+    # chunk is finished, then released
+    args = [(modelpickle, b-a, periods, s, useGlobalTCSettings, normalizeTCs, a) for (a, b), s in zip(bounds, seeds)]
+
+    if processes == 1:
+        for i, records in completed(None, runChunk, args, 1):
+            mergeRecords(simulator, [bounds[i]], [records])
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for i, records in completed(pool, runChunk, args, processes):
+                mergeRecords(simulator, [bounds[i]], [records])
+
+    return simulator
+
+def mergeRecords(simulator, bounds, results):
+    """
+    copies the records of the chunks (see getRecords) into the runs of the
+    simulator given by bounds (first and last, excluded, run of each chunk)
+    """
+    for (a, b), records in zip(bounds, results):
+        for comp in simulator.getCompartments():
+            for name, rec in records[comp.name].items():
+                if isinstance(rec, dict):
+                    for target, values in rec.items():
+                        getattr(comp, name)[target][a:b] = values
+                else:
+                    getattr(comp, name)[a:b] = rec
+
+def growRecords(simulator, model, runs, periods, seed, useGlobalTCSettings=True, normalizeTCs=True, prepare=None):
+    """
+    returns a new simulator of model with records for runs runs (prepare being
+    called on it, see runChunkedSimulation), holding the records of the runs
+    of simulator (if not None), whose records are then released
+    """
+    previous = None if simulator is None else getRecords(simulator)
+
+    grown = sc.Simulator(runs, periods, seed, useGlobalTCSettings, normalizeTCs)
+    grown.setModel(model)
+
+    if prepare is not None:
+        prepare(grown)
+
+    if previous is not None:
+        mergeRecords(grown, [(0, simulator.numRuns)], [previous])
+
+    return grown
+
+def truncateRecords(simulator, runs):
+    """
+    keeps the records of the first runs runs of a simulator (views of its
+    matrices, in memory or memory-mapped)
+    """
+    for comp in simulator.getCompartments():
+        for name in ("inflowRecord", "outflowRecord", "inventory", "immediateFlowRecord", "releaseList"):
+            rec = getattr(comp, name, None)
+            if isinstance(rec, dict):
+                setattr(comp, name, {target: values[:runs] for target, values in rec.items()})
+            elif isinstance(rec, np.ndarray) and rec.ndim == 2:
+                setattr(comp, name, rec[:runs])
+        if type(comp) is cp.Stock:
+            comp.localRelease.releaseList = comp.localRelease.releaseList[:runs]
+
+    simulator.numRuns = runs
+
+def summarizeChunk(modelpickle, runs, periods, seed, useGlobalTCSettings=True, normalizeTCs=True,
+                   scale=1, alpha=0.01, first=0):
+    """
+    simulates one chunk of runs of a (pickled) model, returns the accumulated
+    statistics of its series instead of its records
+    """
+    model = pickle.loads(modelpickle)
+    prepareChunk(model, runs, seed, first)
+
+    simulator = sc.Simulator(runs, periods, seed, useGlobalTCSettings, normalizeTCs)
+    simulator.setModel(model)
+    simulator.runSimulation()
+
+    series = st.collectSeries(simulator)
+    accumulator = SummaryAccumulator([s[:3] for s in series], periods, alpha)
+    accumulator.add([s[3]*scale for s in series])
+
+    return accumulator
+
+def runStreamingSimulation(model, RUNS, periods, seed, chunks, processes=None,
+                           useGlobalTCSettings=True, normalizeTCs=True, scale=1, alpha=0.01):
+    """
+    simulates RUNS runs of a model in chunks like runChunkedSimulation, but
+    only keeps the statistics of the series (values multiplied by scale, see
+    StreamingStatistics.SummaryAccumulator): the memory needed depends on the
+    size of the chunks, not on RUNS. Returns the merged accumulator
+    """
+    if chunks < 1 or chunks > RUNS:
+        raise Exception('The number of chunks must be between 1 and the number of runs ({a}), not {b}.'.format(a = RUNS, b = chunks))
+
+    bounds = chunkRuns(RUNS, chunks)
+    seeds = chunkSeeds(seed, chunks)
+    modelpickle = pickle.dumps(model)
+
+    if processes is None:
+        processes = min(chunks, os.cpu_count() or 1)
+
+    args = ([modelpickle]*chunks, [b-a for a, b in bounds], [periods]*chunks, seeds,
+            [useGlobalTCSettings]*chunks, [normalizeTCs]*chunks, [scale]*chunks, [alpha]*chunks,
+            [a for a, b in bounds])
+
+    # the accumulators of the chunks are merged in the order of the chunks
+    def fold(results):
+        accumulator = next(results)
+        for result in results:
+            accumulator.merge(result)
+        return accumulator
+
+    if processes == 1:
+        return fold(map(summarizeChunk, *args))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return fold(pool.map(summarizeChunk, *args))
+
+def runBatch(modelpickle, runs, periods, seed, useGlobalTCSettings=True, normalizeTCs=True,
+             scale=1, alpha=0.01, keepRecords=False, first=0):
+    """
+    simulates one batch of runs of a (pickled) model, returns its records (if
+    keepRecords, otherwise None) and the accumulated statistics of its series
+    """
+    model = pickle.loads(modelpickle)
+    prepareChunk(model, runs, seed, first)
+
+    simulator = sc.Simulator(runs, periods, seed, useGlobalTCSettings, normalizeTCs)
+    simulator.setModel(model)
+    simulator.runSimulation()
+
+    series = st.collectSeries(simulator)
+    accumulator = SummaryAccumulator([s[:3] for s in series], periods, alpha)
+    accumulator.add([s[3]*scale for s in series])
+
+    return (getRecords(simulator) if keepRecords else None), accumulator
+
+def convergenceStatistics(accumulator, cells, quantiles):
+    """
+    mean and quantiles of the cells (indexes of series and periods) of an
+    accumulator, one row per statistic and one column per cell
+    """
+    return np.stack([accumulator.mean[cells].reshape(-1)] + [accumulator.quantile(q)[cells].reshape(-1) for q in quantiles])
+
+def relativeChange(previous, current, resolution):
+    """
+    largest relative change between two sets of statistics (see
+    convergenceStatistics), less the relative resolution of each statistic
+    (a quantile of the sketch moves by a whole bucket at once). Values below a
+    thousandth of the largest value of their statistic are compared to this
+    threshold instead, so that series without mass do not prevent the
+    convergence
+    """
+    floor = np.maximum(1e-3*np.abs(previous).max(axis=1, keepdims=True), TINY)
+    change = np.abs(current-previous)/np.maximum(np.abs(previous), floor) - np.asarray(resolution)[:, None]
+    return float(max(np.max(change), 0))
+
+def runAdaptiveSimulation(model, periods, seed, batch, tolerance, maxRuns, processes=None,
+                          useGlobalTCSettings=True, normalizeTCs=True, scale=1, alpha=0.01,
+                          keys=None, years=None, quantiles=(0.25, 0.75), keepRecords=False, prepare=None):
+    """
+    simulates batches of batch runs of a model until the mean and quantiles of
+    the series keys (all if None) in the periods years (last period if None)
+    change by less than tolerance (relative, see relativeChange) from one
+    batch to the next, or until maxRuns runs. The batches are simulated in
+    parallel like the chunks of runChunkedSimulation, but their statistics are
+    added and checked in order: the number of runs only depends on seed and
+    batch, not on the number of processes.
+    Returns the accumulator of the statistics (see runStreamingSimulation),
+    the simulator with the merged records of all runs (None if not
+    keepRecords, prepare being called on it before the merge) and a dict
+    describing the convergence (number of runs, last relative change, largest
+    relative standard error of the means, ...). The records of each batch are
+    merged into the simulator as soon as the batch is checked, its matrices
+    growing with the runs simulated (see growRecords).
+    With samples taken in the order of the runs (sampling "lhs" or "sobol" or
+    a SampleBank), maxRuns is limited to the length of the samples, the
+    following runs being copies of the first ones
+    """
+    available = sampleRuns(model)
+    if available is not None and available < maxRuns:
+        print("The samples of the model have "+str(available)+" runs, at most "+str(available)+" runs are simulated")
+        maxRuns = available
+    if batch < 1 or maxRuns < batch:
+        raise Exception('The batches must have between 1 and maxRuns ({a}) runs, not {b}.'.format(a = maxRuns, b = batch))
+
+    # the seed of a batch does not depend on the number of batches
+    batches = maxRuns//batch
+    seeds = chunkSeeds(seed, batches)
+    modelpickle = pickle.dumps(model)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+
+    def simulate(first, last):
+        args = ([modelpickle]*(last-first), [batch]*(last-first), [periods]*(last-first), seeds[first:last],
+                [useGlobalTCSettings]*(last-first), [normalizeTCs]*(last-first), [scale]*(last-first),
+                [alpha]*(last-first), [keepRecords]*(last-first), [i*batch for i in range(first, last)])
+        if pool is None:
+            return map(runBatch, *args)
+        return list(pool.map(runBatch, *args))
+
+    # simulator with records for the runs simulated so far, grown when needed
+    simulator = None
+
+    accumulator = None
+    done = 0
+    previous = None
+    change = np.inf
+
+    try:
+        while done < batches and not change < tolerance:
+            # one batch per process at a time
+            for records, result in simulate(done, min(done+processes, batches)):
+                if accumulator is None:
+                    accumulator = result
+                    selected = [i for i, k in enumerate(accumulator.keys) if keys is None or k in keys]
+                    cells = np.ix_(selected, [periods-1] if years is None else list(years))
+                else:
+                    accumulator.merge(result)
+                if keepRecords:
+                    if simulator is None or simulator.numRuns < (done+1)*batch:
+                        simulator = growRecords(simulator, model, min(max((done+1)*batch, 2*done*batch), batches*batch),
+                                                periods, seed, useGlobalTCSettings, normalizeTCs, prepare)
+                    mergeRecords(simulator, [(done*batch, (done+1)*batch)], [records])
+                records = None
+                done += 1
+
+                current = convergenceStatistics(accumulator, cells, quantiles)
+                if previous is not None:
+                    change = relativeChange(previous, current, [0] + [accumulator.gamma-1]*len(quantiles))
+                previous = current
+
+                if change < tolerance:
+                    break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    runs = accumulator.n
+    means = accumulator.mean[cells]
+    stderr = np.sqrt(accumulator.M2[cells]/runs/runs)/np.maximum(np.abs(means), TINY)
+
+    convergence = {"runs": runs,
+                   "maxRuns": maxRuns,
+                   "batch": batch,
+                   "tolerance": tolerance,
+                   "converged": bool(change < tolerance),
+                   "change": float(change),
+                   "stderr": float(stderr[np.abs(means) >= 1e-3*np.abs(means).max()].max())}
+
+    if keepRecords:
+        truncateRecords(simulator, runs)
+
+    return accumulator, simulator, convergence
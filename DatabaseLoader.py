@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Loader reading the model database once per material and keeping its content
+in memory, with indexes for the lookups needed to set up a model
+
+"""
+
+# import necessary packages
+import sqlite3
+import hashlib
+import numpy as np
+
+import Instrumentation as ins
+
+
+class ModelDatabase(object):
+    """
+    reads the tables compartments, transfercoefficients, input and lifetimes
+    of a database for one material in a single pass. The tables are stored as
+    columnar arrays (same column positions as in the database), rows are
+    accessed through dictionaries of row indices:
+        tcindex[(comp1, comp2, year)], tcrows[(comp1, comp2)],
+        inputindex[(comp, year)], inputrows[comp]
+    """
+
+    def __init__(self, pathtoDB, mat):
+
+        self.mat = mat
+
+        # open database
+        connection = sqlite3.connect(pathtoDB)
+        ins.traceConnection(connection)
+        cursor = connection.cursor()
+
+        # years and compartments with data, over all materials
+        cursor.execute("SELECT DISTINCT year FROM input")
+        self.years_input = [r[0] for r in cursor.fetchall()]
+
+        cursor.execute("SELECT DISTINCT year FROM transfercoefficients")
+        self.years_tc = [r[0] for r in cursor.fetchall()]
+
+        cursor.execute("SELECT DISTINCT comp1 FROM transfercoefficients")
+        self.outflowlist = [r[0] for r in cursor.fetchall()]
+
+        cursor.execute("SELECT DISTINCT comp FROM input")
+        self.inputlist = [r[0] for r in cursor.fetchall()]
+
+        # compartments
+        cursor.execute("SELECT DISTINCT * FROM compartments")
+        self.complist = cursor.fetchall()
+
+        # lifetimes (not material specific)
+        cursor.execute("SELECT * FROM lifetimes")
+        lifetimes = cursor.fetchall()
+
+        # transfer coefficients and inputs of the material
+        cursor.execute("SELECT * FROM transfercoefficients WHERE mat = ?", (mat,))
+        tcs = cursor.fetchall()
+
+        cursor.execute("SELECT * FROM input WHERE mat = ?", (mat,))
+        inputs = cursor.fetchall()
+
+        # close connection
+        connection.close()
+
+        # hash of all the content used for the material, to recognize an
+        # unchanged database
+        self.fingerprint = hashlib.sha256(repr((mat, self.years_input, self.years_tc, self.outflowlist,
+                                                self.inputlist, self.complist, lifetimes, tcs, inputs)).encode()).hexdigest()
+
+        ### COLUMNAR STORAGE
+
+        self.stocklist = list(dict.fromkeys(r[1] for r in lifetimes))
+
+        self.lifetimes = {}
+        for r in lifetimes:
+            self.lifetimes.setdefault(r[1], []).append(r[3])
+
+        # values are kept as objects, since TCs can be "rest"
+        self.tc = {"comp1":    np.asarray([r[1] for r in tcs], dtype=object),
+                   "comp2":    np.asarray([r[2] for r in tcs], dtype=object),
+                   "year":     np.asarray([r[3] for r in tcs]),
+                   "value":    np.asarray([r[5] for r in tcs], dtype=object),
+                   "priority": np.asarray([r[6] for r in tcs]),
+                   "dqis":     np.asarray([r[7:12] for r in tcs], dtype=float).reshape(-1, 5),
+                   "source":   np.asarray([r[12] for r in tcs], dtype=object)}
+
+        self.input = {"comp":   np.asarray([r[1] for r in inputs], dtype=object),
+                      "year":   np.asarray([r[2] for r in inputs]),
+                      "value":  np.asarray([r[4] for r in inputs], dtype=float),
+                      "dqis":   np.asarray([r[5:10] for r in inputs], dtype=float).reshape(-1, 5),
+                      "source": np.asarray([r[10] for r in inputs], dtype=object)}
+
+        ### INDEXES
+
+        self.tcindex = {}
+        self.tcrows = {}
+
+        # destinations of each compartment, in order of appearance
+        self.destinations = {}
+
+        for i, r in enumerate(tcs):
+            self.tcindex.setdefault((r[1], r[2], r[3]), []).append(i)
+            self.tcrows.setdefault((r[1], r[2]), []).append(i)
+            self.destinations.setdefault(r[1], {})[r[2]] = True
+
+        self.destinations = {c: list(d) for c, d in self.destinations.items()}
+
+        self.inputindex = {}
+        self.inputrows = {}
+
+        for i, r in enumerate(inputs):
+            self.inputindex.setdefault((r[1], r[2]), []).append(i)
+            self.inputrows.setdefault(r[1], []).append(i)
+
+    def getDestinations(self, comp):
+        """
+        returns the destination compartments of comp
+        """
+        return self.destinations.get(comp, [])
+
+    def getNonzeroDestinations(self, comp):
+        """
+        returns the destination compartments of comp with a TC different from
+        zero for at least one year
+        """
+        return [dest for dest in self.getDestinations(comp)
+                if any(x != 0 for x in self.tc["value"][self.tcrows[(comp, dest)]])]
+
+    def getInputValues(self, comp):
+        """
+        returns all input values of compartment comp
+        """
+        return self.input["value"][self.inputrows.get(comp, [])]
+
+    def getInputCompartments(self, nonzero=False):
+        """
+        returns the compartments with inputs for the material, in order of
+        appearance (only those with a nonzero input if nonzero is True)
+        """
+        comps = self.input["comp"]
+        if nonzero:
+            comps = comps[self.input["value"] != 0]
+        return list(dict.fromkeys(comps))
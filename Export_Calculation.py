@@ -9,14 +9,27 @@ from time import localtime, strftime
 
 from dpmfa import components as cp
 from dpmfa import model as mod
-from dpmfa import simulator as sc
+
+from DatabaseLoader import ModelDatabase
+import ModelGraph as mg
+import MassBalance as mb
+import Instrumentation as ins
    
 # open database
 #pathtoDB = os.path.join("data_casestudy","DPMFA_Plastic_EU_inclExport.db")
 pathtoDB = os.path.join("data_casestudy","DPMFA_Plastic_CH_inclExport.db")
 connection = sqlite3.connect(pathtoDB)
+ins.traceConnection(connection)
 cursor = connection.cursor()
 
+# indexes for the lookups of transfer coefficients and inputs by compartment
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_tc_comps ON transfercoefficients (comp1, comp2, mat, year)")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_input_comp ON input (comp, mat, year)")
+
+# statement for inserting transfer coefficients
+insert_tc = """INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
+
 
 # set material
 mat = "LDPE"
@@ -30,6 +43,7 @@ mat = "LDPE"
 #for mat in ["LDPE", "HDPE", "PP", "PS", "EPS", "PVC", "PET"]
     
 print("\n\n"+strftime("%H:%M:%S", localtime())+" Starting export calculation for "+mat+"...\n")
+ins.begin("ExportCalculation")
 
 # create model
 model = mod.Model("Export calculation "+mat)
@@ -54,6 +68,7 @@ periodRange = np.arange(0,endYear-startYear+1)
 ### COMPARTMENT DEFINITION
 
 print(strftime("%H:%M:%S", localtime())+" Inserting compartments")
+ins.begin("compartments")
 
 # extract possible compartment names from database
 cursor.execute("SELECT DISTINCT * FROM compartments")
@@ -96,13 +111,15 @@ for i in np.arange(len(complist)):
 
 ### FLOW DEFINITION
 
+ins.end("compartments")
 print(strftime("%H:%M:%S", localtime())+" Inserting transfers")
+ins.begin("transfers")
 
 # loop over compartments with a defined outflow
 for comp in outflowlist:
     
     # extract destination compartments
-    cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1='"+comp+"' AND mat = '"+mat+"')")
+    cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1 = ? AND mat = ?)", (comp, mat))
     destlist = cursor.fetchall()
     # flatten the list
     destlist = [item for sublist in destlist for item in sublist]
@@ -126,7 +143,7 @@ for comp in outflowlist:
         destname = complist[ind][0]
         
         # import data
-        cursor.execute("SELECT * FROM transfercoefficients WHERE (comp1 = '"+comp+"' AND comp2 = '"+dest+"' AND mat = '"+mat+"')")
+        cursor.execute("SELECT * FROM transfercoefficients WHERE (comp1 = ? AND comp2 = ? AND mat = ?)", (comp, dest, mat))
         df = cursor.fetchall()
         
         # create vectors
@@ -192,115 +209,15 @@ for comp in outflowlist:
 
 ### CLEAN OUT LIST OF COMPARTMENTS
 
+ins.end("transfers")
 print(strftime("%H:%M:%S", localtime())+" Cleaning compartments")
+ins.begin("clean-out")
 
 # check if some compartments are empty, if yes remove to avoid bugs (mormalization of zero TCs does not work)
-cursor.execute("SELECT DISTINCT comp FROM input WHERE mat = '"+mat+"' AND NOT value = 0")
-inputlist = cursor.fetchall()
-inputlist = [item for sublist in inputlist for item in sublist]
-
-complog = {c:False for c in [l[1] for l in complist]}
-
-for comp in inputlist:
-   
-    # check if inflow is not zero for any period
-    cursor.execute("SELECT value FROM input WHERE comp='"+comp+"' AND mat='"+mat+"'")        
-    data = cursor.fetchall()
-    data = [item for sublist in data for item in sublist]
-    
-    # skip compartment if there is no input
-    if not any(x != 0 for x in data):
-        continue
-        
-    # else do not clean out compartment
-    complog[comp] = True
-    
-    # loop over destination compartments
-    cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1='"+comp+"' AND NOT value == 0 AND mat = '"+mat+"')")
-    comptoanalyze = cursor.fetchall()
-    comptoanalyze = [item for sublist in comptoanalyze for item in sublist]
-    
-    # list for storing compartments already analyzed
-    companalyzed = []
-    companalyzed.append(comp)
-    
-    # start while loop at comp
-    startcomp = comp
-    
-    while len(comptoanalyze) != 0:
-        
-        # copy for loop
-        comploop = comptoanalyze
-        
-        # loop over compartments
-        for startcomp in comploop:
-            
-            # loop over destination compartments
-            cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1='"+startcomp+"' AND mat = '"+mat+"' AND NOT value == 0)")
-            dest = cursor.fetchall()
-            dest = [item for sublist in dest for item in sublist]
-            
-            # append startcomp to companalyzed
-            companalyzed.append(startcomp)
-            
-            # if no destination compartments, move on
-            if len(dest) == 0:
-                continue
-            
-            # else look at destination compartments closer
-            for endcomp in dest:
-                
-                # check only if wasn't checked earlier
-                if endcomp in companalyzed:
-                    continue
-                
-                # import data
-                cursor.execute("SELECT value FROM transfercoefficients WHERE (comp1 = '"+startcomp+"' AND comp2 = '"+endcomp+"' AND mat = '"+mat+"')")
-                data = cursor.fetchall()
-                data = [item for sublist in data for item in sublist]
-                
-                # check if any data point is not zero, if yes, mark as not for cleaning out
-                if any(x != 0 for x in data):
-                        
-                    complog[endcomp] = True
-                    
-                    # add destinations from that compartment to comptoanalyze
-                    cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1 = '"+endcomp+"' AND mat = '"+mat+"' AND NOT value == 0)")
-                    otherdest = cursor.fetchall()
-                    otherdest = [item for sublist in otherdest for item in sublist]
-                    comptoanalyze = comptoanalyze + otherdest
-                
-                # remove from comptoanalyze
-                comptoanalyze = [x for x in comptoanalyze if x != endcomp]
-                
-                # remove duplicates
-                comptoanalyze = list(set(comptoanalyze))
-            
-            # add all intermediate destinations to companalyzed
-            companalyzed = list(set(companalyzed + dest))
-        
-        # remove comps already analyzed
-        comptoanalyze = [x for x in comptoanalyze if not x in companalyzed]
-
+complog = mg.ReachableCompartments(ModelDatabase(pathtoDB, mat))
 
-# remove from dictionary
-for i in np.arange(len(complist)):
-    
-    # remove compartment from dictionary if not in log
-    if not complog[complist[i][1]]:
-        CompartmentDict.pop(complist[i][0])
-    
-    else:
-        
-        if isinstance(CompartmentDict[complist[i][0]], cp.Sink):
-            continue
-        
-        # remove transfers from dictionary if target is not in log
-        transfers = CompartmentDict[complist[i][0]].transfers
-        
-        for dest in [t.target.name for t in transfers]:
-            if not complog[dest]:
-                CompartmentDict[complist[i][0]].transfers = [x for x in CompartmentDict[complist[i][0]].transfers if complog[x.target.name]]
+# remove empty compartments and transfers to them from dictionary
+mg.CleanOutCompartments(CompartmentDict, complist, complog)
 
 print("")
 
@@ -308,7 +225,9 @@ print("")
 
 ### LIFETIMES DEFINITION
 
+ins.end("clean-out")
 print(strftime("%H:%M:%S", localtime())+" Inserting lifetimes")
+ins.begin("lifetimes")
 
 # extract list of compartments with input
 cursor.execute("SELECT * FROM lifetimes")
@@ -344,13 +263,19 @@ model.setCompartments(CompartmentList)
 
 ### INPUT DEFINITION
 
+ins.end("lifetimes")
 print(strftime("%H:%M:%S", localtime())+" Inserting input and calculating trade")
+ins.begin("trade")
 
 # extract list of compartments with input
 cursor.execute("SELECT DISTINCT comp FROM input")
 inputlist = cursor.fetchall()
 inputlist = [item for sublist in inputlist for item in sublist]
 
+# export TCs calculated, inserted into the database all at once at the end
+# (one tuple of values of insert_tc per TC)
+exportrows = []
+
 # define order in which export should be calculated
 comporder = ['Recycled Material Production',
              'Primary Production',
@@ -381,7 +306,7 @@ for compname in comporder:
     comp = CompartmentDict[compfull]
 
     # check if any input data is negative
-    cursor.execute("SELECT value FROM input WHERE comp='"+compname+"' AND mat='"+mat+"'")        
+    cursor.execute("SELECT value FROM input WHERE comp = ? AND mat = ?", (compname, mat))        
     data = cursor.fetchall()
     data = [item for sublist in data for item in sublist]
     
@@ -394,7 +319,7 @@ for compname in comporder:
     else:
         
         # import data from database for compartment compname and material mat
-        cursor.execute("SELECT * FROM input WHERE comp='"+compname+"' AND mat='"+mat+"'")        
+        cursor.execute("SELECT * FROM input WHERE comp = ? AND mat = ?", (compname, mat))        
         data = cursor.fetchall()
         
         # one entry per year (combining multiple years into one entry)
@@ -427,7 +352,7 @@ for compname in comporder:
                 continue
             
             # load input data for other comp
-            cursor.execute("SELECT * FROM input WHERE comp='"+othercomp+"' AND mat='"+mat+"'")        
+            cursor.execute("SELECT * FROM input WHERE comp = ? AND mat = ?", (othercomp, mat))        
             datacomp = cursor.fetchall()
             
             # one entry per year (averaging multiple years into one entry)
@@ -444,8 +369,8 @@ for compname in comporder:
             tempmodel.addInflow(cp.ExternalListInflow(CompartmentDict[othercompfull], [cp.FixedValueInflow(d) for d in values]))
             
         
-        # perform dpmfa
-        simulator = sc.Simulator(1, len(periodRange), 2250, True, True) # 2250 is just a seed
+        # perform the mass balance (all inputs and TCs are fixed values)
+        simulator = mb.DeterministicSimulator(len(periodRange), True, True)
         simulator.setModel(tempmodel)
         simulator.runSimulation()
         
@@ -476,29 +401,13 @@ for compname in comporder:
                         print("WARNING: The export flow from "+compname+" should have been "+str(round(-expcomp[i][0][4]/masscomp[0][i],3))+" (higher than 1) but was replaced by 1 (year "+str(i+startYear)+", comp="+str(round(masscomp[0][i]*1000,3))+", export="+str(round(-expcomp[i][0][4]*1000,3))+").")
                     
                     # implement into database
-                    format_str = """INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
-                    VALUES ("{c1}", "{c2}", "{y}", "{mt}", "{val}", "{prio}", "{DQ1}", "{DQ2}", "{DQ3}", "{DQ4}", "{DQ5}", "{src}");"""
-                    
-                    sql_command = format_str.format(c1 = compname,
-                                                    c2 = "Export",
-                                                    y = i+startYear,
-                                                    mt = mat,
-                                                    val = TC,
-                                                    prio = 3,
-                                                    DQ1 = expcomp[i][0][5],
-                                                    DQ2 = expcomp[i][0][6],
-                                                    DQ3 = expcomp[i][0][7], 
-                                                    DQ4 = expcomp[i][0][8],
-                                                    DQ5 = expcomp[i][0][9],
-                                                    src = expcomp[i][0][10])
-                    
-                    cursor.execute(sql_command)
+                    exportrows.append((compname, "Export", int(i+startYear), mat, float(TC), 3) + tuple(expcomp[i][0][5:11]))
                 
                 
                 # otherwise: if two datapoints in database
                 else:
                     
-                    TC = [-expcomp[i][0][4]/masscomp[0][i],-expcomp[i][1][4]/masscomp[0][i]]
+                    TC = np.array([-expcomp[i][0][4]/masscomp[0][i],-expcomp[i][1][4]/masscomp[0][i]])
                     TClist.append(np.mean(TC))
                     
                     if any(TC < 0):
@@ -510,44 +419,11 @@ for compname in comporder:
                         raise Exception("Error 3 in Export calculation")
                     
                     # implement into database
-                    format_str = """INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
-                    VALUES ("{c1}", "{c2}", "{y}", "{mt}", "{val}", "{prio}", "{DQ1}", "{DQ2}", "{DQ3}", "{DQ4}", "{DQ5}", "{src}");"""
-                    
-                    sql_command = format_str.format(c1 = compname,
-                                                    c2 = "Export",
-                                                    y = i+startYear,
-                                                    mt = mat,
-                                                    val = TC[0],
-                                                    prio = 3,
-                                                    DQ1 = expcomp[i][0][5],
-                                                    DQ2 = expcomp[i][0][6],
-                                                    DQ3 = expcomp[i][0][7], 
-                                                    DQ4 = expcomp[i][0][8],
-                                                    DQ5 = expcomp[i][0][9],
-                                                    src = expcomp[i][0][10])
-                    
-                    cursor.execute(sql_command)
-                    
-                    format_str = """INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
-                    VALUES ("{c1}", "{c2}", "{y}", "{mt}", "{val}", "{prio}", "{DQ1}", "{DQ2}", "{DQ3}", "{DQ4}", "{DQ5}", "{src}");"""
-                    
-                    sql_command = format_str.format(c1 = compname,
-                                                    c2 = "Export",
-                                                    y = i+startYear,
-                                                    mt = mat,
-                                                    val = TC[1],
-                                                    prio = 3,
-                                                    DQ1 = expcomp[i][1][5],
-                                                    DQ2 = expcomp[i][1][6],
-                                                    DQ3 = expcomp[i][1][7], 
-                                                    DQ4 = expcomp[i][1][8],
-                                                    DQ5 = expcomp[i][1][9],
-                                                    src = expcomp[i][1][10])
-                    
-                    cursor.execute(sql_command)
+                    exportrows.append((compname, "Export", int(i+startYear), mat, float(TC[0]), 3) + tuple(expcomp[i][0][5:11]))
+                    exportrows.append((compname, "Export", int(i+startYear), mat, float(TC[1]), 3) + tuple(expcomp[i][1][5:11]))
         
         # replace negative entries of net import by zero
-        cursor.execute("UPDATE input SET value = 0 WHERE (comp = '"+compname+"' AND value < 0 AND mat = '"+mat+"');")
+        cursor.execute("UPDATE input SET value = 0 WHERE (comp = ? AND value < 0 AND mat = ?);", (compname, mat))
         
         # add export flow into model
         CompartmentDict[compfull].transfers.append(cp.TimeDependentDistributionTransfer([cp.TransferConstant(t) for t in TClist],
@@ -571,60 +447,32 @@ for compname in comporder:
 
 ### FINAL CORRECTION FOR EXPORT FLOWS
 
-# for every export TC calculated, fill up the database with "0" for the years where no export takes place
-
-# get a list of all compartments with an export flow
-cursor.execute("SELECT DISTINCT comp1 FROM transfercoefficients WHERE comp2='Export' AND mat='"+mat+"'")        
-expcomps = cursor.fetchall()
-expcomps = [item for sublist in expcomps for item in sublist]
-
-for comp in expcomps:
-    
-    cursor.execute("SELECT DISTINCT year FROM transfercoefficients WHERE comp1='"+comp+"' AND comp2='Export' AND mat='"+mat+"'")        
-    data = cursor.fetchall()
-    data = [item for sublist in data for item in sublist]
-    
-    # if there is data for each year, skip
-    if all(elem in data for elem in np.arange(startYear,endYear+1)):
-        continue
-    
-    for i in np.arange(startYear,endYear+1):
-        
-        # check if data in database
-        cursor.execute("SELECT * FROM transfercoefficients WHERE comp1='"+comp+"' AND comp2='Export' AND mat='"+mat+"' AND year="+str(i))        
-        data = cursor.fetchall()
-        
-        if len(data) != 0:
-            continue
-        
-        else:
-            
-            # get priority from remaining data
-            cursor.execute("SELECT DISTINCT priority FROM transfercoefficients WHERE comp1='"+comp+"' AND comp2='Export' AND mat='"+mat+"'")        
-            prio = cursor.fetchall()
-            
-            # insert zeroes into database
-            format_str = """INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
-            VALUES ("{c1}", "{c2}", "{y}", "{mt}", "{val}", "{prio}", "{DQ1}", "{DQ2}", "{DQ3}", "{DQ4}", "{DQ5}", "{src}");"""
-            
-            sql_command = format_str.format(c1 = comp,
-                                            c2 = "Export",
-                                            y = i,
-                                            mt = mat,
-                                            val = 0,
-                                            prio = prio[0][0],
-                                            DQ1 = 0,
-                                            DQ2 = 0,
-                                            DQ3 = 0, 
-                                            DQ4 = 0,
-                                            DQ5 = 0,
-                                            src = "Export calculation")
-            
-            cursor.execute(sql_command)
-
-# commit changes
+ins.end("trade")
+ins.begin("database-write")
+
+# insert all export TCs calculated
+cursor.executemany(insert_tc, exportrows)
+
+# for every export TC calculated, fill up the database with "0" for the years where no export takes place:
+# all pairs (compartment with an export flow, year) except those already in the database
+cursor.execute("""WITH RECURSIVE years(year) AS (SELECT ? UNION ALL SELECT year+1 FROM years WHERE year < ?),
+                  exports(comp1, priority) AS (SELECT comp1, MIN(priority) FROM transfercoefficients
+                                               WHERE comp2 = 'Export' AND mat = ? GROUP BY comp1),
+                  missing(comp1, year) AS (SELECT comp1, year FROM exports, years
+                                           EXCEPT
+                                           SELECT comp1, year FROM transfercoefficients WHERE comp2 = 'Export' AND mat = ?)
+                  INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
+                  SELECT missing.comp1, 'Export', missing.year, ?, 0, exports.priority, 0, 0, 0, 0, 0, 'Export calculation'
+                  FROM missing JOIN exports ON missing.comp1 = exports.comp1
+                  ORDER BY missing.comp1, missing.year;""",
+               (int(startYear), int(endYear), mat, mat, mat))
+
+# commit changes (all changes above are part of a single transaction)
 connection.commit()
   
 # close connection
 connection.close()
 
+ins.end("database-write")
+ins.end("ExportCalculation")
+
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling of the transfers and inflows of a model, each from its own stream
+(derived from a seed and its key), so that its samples do not depend on the
+other transfers and inflows, and samples of the last build of a model, with a
+fingerprint of each, so that a new build only resamples the transfers and
+inflows whose data changed. Only the sampling is skipped: the rest of the
+build (database, pedigree, clean-out) is done again, and the state file keeps
+a copy of the samples of the model
+
+"""
+
+# import necessary packages
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+import numpy.random as nr
+
+import TruncatingFunctions as tr
+from SampleBank import streamName
+
+
+def streamSeed(seed, key):
+    """
+    seed of the stream of the transfer or inflow key
+    """
+    entropy = int.from_bytes(hashlib.sha256(streamName(key).encode()).digest()[:8], "little")
+    return int(np.random.SeedSequence([seed, entropy]).generate_state(1)[0])
+
+def sampleGroups(groups, distparams, RUNS, method, seed, samples = None):
+    """
+    samples RUNS values of the distributions distparams of each group (tuple
+    (key, rows of distparams)) from the stream of its key, with the sampling
+    method of TruncatingFunctions.Uniforms, into the sample matrix samples
+    (new if None). Returns the sample matrix
+    """
+    if samples is None:
+        samples = np.empty((len(distparams), RUNS))
+
+    for key, rows in groups:
+        nr.seed(streamSeed(seed, key))
+        samples[rows] = tr.SampleDistributions([distparams[r] for r in rows], RUNS, method)
+
+    return samples
+
+
+class BuildState(object):
+    """
+    samples of the last build by transfer or inflow (key), with the
+    fingerprint of the parameters of their distributions
+    """
+
+    def __init__(self):
+
+        # key -> (fingerprint, samples with one row per distribution)
+        self.samples = {}
+
+        # keys resampled during the last build
+        self.resampled = []
+
+    def fingerprint(self, params, RUNS, method, seed):
+        """
+        fingerprint of the distributions params (list of tuples, see
+        TruncatingFunctions.SampleDistributions) sampled RUNS times with method
+        from the streams of seed
+        """
+        return hashlib.sha256(repr((RUNS, tr.SAMPLER_VERSION, method, seed, params)).encode()).hexdigest()
+
+    def sample(self, groups, distparams, RUNS, method, seed):
+        """
+        returns the sample matrix of the distributions distparams, groups being
+        a list of tuples (key, rows of distparams) of all transfers and inflows.
+        The rows of a group with the same fingerprint as in the last build are
+        taken from it, the other groups are sampled (see sampleGroups), the
+        samples are thus the same as without state
+        """
+        samples = np.empty((len(distparams), RUNS))
+        fingerprints = {}
+        self.resampled = []
+
+        for key, rows in groups:
+            fingerprints[key] = self.fingerprint([distparams[r] for r in rows], RUNS, method, seed)
+
+            if key in self.samples and self.samples[key][0] == fingerprints[key]:
+                samples[rows] = self.samples[key][1]
+            else:
+                self.resampled.append(key)
+
+        sampleGroups([(key, rows) for key, rows in groups if key in self.resampled], distparams, RUNS, method, seed, samples)
+
+        # keep the samples of this build for the next one
+        self.samples = {key: (fingerprints[key], samples[rows]) for key, rows in groups}
+
+        return samples
+
+    def save(self, path):
+        """
+        writes the state into the file path
+        """
+        handle, temp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = ".tmp")
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump(self.samples, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+
+def loadState(path):
+    """
+    reads a state written with BuildState.save, returns an empty state if the
+    file does not exist or cannot be read
+    """
+    state = BuildState()
+    try:
+        with open(path, "rb") as f:
+            state.samples = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+    return state
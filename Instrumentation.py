@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Light instrumentation of the model pipeline: timed spans (nested), counters
+(e.g. SQL queries and samples drawn) and snapshots of the peak memory of the
+process, written as a json trace. Disabled by default, all functions then
+return at once. Enabled with enable() or by setting the environment variable
+PIPELINE_TRACE to the path of the trace, written when the process ends.
+Only the calling process is traced (not the worker processes)
+
+"""
+
+# import necessary packages
+import os
+import sys
+import json
+import time
+import atexit
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, no memory snapshots
+    resource = None
+
+# trace being recorded, None when disabled
+_trace = None
+
+# span returned when disabled
+NOSPAN = contextlib.nullcontext()
+
+
+class Trace(object):
+    """
+    spans, counters and memory snapshots recorded since its creation
+    """
+
+    def __init__(self):
+
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.snapshots = []
+
+        # open spans: (name, start)
+        self.stack = []
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def begin(self, name):
+        self.stack.append((name, self.now()))
+
+    def end(self, name):
+        if len(self.stack) == 0 or self.stack[-1][0] != name:
+            raise Exception('Span "{a}" ended while "{b}" is open.'.format(a = name, b = self.stack[-1][0] if self.stack else None))
+
+        start = self.stack.pop()[1]
+        self.spans.append({"name": name,
+                           "path": "/".join([s[0] for s in self.stack] + [name]),
+                           "start": start,
+                           "seconds": self.now() - start,
+                           "peak_rss_bytes": peakRSS()})
+
+    def close(self, name):
+        """
+        ends the span name and the spans opened within it that are still
+        open (left by an exception)
+        """
+        if name not in [s[0] for s in self.stack]:
+            return
+        while self.stack[-1][0] != name:
+            self.end(self.stack[-1][0])
+        self.end(name)
+
+    def table(self):
+        return {"spans": sorted(self.spans, key = lambda s: s["start"]),
+                "counters": self.counters,
+                "snapshots": self.snapshots}
+
+
+def peakRSS():
+    """
+    peak resident memory of the process in bytes (None if unknown)
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss*1024
+
+def enable():
+    """
+    starts a new trace
+    """
+    global _trace
+    _trace = Trace()
+
+def disable():
+    """
+    stops the trace, returns it (None if there was none)
+    """
+    global _trace
+    trace, _trace = _trace, None
+    return trace
+
+def enabled():
+    return _trace is not None
+
+def begin(name):
+    """
+    opens the span name (closed with end, for sections of long functions)
+    """
+    if _trace is not None:
+        _trace.begin(name)
+
+def end(name):
+    """
+    closes the span name, the last one opened
+    """
+    if _trace is not None:
+        _trace.end(name)
+
+@contextlib.contextmanager
+def _span(name):
+    _trace.begin(name)
+    try:
+        yield
+    finally:
+        if _trace is not None:
+            _trace.close(name)
+
+def span(name):
+    """
+    context manager timing the code it contains as span name
+    """
+    if _trace is None:
+        return NOSPAN
+    return _span(name)
+
+def count(name, n = 1):
+    """
+    adds n to the counter name
+    """
+    if _trace is not None:
+        _trace.counters[name] = _trace.counters.get(name, 0) + n
+
+def snapshot(label):
+    """
+    records the peak memory of the process at this point
+    """
+    if _trace is not None:
+        _trace.snapshots.append({"label": label, "time": _trace.now(), "peak_rss_bytes": peakRSS()})
+
+def traceConnection(connection):
+    """
+    counts the SQL statements executed on a sqlite3 connection (counter
+    sql_queries)
+    """
+    if _trace is not None:
+        connection.set_trace_callback(lambda statement: count("sql_queries"))
+
+def writeTrace(path, metadata = None):
+    """
+    writes the trace recorded so far into the json file path
+    """
+    if _trace is None:
+        return
+    with open(path, "w") as f:
+        json.dump(dict({"metadata": metadata or {}}, **_trace.table()), f, indent = 1)
+
+
+# trace of the whole process, if requested through the environment (not in
+# the worker processes, that inherit the environment)
+if os.environ.get("PIPELINE_TRACE") and multiprocessing.parent_process() is None:
+    enable()
+    atexit.register(lambda: writeTrace(os.environ["PIPELINE_TRACE"], {"pid": os.getpid()}))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic mass balance of a model: a single run of the simulation, where
+the flows of all compartments and periods, including the delayed releases of
+the stocks, are obtained with one sparse linear solve
+
+"""
+
+# import necessary packages
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as spla
+
+from dpmfa import simulator as sc
+from dpmfa import components as cp
+
+
+def EffectiveReleaseRates(stock):
+    """
+    share of the amount stored in a stock that is released in the period of
+    storage (first entry) and in each following period, as scheduled by the
+    LocalRelease of the stock (release rates limited to the remaining amount)
+    """
+    rates = np.asarray(stock.localRelease.releaseRatesList, dtype=float)
+
+    effective = np.zeros(len(rates))
+    effective[0] = rates[0]
+    remainder = 1 - rates[0]
+    for i in range(1, len(rates)):
+        effective[i] = min(rates[i], remainder)
+        remainder = remainder - effective[i]
+
+    return effective
+
+
+class DeterministicSimulator(sc.Simulator):
+    """
+    one run of a model, giving the same records as sc.Simulator with one run
+    (getLoggedInflows, getLoggedTotalOutflows, getStocks, ...). The TCs and
+    inflows are determined like in sc.Simulator, the mass balance of all
+    periods is then solved at once with a sparse system
+    """
+
+    def __init__(self, periods, useGlobalTCSettings=True, normalizeTCs=True, seed=2250):
+        super(DeterministicSimulator, self).__init__(1, periods, seed, useGlobalTCSettings, normalizeTCs)
+
+    def runSimulation(self):
+        """
+        performs the simulation on the model
+        """
+        T = self.numPeriods
+        n = len(self.compartments)
+
+        # sample TCs and inflows in the same order as sc.Simulator
+        for comp in self.flowCompartments:
+            comp.determineTCs(self.useGlobalTCSettings, self.normalizeTCs)
+        for infl in self.inflows:
+            infl.sampleValues()
+        for stock in self.stocks:
+            stock.determineTCs(self.useGlobalTCSettings, self.normalizeTCs)
+
+        ### TCS AND INFLOWS OF ALL PERIODS
+
+        # one edge per transfer
+        edges = [(comp, trans) for comp in self.flowCompartments for trans in comp.transfers]
+        src = np.asarray([comp.compNumber for comp, trans in edges], dtype=int)
+        tgt = np.asarray([trans.target.compNumber for comp, trans in edges], dtype=int)
+
+        TCs = np.zeros((len(edges), T))
+        for period in range(T):
+            for comp in self.flowCompartments:
+                comp.updateTCs(period)
+            TCs[:, period] = [trans.getCurrentTC() for comp, trans in edges]
+
+        inflows = np.zeros((n, T))
+        for inflow in self.inflows:
+            for period in range(T):
+                inflows[inflow.target.compNumber, period] += inflow.getCurrentInflow(period)
+
+        # immediate release rate of each compartment (1 except for stocks)
+        immediate = np.ones(n)
+        for comp in self.flowCompartments:
+            immediate[comp.compNumber] = comp.immediateReleaseRate
+
+        isStock = np.zeros(n, dtype=bool)
+        isStock[[stock.compNumber for stock in self.stocks]] = True
+
+        # release rates of the stocks in the periods following the storage
+        rates = {stock.compNumber: EffectiveReleaseRates(stock)[1:] for stock in self.stocks}
+
+        ### MASS BALANCE OF ALL PERIODS
+
+        # the flows x of all compartments and periods (index period*n + comp)
+        # solve one sparse system x - A x = inflows: A contains the immediate
+        # flows within a period and the releases of the stocks, which depend
+        # on the amounts stored in the previous periods
+        rows = [np.arange(n*T)]
+        cols = [np.arange(n*T)]
+        vals = [np.ones(n*T)]
+
+        periods = np.arange(T)
+        rows.append((tgt[:, None] + periods*n).reshape(-1))
+        cols.append((src[:, None] + periods*n).reshape(-1))
+        vals.append(-(TCs*immediate[src][:, None]).reshape(-1))
+
+        for e in np.flatnonzero(isStock[src]):
+            r = rates[src[e]]
+            if len(r) == 0:
+                continue
+            # pairs (period of release t, period of storage k), lag t-k from 1 to len(r)
+            t, k = np.nonzero((periods[:, None] - periods[None, :] >= 1) &
+                              (periods[:, None] - periods[None, :] <= len(r)))
+            rows.append(tgt[e] + t*n)
+            cols.append(src[e] + k*n)
+            vals.append(-TCs[e, t]*r[t-k-1])
+
+        M = sparse.csc_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n*T, n*T))
+        solution = spla.spsolve(M, inflows.T.reshape(-1)).reshape(T, n).T
+
+        # releases from the stocks in each period
+        releases = np.zeros((n, T))
+        for s, r in rates.items():
+            releases[s] = np.convolve(solution[s], np.concatenate([[0], r]))[:T]
+
+        outflows = TCs*(releases[src] + solution[src]*immediate[src][:, None])
+
+        # inventories of the sinks and stocks
+        stored = np.where(isStock[:, None], solution*(1-immediate[:, None]) - releases, solution)
+        inventory = np.cumsum(stored, axis=1)
+
+        ### RECORDS
+
+        for comp in self.compartments:
+            if getattr(comp, "logInflows", False):
+                comp.inflowRecord[0] = solution[comp.compNumber]
+            if isinstance(comp, cp.Sink):
+                comp.inventory[0] = inventory[comp.compNumber]
+
+        for e, (comp, trans) in enumerate(edges):
+            if comp.logOutflows:
+                comp.outflowRecord[trans.target.name][0] = outflows[e]
+            if type(comp) is cp.Stock and comp.logImmediateFlows:
+                comp.immediateFlowRecord[trans.target.name][0] = TCs[e]*solution[comp.compNumber]*comp.immediateReleaseRate
+
+        for stock in self.stocks:
+            stock.localRelease.releaseList[0] = releases[stock.compNumber]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the models built with setupModel, stored on disk under a hash of the
+content of the database for the material and of the build parameters, the
+least recently used models being deleted above a disk budget
+
+"""
+
+# import necessary packages
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy.random as nr
+
+import setup_model_new as su
+import IncrementalBuild as ib
+import TruncatingFunctions as tr
+from DatabaseLoader import ModelDatabase
+
+
+class ModelCache(object):
+    """
+    stores pickled models in directory, using at most budget bytes
+    """
+
+    def __init__(self, directory, budget = 2*1024**3):
+
+        self.directory = directory
+        self.budget = budget
+
+        os.makedirs(directory, exist_ok = True)
+
+    def key(self, data, modelname, RUNS, startYear, endYear, seed, sampling = "random", bank = None, resample = False):
+        """
+        key of a model built from data (a ModelDatabase) with these parameters
+        """
+        return hashlib.sha256(repr((data.fingerprint, modelname, RUNS, data.mat, startYear, endYear,
+                                    seed, sampling, None if bank is None else bank.seed, resample,
+                                    tr.SAMPLER_VERSION)).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key+".pkl")
+
+    def get(self, key):
+        """
+        returns the model stored under key, None if there is none
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                model = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+        return model
+
+    def put(self, key, model):
+        """
+        stores model under key, then deletes the least recently used models if
+        the cache exceeds its budget
+        """
+        # written to a temporary file first, so that other processes never
+        # read a partial model
+        handle, temp = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump(model, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path(key))
+
+        self.evict(keep = key)
+
+    def evict(self, keep = None):
+        """
+        deletes the least recently used models (and samples of the last builds)
+        until the cache fits into the budget (except model keep)
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl") and not name.endswith(".state"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(f[1] for f in files)
+
+        for mtime, size, name in sorted(files):
+            if total <= self.budget:
+                break
+            if name == str(keep)+".pkl":
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cachedSetupModel(cache, pathtoDB, modelname, RUNS, mat, startYear, endYear, seed, sampling = "random",
+                     bank = None, resample = False):
+    """
+    returns the model of setupModel from the cache (a ModelCache) if the
+    database and the parameters did not change, otherwise builds it (after
+    seeding the sampling with seed) and stores it in the cache. The samples of
+    the last build with the same name, material, seed and sampling method
+    are kept in the cache too, only the transfers and inflows that changed
+    are sampled again (see IncrementalBuild, except with a sample bank, see
+    setupModel), the model being the same as without cache. resample: see
+    setupModel
+    """
+    data = ModelDatabase(pathtoDB, mat)
+    key = cache.key(data, modelname, RUNS, startYear, endYear, seed, sampling, bank, resample)
+
+    model = cache.get(key)
+
+    if model is None:
+        statepath = os.path.join(cache.directory, "samples_"+hashlib.sha256(repr((modelname, mat, seed, sampling)).encode()).hexdigest()+".state")
+        state = ib.loadState(statepath)
+
+        nr.seed(seed)
+        model = su.setupModel(pathtoDB, modelname, RUNS, mat, startYear, endYear, data, state, sampling = sampling,
+                              bank = bank, resample = resample)
+        cache.put(key, model)
+        state.save(statepath)
+    else:
+        print("Model "+modelname+" loaded from the cache")
+
+    return model
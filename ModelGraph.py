@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Graph of the nonzero transfer coefficients of a material, used to clean out
+the compartments that never receive any mass
+
+"""
+
+# import necessary packages
+import numpy as np
+from scipy import sparse
+
+from dpmfa import components as cp
+
+
+def NonzeroAdjacency(data):
+    """
+    builds the adjacency matrix of the flows with a TC different from zero for
+    at least one year (data is a DatabaseLoader.ModelDatabase).
+    Returns the list of compartment names (one per node) and the sparse
+    boolean matrix (source in rows, destination in columns)
+    """
+    # nodes: compartments of the database and any other compartment with TCs
+    names = list(dict.fromkeys([c[1] for c in data.complist] +
+                               list(data.tc["comp1"]) + list(data.tc["comp2"])))
+    index = {n: i for i, n in enumerate(names)}
+
+    # edges: pairs with at least one nonzero TC
+    nonzero = np.asarray(data.tc["value"] != 0, dtype=bool)
+    rows = [index[c] for c in data.tc["comp1"][nonzero]]
+    cols = [index[c] for c in data.tc["comp2"][nonzero]]
+
+    adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                  shape=(len(names), len(names)), dtype=bool)
+
+    return names, adjacency
+
+def ReachableCompartments(data):
+    """
+    determines which compartments can receive mass, i.e. that have a nonzero
+    input or can be reached from one through nonzero TCs.
+    Returns a dictionary with a logical value for each compartment
+    """
+    names, adjacency = NonzeroAdjacency(data)
+    index = {n: i for i, n in enumerate(names)}
+
+    # start from compartments with a nonzero input
+    reached = np.zeros(len(names), dtype=bool)
+    reached[[index[c] for c in data.getInputCompartments(nonzero=True) if c in index]] = True
+
+    # breadth first search, one step of the flows per iteration
+    transposed = adjacency.T.tocsr()
+    frontier = reached.copy()
+
+    while frontier.any():
+        frontier = (transposed @ frontier) & ~reached
+        reached |= frontier
+
+    return {n: bool(r) for n, r in zip(names, reached)}
+
+def CleanOutCompartments(CompartmentDict, complist, complog):
+    """
+    removes the compartments that do not receive any mass (complog False, see
+    ReachableCompartments) from CompartmentDict, as well as the transfers to
+    these compartments
+    """
+    for c in complist:
+
+        # remove compartment from dictionary if not in log
+        if not complog[c[1]]:
+            CompartmentDict.pop(c[0])
+
+        elif not isinstance(CompartmentDict[c[0]], cp.Sink):
+
+            # remove transfers from dictionary if target is not in log
+            CompartmentDict[c[0]].transfers = [t for t in CompartmentDict[c[0]].transfers if complog[t.target.name]]
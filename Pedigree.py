@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Calculation of the coefficients of variation (CV) from the data quality
+indicators (DQI) of the database with the pedigree approach
+
+"""
+
+# import necessary packages
+import numpy as np
+
+# CVs already calculated, by tuple of DQIs (geo, temp, mat, tech, rel)
+_cache = {}
+
+def PedigreeCV(dqis):
+    """
+    calculates the CV for a block of DQI scores (one row of five DQIs per
+    datapoint, or a single row). Each combination of DQIs is only calculated
+    once and stored for later calls.
+    """
+    dqis = np.asarray(dqis, dtype=float)
+
+    single = dqis.ndim == 1
+    dqis = dqis.reshape(-1, 5)
+
+    # missing DQIs give no CV (NaN), setupModel stops at the datapoints used
+    CV = np.full(len(dqis), np.nan)
+    known = np.isfinite(dqis).all(axis=1)
+
+    # only calculate the combinations of DQIs that are not known yet
+    keys, inverse = np.unique(dqis[known], axis=0, return_inverse=True)
+    keys = [tuple(k) for k in keys]
+
+    new = np.asarray([k for k in keys if k not in _cache]).reshape(-1, 5)
+
+    if len(new) != 0:
+        _cache.update(zip([tuple(k) for k in new],
+                          1.5*np.sqrt(np.exp(2.21*(new[:,0]-1)) +
+                                      np.exp(2.21*(new[:,1]-1)) +
+                                      np.exp(2.21*(new[:,2]-1)) +
+                                      np.exp(2.21*(new[:,3]-1)) +
+                                      np.exp(2.21* new[:,4]   ) )/100*2.45))
+
+    CV[known] = np.asarray([_cache[k] for k in keys])[inverse.reshape(-1)]
+
+    if single:
+        return CV[0]
+    return CV
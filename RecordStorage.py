@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of the matrices runs x periods of a simulator (logged flows,
+inventories and releases) in memory-mapped files of a scratch directory
+instead of memory, the logged flows optionally in single precision
+
+"""
+
+# import necessary packages
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from dpmfa import components as cp
+
+
+def memmapRecords(simulator, directory = None, dtype = np.float32):
+    """
+    replaces the matrices of all compartments of a simulator, after setModel
+    and before runSimulation, by memory-mapped files in a new scratch
+    directory inside directory (default: temporary directory of the system).
+    The logged inflows, outflows and immediate flows are stored with dtype,
+    the inventories and releases, which are the state of the simulation, stay
+    in double precision. Returns the scratch directory
+    """
+    if directory is not None:
+        os.makedirs(directory, exist_ok = True)
+    scratch = tempfile.mkdtemp(prefix = "records_", dir = directory)
+    shape = (simulator.numRuns, simulator.numPeriods)
+
+    def mapped(name, dt):
+        return np.memmap(os.path.join(scratch, name+".dat"), dtype = dt, mode = "w+", shape = shape)
+
+    for n, comp in enumerate(simulator.getCompartments()):
+        prefix = "c"+str(n)+"_"
+
+        if getattr(comp, "logInflows", False):
+            comp.inflowRecord = mapped(prefix+"inflow", dtype)
+
+        if isinstance(comp, cp.FlowCompartment) and comp.logOutflows:
+            comp.outflowRecord = {target: mapped(prefix+"outflow"+str(j), dtype)
+                                  for j, target in enumerate(comp.outflowRecord)}
+
+        if isinstance(comp, cp.Sink):
+            comp.inventory = mapped(prefix+"inventory", np.float64)
+
+        if type(comp) is cp.Stock:
+            comp.releaseList = mapped(prefix+"release", np.float64)
+            comp.localRelease.releaseList = mapped(prefix+"localrelease", np.float64)
+            if comp.logImmediateFlows:
+                comp.immediateFlowRecord = {target: mapped(prefix+"immediate"+str(j), dtype)
+                                            for j, target in enumerate(comp.immediateFlowRecord)}
+
+    return scratch
+
+def removeRecords(scratch):
+    """
+    deletes a scratch directory created by memmapRecords, once the results
+    are not needed anymore
+    """
+    shutil.rmtree(scratch, ignore_errors = True)
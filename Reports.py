@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Time series plots of the summary statistics (see Statistics.summarize) into
+multi-page pdf documents, one per kind of series, rendered without display.
+In parallel, the pages are written by blocks into separate pdf files in the
+processes, then merged into the documents (with pypdf, if it is installed,
+otherwise each document is written by one process)
+
+"""
+
+# import necessary packages
+import os
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    # no merge of pdf files, the documents are not split
+    PdfWriter = None
+
+import Statistics as st
+
+# kinds of series, with one document each
+KINDS = ["inflow", "outflow", "stock", "sink"]
+
+# blocks of pages per process, to balance the load
+BLOCKS = 4
+
+
+def pageTitle(kind, source, target):
+    """
+    title of the page of a series
+    """
+    if kind == "outflow":
+        return 'Flow from '+source+' to '+target
+    return {"inflow": 'Inflow into ', "stock": 'Mass in stock ', "sink": 'Mass in sink '}[kind]+source
+
+def plotPage(pp, title, rows):
+    """
+    plots the range, mean and quartiles of a series (its rows of the summary
+    table) on a new page of pp, the figure is closed once saved
+    """
+    years = rows["year"]
+
+    with plt.rc_context({'font.size': 12}):
+        fig = plt.figure()
+        plt.xlabel('Year',fontsize=14)
+        plt.ylabel('Flow mass (kt)',fontsize=14)
+        plt.title(title)
+        plt.xlim(xmin=years[0]-0.5, xmax=years[-1]+0.5)
+        plt.fill_between(years, rows["min"], rows["max"], color='blanchedalmond', label="Range")
+        plt.plot(years, rows["mean"], color = 'darkred', linewidth=2, label='Mean Value')
+        plt.plot(years, rows["q25"], color = 'red', linestyle='dashed', linewidth=1.5, label = '25% Quantile')
+        plt.plot(years, rows["q75"], color = 'red', linestyle='dashed', linewidth=1.5, label = '75% Quantile')
+        plt.legend(loc='upper left', fontsize = 'small')
+        plt.tight_layout()
+        pp.savefig(fig)
+        plt.close(fig)
+
+def writeDocument(path, pages):
+    """
+    writes a multi-page pdf document, pages being a list of tuples (title,
+    rows of the summary table)
+    """
+    pp = PdfPages(path)
+    for title, rows in pages:
+        plotPage(pp, title, rows)
+    pp.close()
+
+    return path
+
+def mergeDocuments(path, parts):
+    """
+    merges the pdf documents parts (deleted afterwards) into the document
+    path, one part after the other
+    """
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    with open(path, "wb") as f:
+        writer.write(f)
+    writer.close()
+
+    for part in parts:
+        os.remove(part)
+
+    return path
+
+def writeReports(stats, outputdir, mat, processes = None):
+    """
+    writes the documents TimeSeries_<KIND>_<mat>.pdf of all series of the
+    summary table stats into outputdir, in at most processes processes
+    (default: number of CPUs, no separate process if 1). The pages of all
+    documents are split into blocks written by the processes into separate
+    files (the largest document thus being split too), then merged. Without
+    pypdf, each document is written by one process. Returns the paths of the
+    documents
+    """
+    pages = {kind: [] for kind in KINDS}
+    for kind, source, target, rows in st.iterSeries(stats):
+        pages[kind].append((pageTitle(kind, source, target), rows))
+
+    paths = [os.path.join(outputdir,'TimeSeries_'+kind.upper()+'_'+mat+'.pdf') for kind in KINDS]
+
+    if processes == 1:
+        return [writeDocument(path, pages[kind]) for path, kind in zip(paths, KINDS)]
+
+    processes = processes or os.cpu_count() or 1
+
+    if PdfWriter is None:
+        with ProcessPoolExecutor(max_workers = min(processes, len(KINDS))) as pool:
+            return list(pool.map(writeDocument, paths, [pages[kind] for kind in KINDS]))
+
+    # blocks of (almost) equal size over all pages, a block only holding
+    # pages of one document
+    total = sum(len(p) for p in pages.values())
+    size = max(int(np.ceil(total/(processes*BLOCKS))), 1)
+
+    parts = {path: [] for path in paths}
+    blocks = []
+    for path, kind in zip(paths, KINDS):
+        for k, start in enumerate(range(0, len(pages[kind]), size)):
+            part = path[:-len(".pdf")]+"_part"+str(k)+".pdf"
+            parts[path].append(part)
+            blocks.append((part, pages[kind][start:start+size]))
+
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        list(pool.map(writeDocument, [b[0] for b in blocks], [b[1] for b in blocks]))
+
+    # a document without pages is written like without separate process
+    return [mergeDocuments(path, parts[path]) if len(parts[path]) != 0 else writeDocument(path, [])
+            for path in paths]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of the logged series of a simulation (runs x years for each inflow,
+outflow, stock and sink) in one compressed binary file, with a reader loading
+single series or ranges of years only, and the legacy export to csv files
+
+"""
+
+# import necessary packages
+import os
+import csv
+import json
+import numpy as np
+
+
+def seriesKey(kind, source, target = None):
+    """
+    name of a series in the store
+    """
+    if target is None:
+        return kind+"/"+source
+    return kind+"/"+source+"/"+target
+
+def writeResults(path, series, years, metadata = None, chunk = 10):
+    """
+    writes the series (list of tuples kind, source, target, matrix of runs x
+    years, see Statistics.collectSeries) into the compressed npz file path.
+    Each series is split into blocks of chunk years, stored as separate
+    members, so that a range of years can be read alone. The metadata
+    (e.g. material, region, seed) are stored with the list of series and the
+    years
+    """
+    years = [int(y) for y in years]
+    bounds = [(a, min(a+chunk, len(years))) for a in range(0, len(years), chunk)]
+
+    members = {}
+    for i, (kind, source, target, value) in enumerate(series):
+        if np.shape(value)[1] != len(years):
+            raise Exception('The series "{a}" has {b} periods instead of {c}.'.format(a = seriesKey(kind, source, target), b = np.shape(value)[1], c = len(years)))
+        for j, (a, b) in enumerate(bounds):
+            members["s{a}_c{b}".format(a = i, b = j)] = value[:, a:b]
+
+    meta = dict(metadata or {})
+    meta.update({"series": [[kind, source, target] for kind, source, target, value in series],
+                 "years": years,
+                 "yearblocks": bounds,
+                 "runs": int(np.shape(series[0][3])[0]) if len(series) != 0 else 0})
+
+    members["metadata"] = np.asarray(json.dumps(meta))
+
+    np.savez_compressed(path, **members)
+
+
+class ResultStore(object):
+    """
+    reads a file written by writeResults. The members are only read when a
+    series is requested, and only for the blocks of years requested
+    """
+
+    def __init__(self, path):
+
+        self.file = np.load(path)
+
+        meta = json.loads(str(self.file["metadata"]))
+        self.series = [tuple(s) for s in meta.pop("series")]
+        self.years = np.asarray(meta.pop("years"))
+        self.chunks = [tuple(c) for c in meta.pop("yearblocks")]
+        self.runs = meta.pop("runs")
+
+        # remaining metadata (material, region, seed, ...)
+        self.metadata = meta
+
+        self.index = {seriesKey(*s): i for i, s in enumerate(self.series)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def getSeries(self, kind, source, target = None, years = None):
+        """
+        returns the matrix runs x years of a series, for all years or for the
+        years given (a list of years or a (first, last) range)
+        """
+        key = seriesKey(kind, source, target)
+        if key not in self.index:
+            raise Exception('There is no series "{a}" in the store.'.format(a = key))
+        i = self.index[key]
+
+        # columns of the requested years
+        if years is None:
+            cols = np.arange(len(self.years))
+        elif isinstance(years, tuple):
+            cols = np.flatnonzero((self.years >= years[0]) & (self.years <= years[1]))
+        else:
+            cols = np.searchsorted(self.years, years)
+            if any(c >= len(self.years) or self.years[c] != y for c, y in zip(cols, years)):
+                raise Exception('Some years of {a} are not in the store.'.format(a = list(years)))
+
+        # read only the blocks containing these columns
+        data = np.empty((self.runs, len(cols)))
+        for j, (a, b) in enumerate(self.chunks):
+            inblock = (cols >= a) & (cols < b)
+            if inblock.any():
+                data[:, inblock] = self.file["s{a}_c{b}".format(a = i, b = j)][:, cols[inblock]-a]
+
+        return data
+
+    def getSeriesOfKind(self, kind):
+        """
+        returns the series (kind, source, target) of the store of a kind
+        """
+        return [s for s in self.series if s[0] == kind]
+
+
+def writeCSV(series, directory, mat):
+    """
+    legacy export: writes each series into its own space-delimited csv file
+    in directory (one line per run)
+    """
+    names = {"inflow": "loggedInflows_", "outflow": "loggedOutflows_", "stock": "stocks_", "sink": "sinks_"}
+
+    for kind, source, target, value in series:
+        name = names[kind]+mat+"_"+source
+        if target is not None:
+            name += "_to_"+target
+        with open(os.path.join(directory, name+".csv"), 'w') as RM :
+            a = csv.writer(RM, delimiter=' ')
+            data = np.asarray(value)
+            a.writerows(data)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Bank of uniform random numbers stored on disk, one stream per logical
+identity of a distribution (e.g. the TC from one compartment to another in a
+year, or the input into a compartment in a year), so that the models of
+different materials, regions or versions of a database are sampled with the
+same random numbers (common random numbers)
+
+"""
+
+# import necessary packages
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+def streamName(key):
+    """
+    name of the stream of a key (tuple of names and years)
+    """
+    return "/".join(str(x) for x in key)
+
+
+class SampleBank(object):
+    """
+    uniforms in [0,1) by key, each stream stored in its own file of the
+    directory bank_<seed> of directory. The stream of a key only depends on
+    the seed and on the key, its first values being the same whatever the
+    number of runs: jobs sharing the bank at the same time can only write the
+    same values into a file, each file being replaced at once
+    """
+
+    def __init__(self, directory, seed = 2250):
+
+        self.directory = directory
+        self.seed = seed
+
+        os.makedirs(self.path(), exist_ok = True)
+
+    def path(self, name = None):
+        """
+        directory of the bank, or file of the stream name
+        """
+        directory = os.path.join(self.directory, "bank_"+str(self.seed))
+        if name is None:
+            return directory
+        return os.path.join(directory, hashlib.sha256(name.encode()).hexdigest()[:32]+".npy")
+
+    def stream(self, name, N):
+        """
+        first N values of the stream name
+        """
+        entropy = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "little")
+        return np.random.default_rng([self.seed, entropy]).random(N)
+
+    def read(self, name):
+        """
+        returns the values of the stream name stored in the bank, None if
+        there are none
+        """
+        try:
+            return np.load(self.path(name))
+        except (FileNotFoundError, EOFError, ValueError):
+            return None
+
+    def write(self, name, values):
+        """
+        stores the values of the stream name, replacing the file at once
+        """
+        handle, temp = tempfile.mkstemp(dir = self.path(), suffix = ".tmp")
+        with os.fdopen(handle, "wb") as f:
+            np.save(f, values)
+        os.replace(temp, self.path(name))
+
+    def uniforms(self, keys, N):
+        """
+        returns the matrix of uniforms of the keys (one row of N runs per key).
+        The streams stored in the bank are reused, new streams (or streams
+        with less than N runs) are generated and stored
+        """
+        wanted = [streamName(key) for key in keys]
+        rows = {}
+        new = 0
+
+        for name in dict.fromkeys(wanted):
+            values = self.read(name)
+            if values is None or len(values) < N:
+                values = self.stream(name, N)
+                self.write(name, values)
+                new += 1
+            rows[name] = values[:N]
+
+        if new != 0:
+            print("Sample bank: "+str(new)+" new streams of "+str(N)+" runs, "+str(len(rows)-new)+" reused")
+
+        return np.asarray([rows[name] for name in wanted]).reshape(len(wanted), N)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Sweep of what-if scenarios on a model built once: each scenario is a list of
+overrides of the inputs, TCs or lifetimes of the base model (no new query of
+the database and no new sampling of the other distributions), the scenarios
+being simulated in parallel processes. Each process summarizes (and writes)
+the results of its scenarios, only the summaries are sent back.
+An override is a dictionary with the keys:
+    kind: "input", "transfer" or "lifetime"
+    compartment: name of the compartment (receiving the input, source of the
+        transfer or stock)
+    target: name of the target compartment (transfers only)
+    years: (first, last) years of the override, all years if missing
+        (inputs and transfers only)
+    material: material of the override, applied to all materials if missing
+    factor: factor applied to the values (inputs and transfers)
+    value: value replacing the values (inputs and transfers)
+    shift: number of periods the releases of a stock are delayed (lifetimes)
+    rates: release rates replacing those of a stock (lifetimes)
+e.g. {"kind": "transfer", "compartment": "Packaging", "target": "Recycling",
+      "years": (2010, 2016), "factor": 1.5}
+
+"""
+
+# import necessary packages
+import os
+import json
+import pickle
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from dpmfa import simulator as sc
+from dpmfa import components as cp
+import ChunkedSimulation as cs
+import Statistics as st
+import ResultStore as rs
+import TruncatingFunctions as tr
+
+# pickled base model of the worker processes (see loadBase)
+_base = None
+
+KINDS = ("input", "transfer", "lifetime")
+
+
+class Adjusted(object):
+    """
+    function of a distribution with its values multiplied by factor or
+    replaced by value. The function is still called, so that the other
+    distributions of the model keep their random numbers (and a sample taken
+    in the order of the runs its position)
+    """
+
+    def __init__(self, function, factor = 1, value = None):
+        self.function = function
+        self.factor = factor
+        self.value = value
+
+    def __call__(self, *args):
+        sample = self.function(*args)
+        return self.value if self.value is not None else sample*self.factor
+
+
+def overridePeriods(override, startYear, periods):
+    """
+    periods of the years of an override (all periods if no years)
+    """
+    first, last = override.get("years") or (startYear, startYear+periods-1)
+    return range(max(first-startYear, 0), min(last-startYear+1, periods))
+
+def adjustTransfer(trans, override, startYear, periods):
+    """
+    returns the transfer trans with the TCs of the years of override
+    multiplied by its factor or replaced by its value
+    """
+    factor = override.get("factor", 1)
+    value = override.get("value")
+
+    # a constant TC becomes a TC by year
+    if isinstance(trans, cp.ConstTransfer):
+        trans = cp.TimeDependentListTransfer([trans.value]*periods, trans.target, priority = trans.priority)
+
+    for p in overridePeriods(override, startYear, periods):
+        if isinstance(trans, cp.TimeDependentListTransfer):
+            trans.transfer_list[p] = value if value is not None else trans.transfer_list[p]*factor
+
+        elif isinstance(trans, cp.TimeDependentDistributionTransfer):
+            dist = trans.transfer_distribution_list[p]
+            if isinstance(dist, cp.TransferConstant):
+                trans.transfer_distribution_list[p] = cp.TransferConstant(value if value is not None else dist.value*factor)
+            else:
+                trans.transfer_distribution_list[p] = cp.TransferDistribution(Adjusted(dist.function, factor, value), dist.parameters)
+
+        else:
+            raise Exception('The TCs of a transfer of type "{a}" cannot be changed.'.format(a = type(trans).__name__))
+
+    return trans
+
+def adjustInflow(inflow, override, startYear, periods):
+    """
+    multiplies the inflows of the years of override by its factor or replaces
+    them by its value
+    """
+    factor = override.get("factor", 1)
+    value = override.get("value")
+
+    for p in overridePeriods(override, startYear, min(periods, len(inflow.inflowList))):
+        single = inflow.inflowList[p]
+        if isinstance(single, cp.FixedValueInflow):
+            inflow.inflowList[p] = cp.FixedValueInflow(value if value is not None else single.currentValue*factor)
+        elif isinstance(single, cp.RandomChoiceInflow):
+            inflow.inflowList[p] = cp.StochasticFunctionInflow(Adjusted(tr.RandomChoice, factor, value), [single.sample])
+        elif isinstance(single, cp.StochasticFunctionInflow):
+            inflow.inflowList[p] = cp.StochasticFunctionInflow(Adjusted(single.pdf, factor, value), single.parameterValues)
+        else:
+            raise Exception('The inflows of type "{a}" cannot be changed.'.format(a = type(single).__name__))
+
+def applyOverride(model, override, startYear, periods, material = None):
+    """
+    applies one override to a model (changed in place) of material, starting
+    in startYear with periods periods
+    """
+    kind = override.get("kind")
+    if kind not in KINDS:
+        raise Exception('Unknown kind of override "{a}", use one of {b}.'.format(a = kind, b = KINDS))
+
+    if material is not None and override.get("material", material) != material:
+        return
+
+    name = override["compartment"]
+    comps = {comp.name: comp for comp in model.compartments}
+    if name not in comps:
+        raise Exception('There is no compartment "{a}" in the model.'.format(a = name))
+    comp = comps[name]
+
+    if kind == "input":
+        inflows = [inflow for inflow in model.inflows if inflow.target is comp]
+        if len(inflows) == 0:
+            raise Exception('There is no input into compartment "{a}".'.format(a = name))
+        for inflow in inflows:
+            adjustInflow(inflow, override, startYear, periods)
+
+    elif kind == "transfer":
+        transfers = [i for i, trans in enumerate(getattr(comp, "transfers", [])) if trans.target.name == override.get("target")]
+        if len(transfers) == 0:
+            raise Exception('There is no transfer from "{a}" to "{b}".'.format(a = name, b = override.get("target")))
+        for i in transfers:
+            comp.transfers[i] = adjustTransfer(comp.transfers[i], override, startYear, periods)
+
+    else:
+        if not isinstance(comp, cp.Stock):
+            raise Exception('The compartment "{a}" is not a stock.'.format(a = name))
+        rates = override.get("rates", comp.localRelease.releaseRatesList)
+        if override.get("shift", 0) < 0:
+            raise Exception('The releases of a stock can only be delayed (shift >= 0).')
+        comp.localRelease = cp.ListRelease(rates, override.get("shift", 0))
+
+def scenarioModel(modelpickle, overrides, startYear, periods, material = None):
+    """
+    copy of the pickled base model with the overrides applied
+    """
+    model = pickle.loads(modelpickle)
+
+    # samples taken in the order of the runs start at the first run (before
+    # the overrides wrap them)
+    cs.setFirstRun(model, 0)
+
+    for override in overrides:
+        applyOverride(model, override, startYear, periods, material)
+
+    return model
+
+def loadBase(modelpickle):
+    """
+    keeps the pickled base model in a worker process
+    """
+    global _base
+    _base = modelpickle
+
+def runScenario(label, overrides, runs, periods, seed, startYear, material = None,
+                useGlobalTCSettings = True, normalizeTCs = True, outputdir = None, metadata = None, scale = 1):
+    """
+    simulates one scenario of the base model, returns its label and the
+    summary of its logged series (see Statistics.summarize, values multiplied
+    by scale). With outputdir, all runs (results_<material>.npz, see
+    ResultStore) and the summary (summary_<material>.csv) are written into
+    outputdir/<label>, with the metadata
+    """
+    model = scenarioModel(_base, overrides, startYear, periods, material)
+
+    simulator = sc.Simulator(runs, periods, seed, useGlobalTCSettings, normalizeTCs)
+    simulator.setModel(model)
+    simulator.runSimulation()
+
+    series = st.collectSeries(simulator)
+
+    years = np.arange(startYear, startYear+periods)
+    stats = st.summarize(series, quantiles = (0.25, 0.75), years = years, scale = scale)
+
+    if outputdir is not None:
+        directory = os.path.join(outputdir, label)
+        os.makedirs(directory, exist_ok = True)
+        suffix = "" if material is None else "_"+material
+        rs.writeResults(os.path.join(directory, "results"+suffix+".npz"), series, years,
+                        dict(metadata or {}, seed = seed, RUNS = runs, scenario = label, overrides = overrides))
+        st.writeTable(stats, os.path.join(directory, "summary"+suffix+".csv"))
+
+    return label, stats
+
+def checkLabel(label):
+    """
+    raises an exception if the label of a scenario cannot be used as the name
+    of its directory (empty, "." or "..", absolute or with a path separator)
+    """
+    if not isinstance(label, str) or label in ("", ".", "..") or os.path.isabs(label) \
+            or os.path.splitdrive(label)[0] or any(s in label for s in ("/", "\\", os.sep)):
+        raise Exception('The scenario label "{a}" is not a valid directory name.'.format(a = label))
+
+def runScenarioSweep(model, scenarios, runs, periods, seed, startYear, processes = None, material = None,
+                     useGlobalTCSettings = True, normalizeTCs = True, outputdir = None, metadata = None, scale = 1):
+    """
+    simulates runs runs of each scenario of the model, scenarios being a
+    dictionary of lists of overrides by label (an empty list for the base
+    model), in processes processes (all cores if None, no separate process
+    if 1). All scenarios use the same seed, their differences are thus only
+    due to the overrides (common random numbers). The runs of each scenario
+    are summarized (and written into outputdir, see runScenario) in its
+    process, they are not sent back.
+    Returns the summary of each scenario by label
+    """
+    # the base model is pickled once and sent once to each process
+    modelpickle = pickle.dumps(model)
+
+    # check the labels and the overrides before the simulations
+    for label, overrides in scenarios.items():
+        checkLabel(label)
+        scenarioModel(modelpickle, overrides, startYear, periods, material)
+
+    labels = list(scenarios)
+
+    if processes is None:
+        processes = min(len(labels), os.cpu_count() or 1)
+
+    args = [(label, scenarios[label], runs, periods, seed, startYear, material, useGlobalTCSettings, normalizeTCs,
+             outputdir, metadata, scale) for label in labels]
+    results = {}
+
+    if processes <= 1:
+        loadBase(modelpickle)
+        for i, (label, stats) in cs.completed(None, runScenario, args, 1):
+            results[label] = stats
+            print("Scenario "+label+" done")
+    else:
+        with ProcessPoolExecutor(max_workers = processes, initializer = loadBase, initargs = (modelpickle,)) as pool:
+            for i, (label, stats) in cs.completed(pool, runScenario, args, processes):
+                results[label] = stats
+                print("Scenario "+label+" done")
+
+    # in the order of the scenarios
+    return {label: results[label] for label in labels}
+
+def readScenarios(path):
+    """
+    reads the scenarios (lists of overrides by label) of a json file
+    """
+    with open(path) as f:
+        scenarios = json.load(f)
+
+    for label in scenarios:
+        checkLabel(label)
+
+    return scenarios
+
+
+if __name__ == "__main__":
+
+    import setup_model_new as su
+    import CaseStudy_Runner as cr
+
+    # usage: python ScenarioSweep.py SCENARIOS.json [--material LDPE] [--region EU] [--runs N] [--processes N]
+    #                                [--seed S]
+    # the results of each scenario are written into output_casestudy/<region>/scenarios/<label>
+    parser = argparse.ArgumentParser(description = "Runs the scenarios of a json file on the model of one material and region")
+    parser.add_argument("scenarios", help = "json file with the lists of overrides by scenario label")
+    parser.add_argument("--material", default = "LDPE")
+    parser.add_argument("--region", default = "EU", choices = list(cr.regions))
+    parser.add_argument("--runs", type = int, default = cr.RUNS)
+    parser.add_argument("--processes", type = int, default = None)
+    parser.add_argument("--seed", type = int, default = 2250)
+    args = parser.parse_args()
+
+    scenarios = readScenarios(args.scenarios)
+    seed = cr.jobSeed(args.material, args.region, args.seed)
+
+    # the base model is built and sampled once
+    np.random.seed(seed)
+    model = su.setupModel(cr.regions[args.region]["db"], args.material+" in "+cr.regions[args.region]["name"], args.runs,
+                          args.material, cr.startYear, cr.endYear)
+
+    # the runs and summary (in kt) of each scenario are written by its process
+    outputdir = os.path.join("output_casestudy", args.region, "scenarios")
+    runScenarioSweep(model, scenarios, args.runs, cr.Tperiods, seed, cr.startYear, args.processes, args.material,
+                     outputdir = outputdir, metadata = {"material": args.material, "region": args.region}, scale = 1000)
+    print("Scenarios written into "+outputdir)
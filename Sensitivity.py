@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Global sensitivity analysis of the results of one simulation: the values of
+the TCs and inputs sampled in each run are recorded during the simulation,
+then the rank correlation (Spearman) and the first-order variance-based index
+of each parameter are calculated for the logged series in some years, giving
+the parameters driving the uncertainty of each series
+
+"""
+
+# import necessary packages
+import numpy as np
+from scipy import sparse
+from scipy.stats import rankdata
+
+from dpmfa import components as cp
+import TruncatingFunctions as tr
+from SampleBank import streamName
+
+
+class ParameterRecord(object):
+    """
+    function of a distribution that keeps the value taken in each run (the
+    last one of the run if it is called calls times per run, like the TCs of
+    the stocks)
+    """
+
+    def __init__(self, function, runs, calls = 1):
+        self.function = function
+        self.calls = calls
+        self.values = np.zeros(runs, dtype=np.float32)
+        self.position = 0
+
+    def __call__(self, *args):
+        value = self.function(*args)
+        run = self.position//self.calls
+        if run < len(self.values):
+            self.values[run] = value
+        self.position += 1
+        return value
+
+
+def recordParameters(model, runs, startYear):
+    """
+    makes the stochastic TCs and inputs of a model record their values in the
+    runs of the next simulation (of runs runs, the first period being
+    startYear), returns the list of (key, ParameterRecord), key being
+    ("tc", compartment, target, year) or ("input", compartment, year).
+    Constant TCs and inputs are not parameters
+    """
+    records = []
+
+    for comp in model.compartments:
+        calls = 2 if type(comp) is cp.Stock else 1
+        for trans in getattr(comp, "transfers", []):
+            for p, dist in enumerate(getattr(trans, "transfer_distribution_list", [])):
+                if isinstance(dist, cp.TransferDistribution):
+                    dist.function = ParameterRecord(dist.function, runs, calls)
+                    records.append((("tc", comp.name, trans.target.name, startYear+p), dist.function))
+
+    for inflow in model.inflows:
+        for p, single in enumerate(getattr(inflow, "inflowList", [])):
+            if isinstance(single, cp.RandomChoiceInflow):
+                # same random numbers as RandomChoiceInflow
+                single = cp.StochasticFunctionInflow(ParameterRecord(tr.RandomChoice, runs), [single.sample])
+                inflow.inflowList[p] = single
+            elif isinstance(single, cp.StochasticFunctionInflow):
+                single.pdf = ParameterRecord(single.pdf, runs)
+            else:
+                continue
+            records.append((("input", inflow.target.name, startYear+p), single.pdf))
+
+    return records
+
+def parameterMatrix(records):
+    """
+    names and matrix (runs x parameters) of the values of the recorded
+    parameters
+    """
+    names = [streamName(key) for key, record in records]
+    if len(records) == 0:
+        return names, np.zeros((0, 0), dtype=np.float32)
+    return names, np.stack([record.values for key, record in records], axis=1)
+
+def writeParameters(path, names, X):
+    """
+    writes the names and values of the parameters into a compressed npz file
+    """
+    np.savez_compressed(path, names = np.asarray(names, dtype=str), values = X)
+
+def standardRanks(X):
+    """
+    ranks of the columns of X, centred and scaled to a unit standard
+    deviation (zero for constant columns)
+    """
+    R = rankdata(X, axis=0)
+    R -= R.mean(axis=0)
+    std = R.std(axis=0)
+    return np.divide(R, std, out=np.zeros_like(R), where=std > 0)
+
+def rankCorrelations(X, Y):
+    """
+    Spearman rank correlation of each column of X (runs x parameters) with
+    each column of Y (runs x outputs), matrix parameters x outputs
+    """
+    return standardRanks(X).T @ standardRanks(Y)/len(X)
+
+def firstOrderIndices(X, Y, bins = None):
+    """
+    first-order indices Var(E[Y|X])/Var(Y) of each column of X (runs x
+    parameters) for each column of Y (runs x outputs), matrix parameters x
+    outputs. The conditional means are those of bins of runs with (almost)
+    the same number of runs (default: square root of the runs, at most 50),
+    the variance they have by chance ((bins-1)/runs of the variance) is
+    subtracted
+    """
+    N, P = X.shape
+    if bins is None:
+        bins = int(min(max(np.sqrt(N), 2), 50))
+
+    # bin of each run for each parameter, by rank
+    b = ((rankdata(X, axis=0, method="ordinal") - 1)*bins//N).astype(int)
+
+    Yc = Y - Y.mean(axis=0)
+    V = (Yc**2).mean(axis=0)
+
+    # sums of the outputs in the bins of all parameters with one sparse product
+    M = sparse.csr_matrix((np.ones(N*P), (np.repeat(np.arange(N), P), (b + bins*np.arange(P)).reshape(-1))),
+                          shape=(N, P*bins))
+    counts = np.asarray(M.sum(axis=0)).reshape(P, bins, 1)
+    sums = np.asarray(M.T @ Yc).reshape(P, bins, -1)
+
+    conditional = (np.divide(sums**2, counts, out=np.zeros_like(sums), where=counts > 0)).sum(axis=1)/N
+    S = np.divide(conditional - V*(bins-1)/N, V, out=np.zeros_like(conditional), where=V > 0)
+
+    return np.clip(S, 0, 1)
+
+def rankDrivers(names, X, series, periods, years, top = 10, bins = None, by = "first_order", block = 200):
+    """
+    ranks the parameters (names and matrix runs x parameters, see
+    parameterMatrix) driving the uncertainty of the logged series (see
+    Statistics.collectSeries) in the periods (years being the years of all
+    periods), by first-order index or by absolute rank correlation (by =
+    "spearman"). The parameters are processed by blocks of at most block
+    columns. Returns a table (dictionary of columns) with the top parameters
+    of each series and year
+    """
+    if by not in ("first_order", "spearman"):
+        raise Exception('Unknown ranking "{a}", use "first_order" or "spearman".'.format(a = by))
+
+    # outputs: one column per series and period
+    outputs = [(s[0], s[1], s[2], years[p]) for s in series for p in periods]
+    Y = np.concatenate([np.asarray(s[3])[:, periods] for s in series], axis=1) if len(series) != 0 else np.zeros((len(X), 0))
+
+    if len(X) != len(Y):
+        raise Exception('The parameters have {a} runs and the series {b} runs.'.format(a = len(X), b = len(Y)))
+
+    rho = np.zeros((X.shape[1], Y.shape[1]))
+    S = np.zeros((X.shape[1], Y.shape[1]))
+    for start in range(0, X.shape[1], block):
+        Xb = np.asarray(X[:, start:start+block], dtype=float)
+        rho[start:start+block] = rankCorrelations(Xb, Y)
+        S[start:start+block] = firstOrderIndices(Xb, Y, bins)
+
+    score = S if by == "first_order" else np.abs(rho)
+
+    columns = {"kind": [], "source": [], "target": [], "year": [], "rank": [], "parameter": [], "spearman": [], "first_order": []}
+    for k, (kind, source, target, year) in enumerate(outputs):
+        order = np.argsort(-score[:, k], kind="stable")[:top]
+        for r, i in enumerate(order):
+            for c, v in zip(columns, (kind, source, target, year, r+1, names[i], rho[i, k], S[i, k])):
+                columns[c].append(v)
+
+    table = {c: np.asarray(v, dtype=object) for c, v in columns.items() if c in ("kind", "source", "target", "parameter")}
+    table.update({"year": np.asarray(columns["year"]), "rank": np.asarray(columns["rank"], dtype=int),
+                  "spearman": np.asarray(columns["spearman"], dtype=float), "first_order": np.asarray(columns["first_order"], dtype=float)})
+
+    # columns in the order of the table
+    return {c: table[c] for c in columns}
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics over the runs of all logged flows, stocks and sinks of a
+simulation, gathered in one table shared by plots, printing and export
+
+"""
+
+# import necessary packages
+import csv
+import numpy as np
+
+from dpmfa import components as cp
+
+# statistics over the run axis that can be requested besides the quantiles
+MOMENTS = {"mean": np.mean,
+           "std":  np.std,
+           "var":  np.var,
+           "min":  np.min,
+           "max":  np.max}
+
+
+def collectSeries(simulator):
+    """
+    lists all logged series of a simulator as tuples (kind, source, target,
+    matrix of runs x periods), kind being "inflow", "outflow", "stock" or
+    "sink" (target is None except for outflows)
+    """
+    series = []
+
+    for key, value in simulator.getLoggedInflows().items():
+        series.append(("inflow", key, None, value))
+
+    for Comp in simulator.getLoggedOutflows():
+        for target, value in Comp.outflowRecord.items():
+            series.append(("outflow", Comp.name, target, value))
+
+    for stock in simulator.getStocks():
+        series.append(("stock", stock.name, None, stock.inventory))
+
+    for sink in simulator.getSinks():
+        if isinstance(sink, cp.Stock):
+            continue
+        series.append(("sink", sink.name, None, sink.inventory))
+
+    return series
+
+def quantileName(q):
+    """
+    column name of quantile q in the summary table (e.g. 0.25 -> "q25")
+    """
+    return "q"+format(q*100, "g")
+
+def summarize(series, quantiles = (0.25, 0.75), moments = ("mean", "std", "min", "max"),
+              years = None, scale = 1, block = 50):
+    """
+    calculates the quantiles and moments over the runs of all series (see
+    collectSeries) for all periods at once, the series being stacked by blocks
+    of at most block series to limit memory use. Values are multiplied by
+    scale. Returns a table (dictionary of columns) with one row per series and
+    year, the rows of a series being consecutive and in the order of the years
+    """
+    for m in moments:
+        if m not in MOMENTS:
+            raise Exception('Unknown statistic "{a}", possible are: {b}.'.format(a = m, b = ", ".join(MOMENTS)))
+
+    periods = np.shape(series[0][3])[1] if len(series) != 0 else 0
+    if years is None:
+        years = np.arange(periods)
+
+    columns = list(moments) + [quantileName(q) for q in quantiles]
+    values = {c: np.empty((len(series), periods)) for c in columns}
+
+    for start in range(0, len(series), block):
+        data = np.stack([s[3] for s in series[start:start+block]])*scale
+
+        for m in moments:
+            values[m][start:start+block] = MOMENTS[m](data, axis=1)
+
+        if len(quantiles) != 0:
+            qs = np.quantile(data, quantiles, axis=1)
+            for q, v in zip(quantiles, qs):
+                values[quantileName(q)][start:start+block] = v
+
+    table = {"kind":   np.repeat(np.asarray([s[0] for s in series], dtype=object), periods),
+             "source": np.repeat(np.asarray([s[1] for s in series], dtype=object), periods),
+             "target": np.repeat(np.asarray([s[2] for s in series], dtype=object), periods),
+             "year":   np.tile(np.asarray(years), len(series))}
+
+    for c in columns:
+        table[c] = values[c].reshape(-1)
+
+    return table
+
+def iterSeries(table):
+    """
+    iterates over the series of a summary table, yields kind, source, target
+    and the part of the table of the series
+    """
+    kind, source, target = table["kind"], table["source"], table["target"]
+    if len(kind) == 0:
+        return
+
+    # first row of each series
+    new = np.ones(len(kind), dtype=bool)
+    new[1:] = (kind[1:] != kind[:-1]) | (source[1:] != source[:-1]) | (target[1:] != target[:-1])
+    bounds = list(np.flatnonzero(new)) + [len(kind)]
+
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        yield kind[a], source[a], target[a], {c: v[a:b] for c, v in table.items()}
+
+def selectRows(table, **conditions):
+    """
+    returns the rows of a summary table with the given values, e.g.
+    selectRows(table, kind = "outflow", year = 2016)
+    """
+    keep = np.ones(len(table["kind"]), dtype=bool)
+    for c, v in conditions.items():
+        keep &= table[c] == v
+    return {c: v[keep] for c, v in table.items()}
+
+def writeTable(table, path):
+    """
+    exports a summary table to a csv file
+    """
+    with open(path, 'w', newline='') as f:
+        a = csv.writer(f)
+        a.writerow(list(table))
+        a.writerows(zip(*table.values()))
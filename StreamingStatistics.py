@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics of the logged series of a simulation accumulated chunk by
+chunk of runs, without keeping the runs: running moments (Chan et al.),
+extremes and a mergeable quantile sketch with logarithmic buckets (as in
+DDSketch), giving the same table as Statistics.summarize
+
+"""
+
+# import necessary packages
+import numpy as np
+
+import Statistics as st
+
+# bucket indexes of the sketch: values are stored in buckets of constant
+# relative width, KMAX buckets on each side of 1 for positive and negative
+# values, absolute values below TINY count as zero
+KMAX = 2048
+TINY = 1e-12
+
+
+class SummaryAccumulator(object):
+    """
+    accumulates the statistics of the series keys (list of tuples kind,
+    source, target, see Statistics.collectSeries) for all periods. The
+    quantiles are estimated with a relative error of at most alpha.
+    Accumulators of different chunks of runs are combined with merge
+    """
+
+    def __init__(self, keys, periods, alpha = 0.01):
+
+        self.keys = [tuple(k) for k in keys]
+        self.periods = periods
+        self.alpha = alpha
+        self.gamma = (1+alpha)/(1-alpha)
+
+        shape = (len(self.keys), periods)
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.M2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+        # sketch: sorted bucket keys (cell*width + bucket) and their counts
+        self.width = 4*KMAX+1
+        self.buckets = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def bucketOf(self, x):
+        """
+        bucket of the values x (ordered like the values)
+        """
+        with np.errstate(divide="ignore"):
+            k = np.ceil(np.log(np.abs(x))/np.log(self.gamma))
+        k = np.clip(np.nan_to_num(k, neginf=-KMAX), -KMAX, KMAX-1).astype(np.int64)
+
+        b = np.full(np.shape(x), 2*KMAX, dtype=np.int64)
+        b = np.where(x >= TINY, 3*KMAX+1+k, b)
+        b = np.where(x <= -TINY, KMAX-1-k, b)
+        return b
+
+    def valueOf(self, b):
+        """
+        representative value of the buckets b
+        """
+        b = np.asarray(b, dtype=np.int64)
+        sign = np.sign(b-2*KMAX)
+        k = np.where(sign > 0, b-3*KMAX-1, KMAX-1-b)
+        return sign*2*self.gamma**k/(self.gamma+1)
+
+    def add(self, matrices):
+        """
+        adds a chunk of runs, matrices being one matrix runs x periods per
+        series, in the order of the keys
+        """
+        if len(matrices) != len(self.keys):
+            raise Exception('{a} series given for {b} keys.'.format(a = len(matrices), b = len(self.keys)))
+
+        data = np.stack([np.asarray(m, dtype=float) for m in matrices], axis=1)
+        runs = data.shape[0]
+        if runs == 0:
+            return
+
+        other = SummaryAccumulator(self.keys, self.periods, self.alpha)
+        other.n = runs
+        other.mean = data.mean(axis=0)
+        other.M2 = ((data-other.mean)**2).sum(axis=0)
+        other.min = data.min(axis=0)
+        other.max = data.max(axis=0)
+
+        cells = np.arange(len(self.keys)*self.periods, dtype=np.int64).reshape(1, len(self.keys), self.periods)
+        other.buckets, other.counts = np.unique((cells*self.width + self.bucketOf(data)).reshape(-1),
+                                                return_counts=True)
+
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        adds the runs accumulated by another accumulator of the same series
+        """
+        if other.keys != self.keys or other.periods != self.periods or other.alpha != self.alpha:
+            raise Exception('Only accumulators of the same series, periods and accuracy can be merged.')
+        if other.n == 0:
+            return
+
+        n = self.n + other.n
+        delta = other.mean - self.mean
+
+        self.M2 = self.M2 + other.M2 + delta**2*self.n*other.n/n
+        self.mean = self.mean + delta*other.n/n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+        buckets, inverse = np.unique(np.concatenate([self.buckets, other.buckets]), return_inverse=True)
+        self.counts = np.bincount(inverse.reshape(-1), weights=np.concatenate([self.counts, other.counts]),
+                                  minlength=len(buckets)).astype(np.int64)
+        self.buckets = buckets
+
+    def quantile(self, q):
+        """
+        estimated quantile q of all series and periods (series x periods),
+        interpolated linearly between the ranks like np.quantile
+        """
+        cumulated = np.cumsum(self.counts)
+
+        # number of runs before each cell
+        cellstart = np.arange(len(self.keys)*self.periods, dtype=np.int64)*self.width
+        before = np.concatenate([[0], cumulated])[np.searchsorted(self.buckets, cellstart)]
+
+        def valueAtRank(rank):
+            b = self.buckets[np.searchsorted(cumulated, before+rank, side="right")] % self.width
+            return self.valueOf(b).reshape(len(self.keys), self.periods)
+
+        position = q*(self.n-1)
+        rank = int(np.floor(position))
+        values = valueAtRank(rank)
+        if rank+1 < self.n:
+            values = values + (position-rank)*(valueAtRank(rank+1) - values)
+
+        return np.clip(values, self.min, self.max)
+
+    def table(self, quantiles = (0.25, 0.75), moments = ("mean", "std", "min", "max"), years = None):
+        """
+        returns the summary table of the accumulated runs, in the format of
+        Statistics.summarize
+        """
+        if self.n == 0:
+            raise Exception('No runs have been accumulated.')
+
+        if years is None:
+            years = np.arange(self.periods)
+
+        values = {"mean": self.mean,
+                  "var":  self.M2/self.n,
+                  "std":  np.sqrt(self.M2/self.n),
+                  "min":  self.min,
+                  "max":  self.max}
+
+        for m in moments:
+            if m not in values:
+                raise Exception('Unknown statistic "{a}", possible are: {b}.'.format(a = m, b = ", ".join(values)))
+
+        table = {"kind":   np.repeat(np.asarray([k[0] for k in self.keys], dtype=object), self.periods),
+                 "source": np.repeat(np.asarray([k[1] for k in self.keys], dtype=object), self.periods),
+                 "target": np.repeat(np.asarray([k[2] for k in self.keys], dtype=object), self.periods),
+                 "year":   np.tile(np.asarray(years), len(self.keys))}
+
+        for m in moments:
+            table[m] = values[m].reshape(-1)
+
+        for q in quantiles:
+            table[st.quantileName(q)] = self.quantile(q).reshape(-1)
+
+        return table
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic model databases with the schema of the case study
+databases (tables compartments, transfercoefficients, input and lifetimes),
+for tests and benchmarks of setupModel and Export_Calculation.py
+
+"""
+
+# import necessary packages
+import os
+import sqlite3
+import numpy as np
+
+# flow compartments of the case study, in the order of the export calculation
+# (Export_Calculation.py), used for the first flow compartments
+CASESTUDY_FLOWS = ['Recycled Material Production',
+                   'Primary Production',
+                   'Transport',
+                   'Fibre Production',
+                   'Non-Textile Manufacturing',
+                   'Textile Manufacturing',
+                   'Packaging (sector)',
+                   'Automotive (sector)',
+                   'Electrical and Electronic Equipment (sector)',
+                   'Clothing (sector)',
+                   'Household Textiles (sector)',
+                   'Technical Textiles (sector)']
+
+SINKS = ['Landfill', 'Incineration', 'Recycling', 'Export']
+
+SCHEMA = ["CREATE TABLE compartments (name TEXT, fullname TEXT, type TEXT)",
+          "CREATE TABLE transfercoefficients (id INTEGER PRIMARY KEY, comp1 TEXT, comp2 TEXT, year INTEGER, mat TEXT, value, priority INTEGER, dqisgeo REAL, dqistemp REAL, dqismat REAL, dqistech REAL, dqisrel REAL, source TEXT)",
+          "CREATE TABLE input (id INTEGER PRIMARY KEY, comp TEXT, year INTEGER, mat TEXT, value REAL, dqisgeo REAL, dqistemp REAL, dqismat REAL, dqistech REAL, dqisrel REAL, source TEXT)",
+          "CREATE TABLE lifetimes (id INTEGER PRIMARY KEY, comp TEXT, year INTEGER, value REAL)"]
+
+
+def compartmentNames(compartments, stocks):
+    """
+    names of the flow compartments, stocks and sinks of a synthetic database
+    """
+    flows = CASESTUDY_FLOWS[:compartments] + ["Flow compartment "+str(i+1) for i in range(len(CASESTUDY_FLOWS), compartments)]
+    return flows, ["Use phase "+str(i+1) for i in range(stocks)], list(SINKS)
+
+def writeDatabase(path, compartments = 12, stocks = 2, years = (1950, 2016), materials = ("LDPE",),
+                  double = 0.3, sources = 2, trade = False, seed = 0):
+    """
+    writes a synthetic database into path (replaced if it exists) with
+    compartments flow compartments (the first ones with the names of the case
+    study), stocks stocks, the sinks SINKS and an unused compartment without
+    input, for the years (first, last) and materials. A share double of the
+    TCs and inputs of each year have two datapoints. The first sources flow
+    compartments have inputs. With trade, the other compartments of the
+    export calculation have inputs too, some of them negative (net exports,
+    to be converted by Export_Calculation.py before setupModel can be used).
+    Returns the path
+    """
+    rng = np.random.default_rng(seed)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    flows, stocklist, sinks = compartmentNames(compartments, stocks)
+    unused = "Unused compartment"
+    yearlist = list(range(years[0], years[1]+1))
+
+    ### FLOW GRAPH
+
+    # each flow compartment transfers to the next one (so that all of them
+    # receive mass) and to other compartments further down the chain, its
+    # first destination taking the rest ("rest" with the lowest priority)
+    edges = {}
+    for i, comp in enumerate(flows):
+        later = flows[i+2:i+6] + stocklist + sinks[:-1]
+        edges[comp] = flows[i+1:i+2] + list(rng.choice(later, size = min(2, len(later)), replace = False))
+    for stock in stocklist:
+        edges[stock] = list(rng.choice(sinks[:-1], size = 2, replace = False))
+    edges[unused] = [sinks[0]]
+
+    # the export calculation needs a flow into the Export sink
+    if trade:
+        if stocks == 0:
+            raise Exception('A database with trade needs at least one stock.')
+        edges[stocklist[0]].append(sinks[-1])
+
+    # lifetimes of the stocks: release rates over a few years
+    lifetimes = []
+    for stock in stocklist:
+        rates = rng.dirichlet(np.ones(int(rng.integers(3, 12))))
+        lifetimes += [(stock, k, float(r)) for k, r in enumerate(rates)]
+
+    def dqis():
+        return [int(x) for x in rng.integers(1, 5, 5)]
+
+    def datapoints(value):
+        if rng.random() < double:
+            return [value, round(value*rng.uniform(0.7, 1.3), 6)]
+        return [value]
+
+    ### TABLES
+
+    tcrows = []
+    inputrows = []
+
+    for mat in materials:
+        for comp, dests in edges.items():
+            # mean share of the other destinations, varying over the years
+            shares = rng.uniform(0.05, 0.8/len(dests), len(dests))
+            trends = rng.uniform(-0.3, 0.3, len(dests))
+            for k, dest in enumerate(dests):
+                for j, year in enumerate(yearlist):
+                    if k == 0:
+                        values = ["rest"]
+                    else:
+                        share = shares[k]*(1 + trends[k]*j/max(len(yearlist)-1, 1))
+                        values = datapoints(round(share*rng.uniform(0.9, 1.1), 6))
+                    for value in values:
+                        tcrows.append((comp, dest, year, mat, value, 1 if k == 0 else 2) + tuple(dqis()) + ("synthetic",))
+
+        # inputs of the sources growing over the years, trade around zero
+        for i, comp in enumerate(flows):
+            if i < sources:
+                level = rng.uniform(10, 1000)
+                values = [level*(1 + 0.03*j) for j in range(len(yearlist))]
+            elif trade and comp in CASESTUDY_FLOWS:
+                level = rng.uniform(-50, 50)
+                values = [level + rng.normal(0, 10) for j in range(len(yearlist))]
+            else:
+                continue
+            for year, value in zip(yearlist, values):
+                for v in datapoints(round(float(value), 6)):
+                    inputrows.append((comp, year, mat, v) + tuple(dqis()) + ("synthetic",))
+
+        for year in yearlist:
+            inputrows.append((unused, year, mat, 0) + tuple(dqis()) + ("synthetic",))
+
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+
+    for statement in SCHEMA:
+        cursor.execute(statement)
+
+    cursor.executemany("INSERT INTO compartments VALUES (?, ?, ?)",
+                       [(c, c, "Flow") for c in flows + [unused]] + [(c, c, "Stock") for c in stocklist] + [(c, c, "Sink") for c in sinks])
+    cursor.executemany("""INSERT INTO transfercoefficients (comp1, comp2, year, mat, value, priority, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", tcrows)
+    cursor.executemany("""INSERT INTO input (comp, year, mat, value, dqisgeo, dqistemp, dqismat, dqistech, dqisrel, source)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", inputrows)
+    cursor.executemany("INSERT INTO lifetimes (comp, year, value) VALUES (?, ?, ?)", lifetimes)
+
+    # ids larger than the years, like in the case study databases (the export
+    # calculation looks for the year in the whole row of a TC)
+    cursor.execute("UPDATE transfercoefficients SET id = id + 100000")
+    cursor.execute("UPDATE input SET id = id + 100000")
+
+    connection.commit()
+    connection.close()
+
+    return path
@@ -5,13 +5,53 @@ Created on Mon Apr 29 09:54:22 2019
 @author: dew
 """
 
-from scipy.stats import trapz
 import numpy.random as nr
 import numpy as np
+from scipy.stats import qmc
+
+import Instrumentation as ins
+
+# version of the sampling, to be increased whenever a change of the functions
+# below changes the values drawn for a given seed (used to invalidate cached
+# models, see ModelCache)
+SAMPLER_VERSION = 2
+
+# sampling methods: pseudo-random uniforms, Latin hypercube or scrambled Sobol
+# sequence (one dimension per distribution)
+METHODS = ["random", "lhs", "sobol"]
+
+#============= CDF AND INVERSE CDF OF TRAPEZOIDAL DISTRIBUTIONS ================
+
+def TrapezCDF(x, A, B, c, d):
+    """
+    cumulative distribution function of a trapezoidal distribution between A
+    and B, with the plateau going from c to d (relative to the interval A-B,
+    same parametrization as scipy.stats.trapezoid)
+    """
+    z = np.clip((x-A)/(B-A), 0, 1)
+    h = 1+d-c
+    
+    # avoid divisions by zero when the plateau touches one of the limits
+    left = np.where(c > 0, c*h, 1)
+    right = np.where(d < 1, (1-d)*h, 1)
+    
+    return np.where(z < c, z**2/left,
+                    np.where(z <= d, (2*z-c)/h, 1-(1-z)**2/right))
+
+def TrapezInvCDF(u, A, B, c, d):
+    """
+    inverse of TrapezCDF, maps probabilities u in [0,1] onto the distribution
+    """
+    h = 1+d-c
+    
+    z = np.where(u < c/h, np.sqrt(u*c*h),
+                 np.where(u <= (2*d-c)/h, (u*h+c)/2, 1-np.sqrt((1-u)*(1-d)*h)))
+    
+    return A + z*(B-A)
 
 #============= FUNCTION FOR TRUNCATING TRAPEZOIDAL DISTRIBUTIONS ==============
 
-def TrapezTrunc(TC1, TC2, spread1, spread2, N, linf=float('-inf'), lsup=float('inf')): 
+def TrapezTrunc(TC1, TC2, spread1, spread2, N, linf=float('-inf'), lsup=float('inf'), u=None): 
     if TC1+TC2 == 0:
         return np.asarray([0]*N)
     
@@ -27,51 +67,396 @@ def TrapezTrunc(TC1, TC2, spread1, spread2, N, linf=float('-inf'), lsup=float('i
         c = (TC2-A)/(B-A)
         d = (TC1-A)/(B-A)
     
-    loc = A
-    scale = B-A
+    # truncation interval within the support of the distribution
+    lo = max(A, linf)
+    hi = min(B, lsup)
     
-    dist = trapz.rvs(c, d, loc, scale, N)
+    if lo > hi:
+        raise Exception('The truncation interval [{a}, {b}] does not overlap with the trapezoidal distribution between {c} and {d}.'.format(a = linf, b = lsup, c = TC1, d = TC2))
     
-    truncdist = [i for i in dist if i >= linf]
-    truncdist = [i for i in truncdist if i <= lsup]
+    if lo == hi:
+        return np.asarray([lo]*N)
     
+    # draw uniformly between the probabilities of both limits and invert the
+    # CDF, so that all N samples lie in the proper range without rejection
+    Flo = TrapezCDF(lo, A, B, c, d)
+    Fhi = TrapezCDF(hi, A, B, c, d)
     
-    while len(truncdist) < N:
-         adddist = trapz.rvs(c, d, loc, scale, N-len(truncdist))
-         truncadddist = [i for i in adddist if i >= linf]
-         truncadddist = [i for i in truncadddist if i <= lsup]
-         
-         truncdist = truncdist + truncadddist
+    # u: N uniforms in [0,1) to use instead of random draws
+    if u is None:
+        u = nr.uniform(0, 1, N)
+    u = Flo + (Fhi-Flo)*u
     
-    return np.asarray(truncdist)
+    return np.clip(TrapezInvCDF(u, A, B, c, d), lo, hi)
+
+#============= CDF AND INVERSE CDF OF TRIANGULAR DISTRIBUTIONS =================
+
+def TriangCDF(x, A, C, B):
+    """
+    cumulative distribution function of a triangular distribution with lower
+    limit A, mode C and upper limit B (works elementwise on arrays)
+    """
+    x = np.clip(x, A, B)
+    
+    # avoid divisions by zero when the mode lies on one of the limits
+    left = np.where(C > A, (B-A)*(C-A), 1)
+    right = np.where(B > C, (B-A)*(B-C), 1)
+    
+    return np.where(x <= C, (x-A)**2/left, 1-(B-x)**2/right)
+
+def TriangInvCDF(u, A, C, B):
+    """
+    inverse of TriangCDF, maps probabilities u in [0,1] onto the distribution
+    """
+    # probability mass on the left of the mode
+    FC = (C-A)/(B-A)
+    
+    return np.where(u <= FC,
+                    A + np.sqrt(u*(B-A)*(C-A)),
+                    B - np.sqrt((1-u)*(B-A)*(B-C)))
 
 #============= FUNCTION FOR TRUNCATING TRIANGULAR DISTRIBUTIONS ===============
     
-def TriangTrunc(TC1, spread1, N, linf=float('-inf'), lsup=float('inf')):
+def TriangTrunc(TC1, spread1, N, linf=float('-inf'), lsup=float('inf'), u=None):
     if TC1 == 0:
         return np.asarray([0]*N)
     
     if TC1 == 1 and lsup == 1:
         return np.asarray([1]*N)
     
-    # define variables for trapezoidal distribution
+    # define variables for triangular distribution
     A = TC1*(1-spread1)
     B = TC1*(1+spread1)
     
-    dist = nr.triangular(A, TC1, B, N)
+    # truncation interval within the support of the distribution
+    lo = max(A, linf)
+    hi = min(B, lsup)
+    
+    if lo > hi:
+        raise Exception('The truncation interval [{a}, {b}] does not overlap with the triangular distribution around {c}.'.format(a = linf, b = lsup, c = TC1))
+    
+    if A == B or lo == hi:
+        return np.asarray([lo]*N)
+    
+    # draw uniformly between the probabilities of both limits and invert the
+    # CDF, so that all N samples lie in the proper range without rejection
+    Flo = TriangCDF(lo, A, TC1, B)
+    Fhi = TriangCDF(hi, A, TC1, B)
+    
+    # u: N uniforms in [0,1) to use instead of random draws
+    if u is None:
+        u = nr.uniform(0, 1, N)
+    u = Flo + (Fhi-Flo)*u
+    
+    return np.clip(TriangInvCDF(u, A, TC1, B), lo, hi)
+
+#============= BATCHED SAMPLING OF MANY TRUNCATED DISTRIBUTIONS ===============
+
+def TriangTruncParameters(TC1, spread1, linf, lsup):
+    """
+    parameters of the truncated triangular distributions (arrays with one
+    entry per distribution): A, C, B, truncation limits lo and hi, rows that
+    are constant and their value. Constant rows get a dummy distribution
+    """
+    TC1, spread1, linf, lsup = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (TC1, spread1, linf, lsup)])
+    
+    # define variables for triangular distributions
+    A = TC1*(1-spread1)
+    B = TC1*(1+spread1)
+    
+    # truncation intervals within the support of the distributions
+    lo = np.maximum(A, linf)
+    hi = np.minimum(B, lsup)
+    
+    # same special cases as in TriangTrunc, these rows are constant
+    fixed = (TC1 == 0) | ((TC1 == 1) & (lsup == 1))
+    const = fixed | (A == B) | (lo == hi)
+    constvalue = np.where(TC1 == 0, 0, np.where(fixed, 1, lo))
+    
+    bad = (lo > hi) & ~fixed
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise Exception('The truncation interval [{a}, {b}] does not overlap with the triangular distribution around {c}.'.format(a = linf[i], b = lsup[i], c = TC1[i]))
+    
+    # replace constant rows by a dummy distribution to avoid divisions by zero
+    A = np.where(const, 0, A)
+    C = np.where(const, 0.5, TC1)
+    B = np.where(const, 1, B)
+    lo = np.where(const, 0, lo)
+    hi = np.where(const, 1, hi)
+    
+    return A, C, B, lo, hi, const, constvalue
+
+def TriangTruncMatrix(TC1, spread1, N, linf=float('-inf'), lsup=float('inf'), u=None):
+    """
+    vectorized version of TriangTrunc: TC1, spread1, linf and lsup are arrays
+    (or scalars) with one entry per distribution, returns a matrix with one
+    row of N samples for each distribution (obtained from the matrix of
+    uniforms u if given, see Uniforms)
+    """
+    A, C, B, lo, hi, const, constvalue = TriangTruncParameters(TC1, spread1, linf, lsup)
+    
+    Flo = TriangCDF(lo, A, C, B)[:, None]
+    Fhi = TriangCDF(hi, A, C, B)[:, None]
+    
+    if u is None:
+        u = nr.uniform(0, 1, (len(A), N))
+    u = Flo + (Fhi-Flo)*u
+    
+    samples = np.clip(TriangInvCDF(u, A[:, None], C[:, None], B[:, None]), lo[:, None], hi[:, None])
+    samples[const] = constvalue[const][:, None]
+    
+    return samples
+
+def TrapezTruncParameters(TC1, TC2, spread1, spread2, linf, lsup):
+    """
+    parameters of the truncated trapezoidal distributions (arrays with one
+    entry per distribution): A, B, c, d, truncation limits lo and hi, rows
+    that are constant and their value. Constant rows get a dummy distribution
+    """
+    TC1, TC2, spread1, spread2, linf, lsup = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (TC1, TC2, spread1, spread2, linf, lsup)])
+    
+    # order both datapoints like in TrapezTrunc
+    swap = TC1 >= TC2
+    low = np.where(swap, TC2, TC1)
+    high = np.where(swap, TC1, TC2)
+    
+    # define variables for trapezoidal distributions
+    A = low*(1-np.where(swap, spread2, spread1))
+    B = high*(1+np.where(swap, spread1, spread2))
+    
+    # truncation intervals within the support of the distributions
+    lo = np.maximum(A, linf)
+    hi = np.minimum(B, lsup)
+    
+    # rows without any spread are constant
+    zero = TC1+TC2 == 0
+    const = zero | (A == B) | (lo == hi)
+    constvalue = np.where(zero, 0, lo)
+    
+    bad = (lo > hi) & ~zero
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise Exception('The truncation interval [{a}, {b}] does not overlap with the trapezoidal distribution between {c} and {d}.'.format(a = linf[i], b = lsup[i], c = TC1[i], d = TC2[i]))
+    
+    # replace constant rows by a dummy distribution to avoid divisions by zero
+    A = np.where(const, 0, A)
+    B = np.where(const, 1, B)
+    c = np.where(const, 0, (low-A)/np.where(const, 1, B-A))
+    d = np.where(const, 1, (high-A)/np.where(const, 1, B-A))
+    lo = np.where(const, 0, lo)
+    hi = np.where(const, 1, hi)
+    
+    return A, B, c, d, lo, hi, const, constvalue
+
+def TrapezTruncMatrix(TC1, TC2, spread1, spread2, N, linf=float('-inf'), lsup=float('inf'), u=None):
+    """
+    vectorized version of TrapezTrunc: all parameters except N are arrays (or
+    scalars) with one entry per distribution, returns a matrix with one row
+    of N samples for each distribution (obtained from the matrix of uniforms
+    u if given, see Uniforms)
+    """
+    A, B, c, d, lo, hi, const, constvalue = TrapezTruncParameters(TC1, TC2, spread1, spread2, linf, lsup)
+    
+    Flo = TrapezCDF(lo, A, B, c, d)[:, None]
+    Fhi = TrapezCDF(hi, A, B, c, d)[:, None]
+    
+    if u is None:
+        u = nr.uniform(0, 1, (len(A), N))
+    u = Flo + (Fhi-Flo)*u
+    
+    samples = np.clip(TrapezInvCDF(u, A[:, None], B[:, None], c[:, None], d[:, None]), lo[:, None], hi[:, None])
+    samples[const] = constvalue[const][:, None]
+    
+    return samples
+
+def Uniforms(n, N, method="random"):
+    """
+    matrix of uniforms in [0,1) for n distributions (rows) and N runs
+    (columns). With "lhs" or "sobol" (see METHODS), the columns are the points
+    of a Latin hypercube or of a scrambled Sobol sequence with one dimension
+    per distribution, seeded from the global random state
+    """
+    if method not in METHODS:
+        raise Exception('Unknown sampling method "{a}", possible are: {b}.'.format(a = method, b = ", ".join(METHODS)))
+    
+    if method == "random" or n == 0:
+        return nr.uniform(0, 1, (n, N))
+    
+    seed = nr.randint(2**31-1)
+    
+    if method == "lhs":
+        return qmc.LatinHypercube(d = n, seed = seed).random(N).T
+    
+    if n > qmc.Sobol.MAXDIM:
+        raise Exception('A Sobol sequence has at most {a} dimensions, the model has {b} distributions.'.format(a = qmc.Sobol.MAXDIM, b = n))
+    
+    return qmc.Sobol(d = n, scramble = True, seed = seed).random(N).T
+
+def SampleDistributions(params, N, method="random", u=None):
+    """
+    samples N values for each distribution in params, a list of tuples
+    (shape, TC1, TC2, spread1, spread2, linf, lsup) where shape is either
+    "triang" (TC2 and spread2 are then ignored) or "trapez", from uniforms
+    of the sampling method (see Uniforms) or from the matrix of uniforms u
+    (one row per distribution) if given.
+    Returns a matrix with one row per distribution, in the order of params.
+    """
+    samples = np.zeros((len(params), N))
+    
+    if len(params) == 0:
+        return samples
+    
+    ins.count("samples_drawn", len(params)*N)
+    
+    shape, TC1, TC2, spread1, spread2, linf, lsup = [np.asarray(x) for x in zip(*params)]
+    
+    # one vectorized call per type of distribution
+    triang = shape == "triang"
+    trapez = shape == "trapez"
+    
+    # the pseudo-random uniforms are drawn by each call
+    if u is None and method != "random":
+        u = Uniforms(len(params), N, method)
+    
+    if triang.any():
+        samples[triang] = TriangTruncMatrix(TC1[triang], spread1[triang], N, linf[triang], lsup[triang],
+                                            None if u is None else u[triang])
+    
+    if trapez.any():
+        samples[trapez] = TrapezTruncMatrix(TC1[trapez], TC2[trapez], spread1[trapez], spread2[trapez], N, linf[trapez], lsup[trapez],
+                                            None if u is None else u[trapez])
+    
+    return samples
+
+#============= MEANS OF TRUNCATED DISTRIBUTIONS ================================
+
+def TruncatedMean(CDF, lo, hi, breakpoints):
+    """
+    mean of distributions with the piecewise quadratic CDF (a function of x
+    only) truncated to [lo, hi], breakpoints being the arrays of the limits
+    of the pieces. Uses mean = lo + integral of (F(hi)-F(x))/(F(hi)-F(lo))
+    between lo and hi, computed exactly with Simpson's rule on each piece
+    """
+    Fhi = CDF(hi)
+    points = [lo] + [np.clip(b, lo, hi) for b in breakpoints] + [hi]
+    
+    integral = 0
+    for a, b in zip(points[:-1], points[1:]):
+        integral = integral + (b-a)/6*((Fhi-CDF(a)) + 4*(Fhi-CDF((a+b)/2)) + (Fhi-CDF(b)))
     
-     # remove all that's not in the proper range - we end with a distribution with a length < N
-    truncdist = [i for i in dist if i >= linf]
-    truncdist = [i for i in truncdist if i <= lsup]
+    return lo + integral/(Fhi-CDF(lo))
+
+def TriangTruncMean(TC1, spread1, linf=float('-inf'), lsup=float('inf')):
+    """
+    means of the distributions sampled by TriangTruncMatrix (one entry per
+    distribution)
+    """
+    A, C, B, lo, hi, const, constvalue = TriangTruncParameters(TC1, spread1, linf, lsup)
+    
+    means = TruncatedMean(lambda x: TriangCDF(x, A, C, B), lo, hi, [C])
+    
+    return np.where(const, constvalue, np.clip(means, lo, hi))
+
+def TrapezTruncMean(TC1, TC2, spread1, spread2, linf=float('-inf'), lsup=float('inf')):
+    """
+    means of the distributions sampled by TrapezTruncMatrix (one entry per
+    distribution)
+    """
+    A, B, c, d, lo, hi, const, constvalue = TrapezTruncParameters(TC1, TC2, spread1, spread2, linf, lsup)
+    
+    means = TruncatedMean(lambda x: TrapezCDF(x, A, B, c, d), lo, hi, [A+c*(B-A), A+d*(B-A)])
+    
+    return np.where(const, constvalue, np.clip(means, lo, hi))
+
+def DistributionMeans(params):
+    """
+    means of the distributions in params (same format as in
+    SampleDistributions), in the order of params
+    """
+    means = np.zeros(len(params))
+    
+    if len(params) == 0:
+        return means
+    
+    shape, TC1, TC2, spread1, spread2, linf, lsup = [np.asarray(x) for x in zip(*params)]
+    
+    triang = shape == "triang"
+    trapez = shape == "trapez"
+    
+    if triang.any():
+        means[triang] = TriangTruncMean(TC1[triang], spread1[triang], linf[triang], lsup[triang])
+    
+    if trapez.any():
+        means[trapez] = TrapezTruncMean(TC1[trapez], TC2[trapez], spread1[trapez], spread2[trapez], linf[trapez], lsup[trapez])
+    
+    return means
+
+def RandomChoice(sample):
+    """
+    draws one value of a sample with the global random state (defined here
+    so that transfers using it can be sent to other processes)
+    """
+    return nr.choice(sample)
+
+class RunSample(object):
+    """
+    takes the values of a sample in the order of the runs (value i in run i,
+    from the first value again after the last one) instead of at random like
+    RandomChoice, so that the runs keep the stratification of a sample from
+    Uniforms. Used as function of a TransferDistribution or of a
+    StochasticFunctionInflow, called calls times per run (the dpmfa simulator
+    determines the TCs of the stocks twice per run)
+    """
+    
+    def __init__(self, sample, calls=1):
+        self.sample = sample
+        self.calls = calls
+        self.position = 0
+    
+    def __call__(self):
+        value = self.sample[(self.position//self.calls) % len(self.sample)]
+        self.position += 1
+        return value
+    
+    def setRun(self, run):
+        """
+        the next value is the one of run
+        """
+        self.position = run*self.calls
+
+class SampleMatrix(object):
+    """
+    samples of all distributions params of a model (one row per distribution,
+    see SampleDistributions) that can be drawn again for another number of
+    runs, e.g. for each chunk of a simulation instead of keeping the samples
+    of all runs in the model
+    """
+    
+    def __init__(self, params, method, values):
+        self.params = params
+        self.method = method
+        self.values = values
+    
+    def resample(self, N, seed):
+        """
+        draws N new values of all distributions, from the seed
+        """
+        nr.seed(seed)
+        self.values = SampleDistributions(self.params, N, self.method)
+
+class MatrixRow(RunSample):
+    """
+    RunSample of one row of a SampleMatrix, following the matrix when its
+    values are drawn again
+    """
     
-    # Create the "same" triangular distribution with the missing number of samples, and remove all that's not in the range.
-    # "while" -> do that until you have N samples. 
-    while len(truncdist) < N:
-         adddist = nr.triangular(A, TC1, B, N-len(truncdist))
-         truncadddist = [i for i in adddist if i >= linf]
-         truncadddist = [i for i in truncadddist if i <= lsup]
-         
-          # concatenate both triangular distributions
-         truncdist = truncdist + truncadddist
+    def __init__(self, matrix, row, calls=1):
+        self.matrix = matrix
+        self.row = row
+        self.calls = calls
+        self.position = 0
     
-    return np.asarray(truncdist)
\ No newline at end of file
+    @property
+    def sample(self):
+        return self.matrix.values[self.row]
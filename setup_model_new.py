@@ -10,35 +10,61 @@ Function for setting up a model based on a database
 ### PACKAGE IMPORT AND VARIABLE DEFINITION ########################################################################
 
 # import necessary packages
-import sqlite3
 import numpy as np
-import math
 
 from dpmfa import components as cp
 from dpmfa import model as mod
 import TruncatingFunctions as tr
+import IncrementalBuild as ib
+from DatabaseLoader import ModelDatabase
+from Pedigree import PedigreeCV
+import ModelGraph as mg
+import Instrumentation as ins
 
-def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
+def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear, data = None, state = None, mean = False,
+               sampling = "random", bank = None, resample = False):
     """
     imports an SQL database and implements a model using the dpmfa package
+    (data: content of the database already loaded with ModelDatabase; state:
+    IncrementalBuild.BuildState of the last build, only the transfers and
+    inflows that changed since are sampled again). With mean, the TCs and
+    inflows are the means of their distributions instead of samples (a
+    deterministic model, see MassBalance.DeterministicSimulator). sampling is
+    the method of TruncatingFunctions.Uniforms used for the samples of the TCs
+    and inflows: with "lhs" or "sobol", run i of the simulation uses value i
+    of every sample, so that the runs keep their stratification. With a
+    bank (SampleBank.SampleBank), the samples are obtained from the uniforms
+    of the bank for each TC and input by year, taken in the order of the runs
+    (the same random numbers for all models using the bank, sampling must be
+    "random"). With resample, the samples are kept in one
+    TruncatingFunctions.SampleMatrix (model.sampleMatrix), taken in the order
+    of the runs and drawn again for each chunk of runs of a simulation (see
+    ChunkedSimulation), RUNS being the number of runs of a chunk
     """
     
-    # open database
-    connection = sqlite3.connect(pathtoDB)
-    cursor = connection.cursor()
+    if bank is not None and sampling != "random":
+        raise Exception('The samples of a sample bank are taken from its uniforms, sampling "{a}" cannot be used with a bank.'.format(a = sampling))
     
-    # create model
-    model = mod.Model(modelname)
+    if resample and (mean or bank is not None):
+        raise Exception('The samples of a model with means or a sample bank cannot be drawn again.')
     
-    # extract years from input
-    cursor.execute("SELECT DISTINCT year FROM input")
-    years_input = cursor.fetchall()
-    years_input = [item for sublist in years_input for item in sublist]
+    ins.begin("setupModel")
     
-    # extract years from tc
-    cursor.execute("SELECT DISTINCT year FROM transfercoefficients")
-    years_tc = cursor.fetchall()
-    years_tc = [item for sublist in years_tc for item in sublist]
+    # load the content of the database for the material
+    if data is None:
+        data = ModelDatabase(pathtoDB, mat)
+    
+    # CVs of all datapoints, calculated from the DQIs
+    tcCV = PedigreeCV(data.tc["dqis"])
+    inputCV = PedigreeCV(data.input["dqis"])
+    
+    # create model (with new lists, the default ones of mod.Model are shared
+    # between all models built in the same process)
+    model = mod.Model(modelname, [], [])
+    
+    # years from input and tc
+    years_input = data.years_input
+    years_tc = data.years_tc
     
     print("Temporal range of input: "+str(min(years_input))+" - "+str(max(years_input)))
     print("Temporal range of TCs: "+str(min(years_tc))+" - "+str(max(years_tc)))
@@ -50,25 +76,30 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
     
     ### COMPARTMENT DEFINITION
     
-    # extract possible compartment names from database
-    cursor.execute("SELECT DISTINCT * FROM compartments")
-    complist = cursor.fetchall()
+    ins.begin("compartments")
+    
+    # possible compartment names from database
+    complist = data.complist
+    
+    # short compartment names for implementation
+    shortnames = {c[1]: c[0] for c in complist}
     
-    # extract list of compartments being in the lifetimes table
-    cursor.execute("SELECT DISTINCT comp FROM lifetimes")
-    stocklist = cursor.fetchall()
-    # flatten the list
-    stocklist = [item for sublist in stocklist for item in sublist]
+    # list of compartments being in the lifetimes table
+    stocklist = data.stocklist
     
-    # extract list of compartments with outflows
-    cursor.execute("SELECT DISTINCT comp1 FROM transfercoefficients")
-    outflowlist = cursor.fetchall()
-    # flatten the list
-    outflowlist = [item for sublist in outflowlist for item in sublist]
+    # list of compartments with outflows
+    outflowlist = data.outflowlist
     
     # create the dictionary of compartments that will be inserted into the model
     CompartmentDict = {}
     
+    # parameters of all distributions of the model, sampled at once further
+    # down: one tuple shape, TC1, TC2, CV1, CV2, linf, lsup per distribution
+    distparams = []
+    
+    # key of each distribution in a sample bank
+    distkeys = []
+    
     # loop over compartments
     for i in np.arange(len(complist)):
         
@@ -98,22 +129,25 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
                 print('The estimation as "Sink" does not correspond to the compartments table in the database')
     
     
+    ins.end("compartments")
+    
     ### FLOW DEFINITION
     
+    ins.begin("flows")
+    
+    # list of transfers to implement once the distributions are sampled, one
+    # tuple (source, destination, TC, priority) per transfer, the TC being
+    # either a constant or a list of rows of the sample matrix (one per year)
+    flowlist = []
+    
     # loop over compartments with a defined outflow
     for comp in outflowlist:
         
         # extract destination compartments
-        cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1='"+comp+"' AND mat = '"+mat+"')")
-        destlist = cursor.fetchall()
-        # flatten the list
-        destlist = [item for sublist in destlist for item in sublist]
+        destlist = data.getDestinations(comp)
         
         # short compartment name for implementation
-        for i in range(len(complist)):
-            if complist[i][1] == comp:
-                ind = i
-        compname = complist[ind][0]
+        compname = shortnames[comp]
         
         # create a transfer list
         CompartmentDict[compname].transfers = []
@@ -123,26 +157,16 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
             print("Implementing flow from "+comp+" to "+dest+"...")
             
             # short compartment name for implementation
-            for i in range(len(complist)):
-                if complist[i][1] == dest:
-                    ind = i
-            destname = complist[ind][0]
+            destname = shortnames[dest]
             
-            # import data
-            cursor.execute("SELECT * FROM transfercoefficients WHERE (comp1 = '"+comp+"' AND comp2 = '"+dest+"' AND mat = '"+mat+"')")
-            df = cursor.fetchall()
+            # rows of the data
+            df = data.tcrows[(comp, dest)]
             
             # create vectors
-            dfvalue = []
-            dfsource = []
-            dfyears = []
-            dfpriority = []
-            
-            for i in np.arange(len(df)):
-                dfvalue.append(df[i][5])
-                dfsource.append(df[i][12])
-                dfyears.append(df[i][3])
-                dfpriority.append(df[i][6])
+            dfvalue = list(data.tc["value"][df])
+            dfsource = list(data.tc["source"][df])
+            dfyears = list(data.tc["year"][df])
+            dfpriority = [int(x) for x in data.tc["priority"][df]]
             
             # test that priorities are adequate
             if(len(set(dfpriority)) != 1):
@@ -151,198 +175,84 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
             # implement transfers
             if(all(x == 0 for x in dfvalue)):
                 # if all TCs are 0, implement a ConstTransfer (no distribution possible)
-                CompartmentDict[compname].transfers.append(cp.ConstTransfer(0, CompartmentDict[destname], priority = dfpriority[0]))
+                flowlist.append((compname, destname, 0, dfpriority[0]))
             
             elif(all(x == 1 for x in dfvalue)):
                 # if all TCs are 1, implement a ConstTransfer (no distribution possible)
-                CompartmentDict[compname].transfers.append(cp.ConstTransfer(1, CompartmentDict[destname], priority = dfpriority[0]))
+                flowlist.append((compname, destname, 1, dfpriority[0]))
                 
             elif(all((x == "rest" or x == "Rest") for x in dfvalue) or
                  all((x == "rest" or x == "Rest") for x in dfsource)):
                 # if all TCs are "rest", implement a ConstTransfer with low priority
-                CompartmentDict[compname].transfers.append(cp.ConstTransfer(1, CompartmentDict[destname], priority = 1))               
+                flowlist.append((compname, destname, 1, 1))
                 
             else:
                 
-                # create list for storing distributions for all years
-                distlist = []
+                # create list for storing the rows of the distributions for all years
+                distrows = []
                 
                 # loop over years
                 for i in set(dfyears):
                     
-                    # find index corresponding to year i
-                    # logical list (true = corresponding year)
-                    logind = [i in x for x in df]
-                    ind = [i for i, x in enumerate(logind) if x]
+                    # find rows corresponding to year i
+                    ind = data.tcindex[(comp, dest, i)]
                     
                     # check if there are any double TCs, if yes, append trapezoidal distribution
                     if len(ind) == 2:
-                        value1 = df[ind[0]][5]
-                        value2 = df[ind[1]][5]
-                        
-                        # calculate the first CV
-                        dqis = df[ind[0]][7:12]
-                        CV1 = 1.5*math.sqrt(math.exp(2.21*(dqis[0]-1)) +
-                                            math.exp(2.21*(dqis[1]-1)) +
-                                            math.exp(2.21*(dqis[2]-1)) +
-                                            math.exp(2.21*(dqis[3]-1)) +
-                                            math.exp(2.21* dqis[4]   ) )/100*2.45
+                        value1 = data.tc["value"][ind[0]]
+                        value2 = data.tc["value"][ind[1]]
                         
-                        # calculate the second CV
-                        dqis = df[ind[1]][7:12]
-                        CV2 = 1.5*math.sqrt(math.exp(2.21*(dqis[0]-1)) +
-                                            math.exp(2.21*(dqis[1]-1)) +
-                                            math.exp(2.21*(dqis[2]-1)) +
-                                            math.exp(2.21*(dqis[3]-1)) +
-                                            math.exp(2.21* dqis[4]   ) )/100*2.45
+                        # get both CVs
+                        CV1 = tcCV[ind[0]]
+                        CV2 = tcCV[ind[1]]
                         
-                        distlist.append(cp.TransferDistribution(tr.TrapezTrunc, [value1, value2, CV1, CV2, 1, 0, 1]))
+                        distrows.append(len(distparams))
+                        distparams.append(("trapez", value1, value2, CV1, CV2, 0, 1))
                         
                     elif len(ind) == 1:
                         # if no, append triangular distribution
                         
-                        value = df[ind[0]][5]
+                        value = data.tc["value"][ind[0]]
                         
-                        # calculate the CV
+                        # get the CV
                         if value == 0:
                             CV = 0
                         else:
-                            dqis = df[ind[0]][7:12]
-                            
-                            CV = 1.5*math.sqrt(math.exp(2.21*(dqis[0]-1)) +
-                                               math.exp(2.21*(dqis[1]-1)) +
-                                               math.exp(2.21*(dqis[2]-1)) +
-                                               math.exp(2.21*(dqis[3]-1)) +
-                                               math.exp(2.21* dqis[4]   ) )/100*2.45
+                            CV = tcCV[ind[0]]
                             
-                        distlist.append(cp.TransferDistribution(tr.TriangTrunc, [value, CV, 1, 0, 1]))
+                        distrows.append(len(distparams))
+                        distparams.append(("triang", value, 0, CV, 0, 0, 1))
                         
                     else:
                         raise Exception('There should be exactly one or two datapoints in the database for the TC from "{a}" to "{b}", year "{c}" and material "{d}".'.format(a = comp, b = dest, c = i, d = mat))
+                    
+                    distkeys.append(("tc", comp, dest, i))
     
-                # implement a TimeDependentListTransfer based on all distributions calculated above
-                CompartmentDict[compname].transfers.append(cp.TimeDependentDistributionTransfer(distlist,
-                               CompartmentDict[destname],
-                               priority = dfpriority[0]))
+                # implement a TimeDependentListTransfer based on all distributions listed above
+                flowlist.append((compname, destname, distrows, dfpriority[0]))
                       
+    ins.end("flows")
+    
     ### CLEAN OUT LIST OF COMPARTMENTS
+    
+    ins.begin("clean-out")
 
     # check if some compartments are empty, if yes remove to avoid bugs (mormalization of zero TCs does not work)
-    cursor.execute("SELECT DISTINCT comp FROM input WHERE mat = '"+mat+"' AND NOT value = 0")
-    inputlist = cursor.fetchall()
-    inputlist = [item for sublist in inputlist for item in sublist]
-    
     # stores a logical value for each compartment in a dictionary
-    complog = {c:False for c in [l[1] for l in complist]}
-    
-    for comp in inputlist:
-       
-        # check if inflow is not zero for any period
-        cursor.execute("SELECT value FROM input WHERE comp='"+comp+"' AND mat='"+mat+"'")        
-        data = cursor.fetchall()
-        data = [item for sublist in data for item in sublist]
-        
-        # skip compartment if there is no input
-        if not any(x != 0 for x in data):
-            continue
-            
-        # else do not clean out compartment
-        complog[comp] = True
-        
-        # list for storing compartments already analyzed
-        companalyzed = []
-        
-        # start while loop at comp
-        comptoanalyze = [comp]
-        
-        while len(comptoanalyze) != 0:
-            
-            # copy for loop
-            comploop = comptoanalyze
-            
-            # loop over compartments
-            for startcomp in comploop:
-                
-                # loop over destination compartments
-                cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1='"+startcomp+"' AND mat = '"+mat+"' AND NOT value == 0)")
-                dest = cursor.fetchall()
-                dest = [item for sublist in dest for item in sublist]
-                
-                # append startcomp to companalyzed
-                companalyzed.append(startcomp)
-                
-                # if no destination compartments, move on
-                if len(dest) == 0:
-                    continue
-                
-                # else look at destination compartments closer
-                for endcomp in dest:
-                    
-                    # check only if wasn't checked earlier
-                    if endcomp in companalyzed:
-                        continue
-                    
-                    # import data
-                    cursor.execute("SELECT value FROM transfercoefficients WHERE (comp1 = '"+startcomp+"' AND comp2 = '"+endcomp+"' AND mat = '"+mat+"')")
-                    data = cursor.fetchall()
-                    data = [item for sublist in data for item in sublist]
-                    
-                    # check if any data point is not zero, if yes, mark as not for cleaning out
-                    if any(x != 0 for x in data):
-                            
-                        complog[endcomp] = True
-                        
-                        # add destinations from that compartment to comptoanalyze
-                        cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1 = '"+endcomp+"' AND mat = '"+mat+"' AND NOT value == 0)")
-                        otherdest = cursor.fetchall()
-                        otherdest = [item for sublist in otherdest for item in sublist]
-                        
-                        # set to true since flow not zero
-                        for d in otherdest:
-                            complog[d] = True
-                        
-                        # save as to analyze further
-                        comptoanalyze = comptoanalyze + otherdest
-                    
-                    # remove from comptoanalyze
-                    comptoanalyze = [x for x in comptoanalyze if x != endcomp]
-                    
-                    # remove duplicates
-                    comptoanalyze = list(set(comptoanalyze))
-                
-                # add all intermediate destinations to companalyzed
-                companalyzed = list(set(companalyzed + dest))
-            
-            # remove comps already analyzed
-            comptoanalyze = [x for x in comptoanalyze if not x in companalyzed]
-    
-    
-    # remove from dictionary
-    for i in np.arange(len(complist)):
-        
-        # remove compartment from dictionary if not in log
-        if not complog[complist[i][1]]:
-            CompartmentDict.pop(complist[i][0])
-        
-        else:
-            
-            if isinstance(CompartmentDict[complist[i][0]], cp.Sink):
-                continue
-            
-            # remove transfers from dictionary if target is not in log
-            transfers = CompartmentDict[complist[i][0]].transfers
-            
-            for dest in [t.target.name for t in transfers]:
-                if not complog[dest]:
-                    CompartmentDict[complist[i][0]].transfers = [x for x in CompartmentDict[complist[i][0]].transfers if complog[x.target.name]]
+    complog = mg.ReachableCompartments(data)
     
+    ins.end("clean-out")
     
     ### INPUT DEFINITION
     
+    ins.begin("inputs")
+    
     # extract list of compartments with input
-    cursor.execute("SELECT DISTINCT comp FROM input")
-    inputlist = cursor.fetchall()
-    inputlist = [item for sublist in inputlist for item in sublist]
+    inputlist = data.inputlist
+    
+    # list of inflows to implement once the distributions are sampled, one
+    # tuple (compartment, rows of the sample matrix) per inflow
+    inflowlist = []
     
     # loop over compartments
     for j in np.arange(len(complist)):
@@ -364,99 +274,168 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
         comp = CompartmentDict[compfull]
         
         # check if any input data is negative
-        cursor.execute("SELECT value FROM input WHERE comp='"+compname+"' AND mat='"+mat+"'")        
-        data = cursor.fetchall()
-        data = [item for sublist in data for item in sublist]
+        values = data.getInputValues(compname)
     
-        if any(x < 0 for x in data):
+        if any(x < 0 for x in values):
             raise Exception("There is a negative input for compartment "+compname)
         
-        # for storing distributions (one entry per year)
-        inflow_dist = []
+        # for storing the rows of the distributions (one entry per year)
+        inflow_rows = []
         
         for i in periodRange:
             
-            # import data from database for compartment compname and year i+startYear and material mat
-            cursor.execute("SELECT * FROM input WHERE comp='"+compname+"' AND year="+str(i+startYear)+" AND mat='"+mat+"'")        
-            data = cursor.fetchall()
+            # rows of the data for compartment compname and year i+startYear
+            ind = data.inputindex.get((compname, i+startYear), [])
             
             # check if any double data for compartment and year
-            if len(data) == 1:
+            if len(ind) == 1:
                 
                 # load inflow
-                inflow = data[0][4]
+                inflow = data.input["value"][ind[0]]
                 
                 # if the raw data is 0, include only zeroes
                 if inflow == 0:
-                    inflow_dist.append(np.asarray([0]*RUNS))
+                    inflow_rows.append(len(distparams))
+                    distparams.append(("triang", 0, 0, 0, 0, 0, float('inf')))
                 
                 # otherwise create a triangular distribution
                 else:    
                     
-                    # load DQIS
-                    dqis = data[0][5:10]
-                    
-                    # calculate CV
-                    CV = 1.5*math.sqrt( math.exp(2.21*(dqis[0]-1)) +
-                                        math.exp(2.21*(dqis[1]-1)) +
-                                        math.exp(2.21*(dqis[2]-1)) +
-                                        math.exp(2.21*(dqis[3]-1)) +
-                                        math.exp(2.21* dqis[4]   ) )/100*2.45
+                    # get CV
+                    CV = inputCV[ind[0]]
                                    
                     # create a triangular distribution
-                    inflow_dist.append(tr.TriangTrunc(inflow,
-                                                      CV,
-                                                      RUNS, 0, float('inf')))
+                    inflow_rows.append(len(distparams))
+                    distparams.append(("triang", inflow, 0, CV, 0, 0, float('inf')))
                 
-            elif len(data) == 2:
+            elif len(ind) == 2:
                 
                 # load inflow
-                inflow = [data[0][4],data[1][4]]
+                inflow = [data.input["value"][ind[0]], data.input["value"][ind[1]]]
                 
                 # if the raw data is 0, include only zeroes
                 if inflow[0] == 0 and inflow[1] == 0:
-                    inflow_dist.append(np.asarray([0]*RUNS))
+                    inflow_rows.append(len(distparams))
+                    distparams.append(("triang", 0, 0, 0, 0, 0, float('inf')))
                 
                 # otherwise create a trapezoidal distribution
                 else:    
                        
-                    # calculate CV
-                    CV = []
-                    
-                    dqis = data[0][5:10]
-                    CV.append(1.5*math.sqrt( math.exp(2.21*(dqis[0]-1)) +
-                              math.exp(2.21*(dqis[1]-1)) +
-                              math.exp(2.21*(dqis[2]-1)) +
-                              math.exp(2.21*(dqis[3]-1)) +
-                              math.exp(2.21* dqis[4]   ) )/100*2.45)
-                      
-                    dqis = data[1][5:10]
-                    CV.append(1.5*math.sqrt( math.exp(2.21*(dqis[0]-1)) +
-                              math.exp(2.21*(dqis[1]-1)) +
-                              math.exp(2.21*(dqis[2]-1)) +
-                              math.exp(2.21*(dqis[3]-1)) +
-                              math.exp(2.21* dqis[4]   ) )/100*2.45)
+                    # get CVs
+                    CV = [inputCV[ind[0]], inputCV[ind[1]]]
                     
                     # create a trapezoidal distribution
-                    inflow_dist.append(tr.TrapezTrunc(inflow[0],
-                                                      inflow[1],
-                                                      CV[0], 
-                                                      CV[1],
-                                                      RUNS, 0, float('inf')))
+                    inflow_rows.append(len(distparams))
+                    distparams.append(("trapez", inflow[0], inflow[1], CV[0], CV[1], 0, float('inf')))
                 
             else:
                 raise Exception('There is an error in the database for compartment "{a}", year "{b}" and material "{c}".'.format(a = compname, b = str(i+startYear), c = mat))
+            
+            distkeys.append(("input", compname, i+startYear))
                 
                 
-        # include inflows in model
-        model.addInflow(cp.ExternalListInflow(comp, [cp.RandomChoiceInflow(inflow_dist[x]) for x in periodRange]))  
+        # include inflows in model once sampled
+        inflowlist.append((comp, inflow_rows))
+    
+    # a missing DQI gives no CV, the distribution cannot be sampled
+    for params, key in zip(distparams, distkeys):
+        if np.isnan(params[3]) or np.isnan(params[4]):
+            if key[0] == "tc":
+                datapoint = 'the TC from "{a}" to "{b}" in year "{c}"'.format(a = key[1], b = key[2], c = key[3])
+            else:
+                datapoint = 'the input into "{a}" in year "{b}"'.format(a = key[1], b = key[2])
+            raise Exception('A DQI is missing in the database for {a} and material "{b}".'.format(a = datapoint, b = mat))
+    
+    
+    ins.end("inputs")
+    
+    ### SAMPLING
+    
+    ins.begin("sampling")
     
+    # draw RUNS values for all distributions of the model at once, one row
+    # of the sample matrix per distribution
+    if mean:
+        print("Calculating the means of "+str(len(distparams))+" distributions...")
+        samples = tr.DistributionMeans(distparams)[:, None]
+    
+    elif bank is not None:
+        print("Sampling "+str(len(distparams))+" distributions from the sample bank...")
+        samples = tr.SampleDistributions(distparams, RUNS, u = bank.uniforms(distkeys, RUNS))
+    
+    else:
+        # rows of the distributions of each transfer and inflow, each sampled
+        # from its own stream (see IncrementalBuild), from a seed drawn from
+        # the global random state: the samples are the same with or without
+        # the state of the last build
+        groups = [(("tc", compname, destname, mat), TC) for compname, destname, TC, priority in flowlist if isinstance(TC, list)]
+        groups += [(("input", comp.name, mat), inflow_rows) for comp, inflow_rows in inflowlist]
+        seed = int(np.random.randint(2**31-1))
+        
+        if state is None:
+            print("Sampling "+str(len(distparams))+" distributions...")
+            samples = ib.sampleGroups(groups, distparams, RUNS, sampling, seed)
+        else:
+            samples = state.sample(groups, distparams, RUNS, sampling, seed)
+            print("Sampled again "+str(len(state.resampled))+" of "+str(len(groups))+" transfers and inflows")
+    
+    # samples taken in the order of the runs instead of at random
+    ordered = sampling != "random" or bank is not None or resample
+    
+    # one sample matrix for the whole model, drawn again for each chunk
+    if resample:
+        model.sampleMatrix = tr.SampleMatrix(distparams, sampling, samples)
+    
+    def runSample(row, calls = 1):
+        if resample:
+            return tr.MatrixRow(model.sampleMatrix, row, calls)
+        return tr.RunSample(samples[row], calls)
+    
+    # implement transfers
+    for compname, destname, TC, priority in flowlist:
+        
+        if isinstance(TC, list) and mean:
+            # the mean TC of each year
+            CompartmentDict[compname].transfers.append(cp.TimeDependentListTransfer([samples[row, 0] for row in TC],
+                           CompartmentDict[destname],
+                           priority = priority))
+        elif isinstance(TC, list) and ordered:
+            # a TimeDependentDistributionTransfer taking the sampled rows in the order of the runs
+            calls = 2 if type(CompartmentDict[compname]) is cp.Stock else 1
+            distlist = [cp.TransferDistribution(runSample(row, calls), []) for row in TC]
+            CompartmentDict[compname].transfers.append(cp.TimeDependentDistributionTransfer(distlist,
+                           CompartmentDict[destname],
+                           priority = priority))
+            # the transfer takes a first value when created, start again at the first run
+            distlist[0].function.setRun(0)
+        elif isinstance(TC, list):
+            # a TimeDependentDistributionTransfer drawing from the sampled rows
+            distlist = [cp.TransferDistribution(tr.RandomChoice, [samples[row]]) for row in TC]
+            CompartmentDict[compname].transfers.append(cp.TimeDependentDistributionTransfer(distlist,
+                           CompartmentDict[destname],
+                           priority = priority))
+        else:
+            CompartmentDict[compname].transfers.append(cp.ConstTransfer(TC, CompartmentDict[destname], priority = priority))
+    
+    # remove empty compartments and transfers to them from dictionary
+    mg.CleanOutCompartments(CompartmentDict, complist, complog)
+    
+    
+    # include inflows in model
+    for comp, inflow_rows in inflowlist:
+        if mean:
+            model.addInflow(cp.ExternalListInflow(comp, [cp.FixedValueInflow(samples[row, 0]) for row in inflow_rows]))
+        elif ordered:
+            model.addInflow(cp.ExternalListInflow(comp, [cp.StochasticFunctionInflow(runSample(row), []) for row in inflow_rows]))
+        else:
+            model.addInflow(cp.ExternalListInflow(comp, [cp.RandomChoiceInflow(samples[row]) for row in inflow_rows]))
+    
+    
+    ins.end("sampling")
     
     ### LIFETIMES DEFINITION
     
-    # extract list of compartments with input
-    cursor.execute("SELECT * FROM lifetimes")
-    df = cursor.fetchall()
+    ins.begin("lifetimes")
     
     # loop over stocks
     for comp in stocklist:
@@ -465,16 +444,14 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
             continue
     
         # create lifetime vectors
-        lifetimedist = []
-        
-        for i in np.arange(len(df)):
-            if(df[i][1] == comp):
-                lifetimedist.append(df[i][3])
+        lifetimedist = data.lifetimes[comp]
         
         # insert lifetime distribution into compartment object
         CompartmentDict[comp].localRelease = cp.ListRelease(lifetimedist)
     
     
+    ins.end("lifetimes")
+    
     ### IMPLEMENT COMPARTMENTS INTO MODEL
     
     # transform into list for implementing into model
@@ -483,7 +460,6 @@ def setupModel(pathtoDB,modelname,RUNS,mat, startYear, endYear):
     # insert compartments into model                 
     model.setCompartments(CompartmentList)
     
-    # close connection
-    connection.close()
+    ins.end("setupModel")
     
     return model
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests on synthetic databases (see SyntheticDatabase): the fast
+paths give the same results as the implementations they replaced (database
+queries, clean-out loop, dpmfa simulator, export calculation)
+
+"""
+
+# import necessary packages
+import os
+import sys
+import csv
+import math
+import pickle
+import sqlite3
+import subprocess
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dpmfa import simulator as sc
+import SyntheticDatabase as sd
+import setup_model_new as su
+import ModelGraph as mg
+import MassBalance as mb
+import ChunkedSimulation as cs
+import ModelCache as mc
+import Statistics as st
+import Reports as rp
+from DatabaseLoader import ModelDatabase
+
+YEARS = (1950, 1965)
+PERIODS = YEARS[1]-YEARS[0]+1
+
+
+@pytest.fixture(scope = "module")
+def database(tmp_path_factory):
+    return sd.writeDatabase(str(tmp_path_factory.mktemp("db") / "synthetic.db"), compartments = 14,
+                            years = YEARS, materials = ("LDPE", "PP"), seed = 1)
+
+def flatten(rows):
+    return [item for sublist in rows for item in sublist]
+
+def assertSameSeries(a, b, exact = True):
+    assert [s[:3] for s in a] == [s[:3] for s in b]
+    for x, y in zip(a, b):
+        if exact:
+            assert np.array_equal(np.asarray(x[3]), np.asarray(y[3])), x[:3]
+        else:
+            assert np.allclose(np.asarray(x[3]), np.asarray(y[3]), rtol = 1e-9, atol = 1e-9), x[:3]
+
+
+### DATABASE LOADER
+
+def test_loader_matches_queries(database):
+    """
+    ModelDatabase holds the rows of the queries of the former setupModel
+    """
+    connection = sqlite3.connect(database)
+    cursor = connection.cursor()
+
+    for mat in ("LDPE", "PP"):
+        data = ModelDatabase(database, mat)
+
+        assert data.years_input == flatten(cursor.execute("SELECT DISTINCT year FROM input").fetchall())
+        assert data.years_tc == flatten(cursor.execute("SELECT DISTINCT year FROM transfercoefficients").fetchall())
+        assert data.outflowlist == flatten(cursor.execute("SELECT DISTINCT comp1 FROM transfercoefficients").fetchall())
+        assert data.complist == cursor.execute("SELECT DISTINCT * FROM compartments").fetchall()
+        assert data.stocklist == flatten(cursor.execute("SELECT DISTINCT comp FROM lifetimes").fetchall())
+
+        lifetimes = cursor.execute("SELECT * FROM lifetimes").fetchall()
+        for comp in data.stocklist:
+            assert data.lifetimes[comp] == [r[3] for r in lifetimes if r[1] == comp]
+
+        for comp in data.outflowlist:
+            destlist = flatten(cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1 = ? AND mat = ?)",
+                                              (comp, mat)).fetchall())
+            assert data.getDestinations(comp) == destlist
+
+            for dest in destlist:
+                df = cursor.execute("SELECT * FROM transfercoefficients WHERE (comp1 = ? AND comp2 = ? AND mat = ?)",
+                                    (comp, dest, mat)).fetchall()
+                rows = data.tcrows[(comp, dest)]
+                assert list(data.tc["year"][rows]) == [r[3] for r in df]
+                assert list(data.tc["value"][rows]) == [r[5] for r in df]
+                assert list(data.tc["priority"][rows]) == [r[6] for r in df]
+                assert data.tc["dqis"][rows].tolist() == [list(r[7:12]) for r in df]
+                assert list(data.tc["source"][rows]) == [r[12] for r in df]
+
+        for comp in flatten(cursor.execute("SELECT DISTINCT comp FROM input").fetchall()):
+            assert list(data.getInputValues(comp)) == flatten(cursor.execute("SELECT value FROM input WHERE comp = ? AND mat = ?",
+                                                                             (comp, mat)).fetchall())
+            for year in range(YEARS[0], YEARS[1]+1):
+                df = cursor.execute("SELECT * FROM input WHERE comp = ? AND year = ? AND mat = ?", (comp, year, mat)).fetchall()
+                rows = data.inputindex.get((comp, year), [])
+                assert list(data.input["value"][rows]) == [r[4] for r in df]
+                assert data.input["dqis"][rows].tolist() == [list(r[5:10]) for r in df]
+
+    connection.close()
+
+
+### CLEAN-OUT
+
+def baselineReachable(pathtoDB, mat):
+    """
+    compartments receiving mass, as determined by the query loop of the
+    former setupModel
+    """
+    connection = sqlite3.connect(pathtoDB)
+    cursor = connection.cursor()
+
+    complist = cursor.execute("SELECT DISTINCT * FROM compartments").fetchall()
+    inputlist = flatten(cursor.execute("SELECT DISTINCT comp FROM input WHERE mat = ? AND NOT value = 0", (mat,)).fetchall())
+
+    complog = {c: False for c in [l[1] for l in complist]}
+
+    def destinations(comp):
+        return flatten(cursor.execute("SELECT DISTINCT comp2 FROM transfercoefficients WHERE (comp1 = ? AND mat = ? AND NOT value == 0)",
+                                      (comp, mat)).fetchall())
+
+    for comp in inputlist:
+
+        data = flatten(cursor.execute("SELECT value FROM input WHERE comp = ? AND mat = ?", (comp, mat)).fetchall())
+        if not any(x != 0 for x in data):
+            continue
+
+        complog[comp] = True
+        companalyzed = []
+        comptoanalyze = [comp]
+
+        while len(comptoanalyze) != 0:
+            for startcomp in comptoanalyze:
+                dest = destinations(startcomp)
+                companalyzed.append(startcomp)
+                if len(dest) == 0:
+                    continue
+
+                for endcomp in dest:
+                    if endcomp in companalyzed:
+                        continue
+
+                    data = flatten(cursor.execute("SELECT value FROM transfercoefficients WHERE (comp1 = ? AND comp2 = ? AND mat = ?)",
+                                                  (startcomp, endcomp, mat)).fetchall())
+                    if any(x != 0 for x in data):
+                        complog[endcomp] = True
+                        otherdest = destinations(endcomp)
+                        for d in otherdest:
+                            complog[d] = True
+                        comptoanalyze = comptoanalyze + otherdest
+
+                    comptoanalyze = list(set(x for x in comptoanalyze if x != endcomp))
+
+                companalyzed = list(set(companalyzed + dest))
+
+            comptoanalyze = [x for x in comptoanalyze if not x in companalyzed]
+
+    connection.close()
+
+    return complog
+
+@pytest.mark.parametrize("seed", range(4))
+def test_reachable_matches_loop(tmp_path, seed):
+    """
+    ModelGraph.ReachableCompartments marks the same compartments as the former
+    clean-out loop, with some flows set to zero
+    """
+    path = sd.writeDatabase(str(tmp_path / "synthetic.db"), compartments = 14, years = YEARS, seed = seed)
+
+    # zero TCs for some flows, so that parts of the model become unreachable
+    rng = np.random.default_rng(seed)
+    connection = sqlite3.connect(path)
+    pairs = connection.execute("SELECT DISTINCT comp1, comp2 FROM transfercoefficients WHERE priority = 2").fetchall()
+    for k in rng.choice(len(pairs), size = len(pairs)//3, replace = False):
+        connection.execute("UPDATE transfercoefficients SET value = 0 WHERE comp1 = ? AND comp2 = ?", pairs[k])
+    connection.execute("UPDATE input SET value = 0 WHERE comp = ?", (sd.CASESTUDY_FLOWS[0],))
+    connection.commit()
+    connection.close()
+
+    complog = mg.ReachableCompartments(ModelDatabase(path, "LDPE"))
+    baseline = baselineReachable(path, "LDPE")
+
+    assert {c: complog[c] for c in baseline} == baseline
+    assert not all(baseline.values())
+
+
+### MASS BALANCE
+
+@pytest.mark.parametrize("mean", [True, False])
+def test_deterministic_simulator(database, mean):
+    """
+    MassBalance.DeterministicSimulator gives the records of the dpmfa
+    simulator with one run
+    """
+    np.random.seed(3)
+    modelpickle = pickle.dumps(su.setupModel(database, "m", 1 if mean else 20, "LDPE", YEARS[0], YEARS[1], mean = mean))
+
+    simulator = sc.Simulator(1, PERIODS, 2250, True, True)
+    simulator.setModel(pickle.loads(modelpickle))
+    simulator.runSimulation()
+
+    deterministic = mb.DeterministicSimulator(PERIODS, True, True, 2250)
+    deterministic.setModel(pickle.loads(modelpickle))
+    deterministic.runSimulation()
+
+    assertSameSeries(st.collectSeries(simulator), st.collectSeries(deterministic), exact = False)
+
+
+### MODEL CACHE
+
+@pytest.mark.parametrize("sampling", ["random", "lhs"])
+def test_cached_build_matches_plain_build(database, tmp_path, sampling):
+    """
+    a model built through the cache (and rebuilt after a change of the
+    database) has the samples of a model built without cache
+    """
+    def simulate(model):
+        simulator = sc.Simulator(20, PERIODS, 7, True, True)
+        simulator.setModel(model)
+        simulator.runSimulation()
+        return st.collectSeries(simulator)
+
+    path = str(tmp_path / "synthetic.db")
+    with open(database, "rb") as f, open(path, "wb") as g:
+        g.write(f.read())
+
+    cache = mc.ModelCache(str(tmp_path / "cache"))
+    mc.cachedSetupModel(cache, path, "m", 20, "LDPE", YEARS[0], YEARS[1], 11, sampling)
+
+    # change one TC, only its transfer is sampled again
+    connection = sqlite3.connect(path)
+    connection.execute("""UPDATE transfercoefficients SET value = 0.2 WHERE id = (SELECT MIN(id) FROM transfercoefficients
+                          WHERE mat = 'LDPE' AND priority = 2)""")
+    connection.commit()
+    connection.close()
+
+    cached = mc.cachedSetupModel(cache, path, "m", 20, "LDPE", YEARS[0], YEARS[1], 11, sampling)
+
+    np.random.seed(11)
+    plain = su.setupModel(path, "m", 20, "LDPE", YEARS[0], YEARS[1], sampling = sampling)
+
+    assertSameSeries(simulate(cached), simulate(plain))
+
+
+### CHUNKED SIMULATION
+
+def test_chunks_independent_of_processes(database):
+    """
+    the runs of a chunked simulation only depend on the seed and the number
+    of chunks
+    """
+    np.random.seed(5)
+    model = su.setupModel(database, "m", 60, "LDPE", YEARS[0], YEARS[1])
+
+    serial = cs.runChunkedSimulation(model, 60, PERIODS, 7, 3, processes = 1)
+    parallel = cs.runChunkedSimulation(model, 60, PERIODS, 7, 3, processes = 2)
+
+    assertSameSeries(st.collectSeries(serial), st.collectSeries(parallel))
+
+def test_adaptive_records_independent_of_processes(database):
+    """
+    the records of an adaptive simulation, grown with the batches, only depend
+    on the seed and the batch size
+    """
+    np.random.seed(5)
+    model = su.setupModel(database, "m", 60, "LDPE", YEARS[0], YEARS[1])
+
+    serial = cs.runAdaptiveSimulation(model, PERIODS, 7, 7, 0, 60, processes = 1, keepRecords = True)
+    series = st.collectSeries(serial[1])
+    parallel = cs.runAdaptiveSimulation(model, PERIODS, 7, 7, 0, 60, processes = 2, keepRecords = True)
+
+    assert serial[2]["runs"] == parallel[1].numRuns == 56
+    assertSameSeries(series, st.collectSeries(parallel[1]))
+
+@pytest.mark.parametrize("sampling", ["lhs", "sobol"])
+def test_ordered_chunks_match_single_run(database, sampling):
+    """
+    with samples taken in the order of the runs, a chunked simulation gives
+    the runs of a single simulation
+    """
+    np.random.seed(5)
+    modelpickle = pickle.dumps(su.setupModel(database, "m", 64, "LDPE", YEARS[0], YEARS[1], sampling = sampling))
+
+    simulator = sc.Simulator(64, PERIODS, 7, True, True)
+    simulator.setModel(pickle.loads(modelpickle))
+    simulator.runSimulation()
+
+    chunked = cs.runChunkedSimulation(pickle.loads(modelpickle), 64, PERIODS, 7, 4, processes = 1)
+
+    assertSameSeries(st.collectSeries(simulator), st.collectSeries(chunked))
+
+
+### REPORTS
+
+def test_parallel_reports_match_serial(tmp_path):
+    """
+    the documents written by blocks in processes and merged have the pages of
+    the documents written without separate process
+    """
+    pypdf = pytest.importorskip("pypdf")
+
+    rng = np.random.default_rng(0)
+    series = [(kind, "Compartment "+str(i), "Sink" if kind == "outflow" else None, rng.random((20, PERIODS)))
+              for kind, n in (("inflow", 5), ("outflow", 11), ("stock", 2)) for i in range(n)]
+    stats = st.summarize(series, years = np.arange(YEARS[0], YEARS[1]+1))
+
+    os.makedirs(str(tmp_path / "serial"))
+    os.makedirs(str(tmp_path / "parallel"))
+    serial = rp.writeReports(stats, str(tmp_path / "serial"), "LDPE", 1)
+    parallel = rp.writeReports(stats, str(tmp_path / "parallel"), "LDPE", 2)
+
+    for a, b in zip(serial, parallel):
+        assert os.path.exists(a) == os.path.exists(b)
+        if os.path.exists(a):
+            assert ([page.extract_text() for page in pypdf.PdfReader(a).pages] ==
+                    [page.extract_text() for page in pypdf.PdfReader(b).pages])
+
+    assert sorted(os.listdir(str(tmp_path / "parallel"))) == sorted(os.listdir(str(tmp_path / "serial")))
+
+
+### EXPORT CALCULATION
+
+def number(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return x
+
+def test_export_matches_reference(tmp_path):
+    """
+    Export_Calculation.py gives the export TCs and inputs of the former
+    implementation. reference/export_LDPE.csv was written with it on the
+    database below (the former version stored the TCs as text)
+    """
+    os.makedirs(str(tmp_path / "data_casestudy"))
+    path = sd.writeDatabase(str(tmp_path / "data_casestudy" / "DPMFA_Plastic_CH_inclExport.db"), years = YEARS,
+                            double = 0, trade = True, seed = 0)
+
+    # the script works on the database of the working directory
+    subprocess.run([sys.executable, os.path.join(ROOT, "Export_Calculation.py")], cwd = str(tmp_path), check = True,
+                   stdout = subprocess.DEVNULL)
+
+    connection = sqlite3.connect(path)
+    rows = [("transfercoefficients",)+r for r in connection.execute("""SELECT comp1, year, value, priority, source FROM transfercoefficients
+                                                                      WHERE comp2 = 'Export' AND mat = 'LDPE' ORDER BY comp1, year, id""")]
+    rows += [("input",)+r for r in connection.execute("SELECT comp, year, value, NULL, source FROM input WHERE mat = 'LDPE' ORDER BY comp, year, id")]
+    connection.close()
+
+    with open(os.path.join(ROOT, "tests", "reference", "export_LDPE.csv"), newline = "") as f:
+        reference = [(r["table"], r["comp"], int(r["year"]), float(r["value"]), int(r["priority"]) if r["priority"] else None, r["source"])
+                     for r in csv.DictReader(f)]
+
+    assert len(rows) == len(reference)
+    for row, ref in zip(rows, reference):
+        assert row[:3] == ref[:3] and row[4:] == ref[4:], row
+        assert math.isclose(number(row[3]), ref[3], rel_tol = 1e-9, abs_tol = 1e-12), row